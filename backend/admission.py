@@ -0,0 +1,110 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any
+
+from config import get_settings
+from publisher import main_queue_state
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+PRIORITIES = ("high", "normal", "low")
+
+
+@dataclass
+class _AdmissionState:
+    queue_depth: int | None = None
+    consumers: int | None = None
+    polled_at: float | None = None
+    last_error: str | None = None
+    admitted: dict[str, int] = field(default_factory=lambda: dict.fromkeys(PRIORITIES, 0))
+    rejected: dict[str, int] = field(default_factory=lambda: dict.fromkeys(PRIORITIES, 0))
+
+
+_state = _AdmissionState()
+_monitor_task: asyncio.Task | None = None
+
+
+def _depth_is_fresh() -> bool:
+    if _state.polled_at is None or _state.queue_depth is None:
+        return False
+    # A stale reading must not keep rejecting traffic after the poller stopped working.
+    max_age = 5 * settings.ADMISSION_POLL_INTERVAL_MS / 1000.0
+    return time.monotonic() - _state.polled_at <= max_age
+
+
+def _limit_for(priority: str) -> int | None:
+    if priority == "low":
+        return settings.ADMISSION_LOW_PRIORITY_MAX_DEPTH
+    if priority == "normal":
+        return settings.ADMISSION_MAX_DEPTH
+    return None
+
+
+def admit(priority: str, count: int = 1) -> bool:
+    allowed = True
+    if settings.ADMISSION_ENABLED and _depth_is_fresh():
+        limit = _limit_for(priority)
+        allowed = limit is None or _state.queue_depth < limit
+
+    if allowed:
+        _state.admitted[priority] = _state.admitted.get(priority, 0) + count
+    else:
+        _state.rejected[priority] = _state.rejected.get(priority, 0) + count
+    return allowed
+
+
+def retry_after_seconds() -> int:
+    return max(1, settings.ADMISSION_RETRY_AFTER_SECONDS)
+
+
+async def _run_monitor(interval_seconds: float) -> None:
+    while True:
+        try:
+            depth, consumers = await main_queue_state()
+            _state.queue_depth = depth
+            _state.consumers = consumers
+            _state.polled_at = time.monotonic()
+            _state.last_error = None
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            _state.last_error = str(e)
+            logger.warning("Queue depth poll failed: %s", e)
+        await asyncio.sleep(interval_seconds)
+
+
+async def start_admission_monitor() -> None:
+    global _monitor_task
+    if not settings.ADMISSION_ENABLED:
+        return
+    interval_seconds = max(0.05, settings.ADMISSION_POLL_INTERVAL_MS / 1000.0)
+    _monitor_task = asyncio.create_task(_run_monitor(interval_seconds))
+
+
+async def stop_admission_monitor() -> None:
+    global _monitor_task
+    if _monitor_task is None:
+        return
+    _monitor_task.cancel()
+    await asyncio.gather(_monitor_task, return_exceptions=True)
+    _monitor_task = None
+
+
+def admission_metrics() -> dict[str, Any]:
+    return {
+        "enabled": settings.ADMISSION_ENABLED,
+        "queue_depth": _state.queue_depth,
+        "consumers": _state.consumers,
+        "depth_fresh": _depth_is_fresh(),
+        "last_poll_age_seconds": round(time.monotonic() - _state.polled_at, 3) if _state.polled_at else None,
+        "last_error": _state.last_error,
+        "thresholds": {
+            "low_priority_max_depth": settings.ADMISSION_LOW_PRIORITY_MAX_DEPTH,
+            "max_depth": settings.ADMISSION_MAX_DEPTH,
+        },
+        "admitted": dict(_state.admitted),
+        "rejected": dict(_state.rejected),
+    }
@@ -0,0 +1,146 @@
+"""Add incrementally maintained stats counters
+
+Revision ID: 005
+Revises: 004
+Create Date: 2026-10-16
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "005"
+down_revision: Union[str, None] = "004"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Counters are spread over 16 shards keyed by backend pid so concurrent writers
+# rarely contend on the same row; readers sum the shards. Shard -1 is reserved
+# for drift corrections written by the backend reconciler.
+_FUNCTIONS = """
+CREATE OR REPLACE FUNCTION stats_counters_add_statuses(deltas jsonb) RETURNS void AS $$
+BEGIN
+    INSERT INTO stats_counters (name, shard, value)
+    SELECT 'status:' || d.key, pg_backend_pid() % 16, d.value::bigint
+    FROM jsonb_each_text(deltas) AS d
+    WHERE d.value::bigint <> 0
+    ORDER BY d.key
+    ON CONFLICT (name, shard) DO UPDATE SET value = stats_counters.value + EXCLUDED.value;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION sms_events_stats_on_insert() RETURNS trigger AS $$
+BEGIN
+    PERFORM stats_counters_add_statuses(
+        (SELECT COALESCE(jsonb_object_agg(status, cnt), '{}'::jsonb)
+         FROM (SELECT COALESCE(status, '') AS status, COUNT(*) AS cnt FROM new_rows GROUP BY 1) s)
+    );
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION sms_events_stats_on_update() RETURNS trigger AS $$
+BEGIN
+    PERFORM stats_counters_add_statuses(
+        (SELECT COALESCE(jsonb_object_agg(status, cnt), '{}'::jsonb)
+         FROM (
+             SELECT status, SUM(delta) AS cnt
+             FROM (
+                 SELECT COALESCE(o.status, '') AS status, -1 AS delta
+                 FROM old_rows o JOIN new_rows n ON n.id = o.id
+                 WHERE o.status IS DISTINCT FROM n.status
+                 UNION ALL
+                 SELECT COALESCE(n.status, ''), 1
+                 FROM old_rows o JOIN new_rows n ON n.id = o.id
+                 WHERE o.status IS DISTINCT FROM n.status
+             ) changes
+             GROUP BY status
+         ) s)
+    );
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION sms_events_stats_on_delete() RETURNS trigger AS $$
+BEGIN
+    PERFORM stats_counters_add_statuses(
+        (SELECT COALESCE(jsonb_object_agg(status, -cnt), '{}'::jsonb)
+         FROM (SELECT COALESCE(status, '') AS status, COUNT(*) AS cnt FROM old_rows GROUP BY 1) s)
+    );
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION ai_calls_stats_on_insert() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO stats_counters (name, shard, value)
+    SELECT t.name, pg_backend_pid() % 16, t.value
+    FROM (
+        SELECT 'ai:calls' AS name, COUNT(*)::bigint AS value FROM new_rows
+        UNION ALL
+        SELECT 'ai:input_tokens', COALESCE(SUM(input_tokens), 0)::bigint FROM new_rows
+        UNION ALL
+        SELECT 'ai:output_tokens', COALESCE(SUM(output_tokens), 0)::bigint FROM new_rows
+    ) t
+    WHERE t.value <> 0
+    ORDER BY t.name
+    ON CONFLICT (name, shard) DO UPDATE SET value = stats_counters.value + EXCLUDED.value;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER sms_events_stats_insert AFTER INSERT ON sms_events
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION sms_events_stats_on_insert();
+
+CREATE TRIGGER sms_events_stats_update AFTER UPDATE ON sms_events
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION sms_events_stats_on_update();
+
+CREATE TRIGGER sms_events_stats_delete AFTER DELETE ON sms_events
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION sms_events_stats_on_delete();
+
+CREATE TRIGGER ai_calls_stats_insert AFTER INSERT ON ai_calls
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION ai_calls_stats_on_insert();
+"""
+
+_BACKFILL = """
+INSERT INTO stats_counters (name, shard, value)
+SELECT 'status:' || COALESCE(status, ''), -1, COUNT(*) FROM sms_events GROUP BY 1
+UNION ALL
+SELECT 'ai:calls', -1, COUNT(*) FROM ai_calls
+UNION ALL
+SELECT 'ai:input_tokens', -1, COALESCE(SUM(input_tokens), 0) FROM ai_calls
+UNION ALL
+SELECT 'ai:output_tokens', -1, COALESCE(SUM(output_tokens), 0) FROM ai_calls
+"""
+
+
+def upgrade() -> None:
+    op.create_table(
+        "stats_counters",
+        sa.Column("name", sa.String(64), nullable=False),
+        sa.Column("shard", sa.SmallInteger(), nullable=False),
+        sa.Column("value", sa.BigInteger(), server_default=sa.text("0"), nullable=False),
+        sa.PrimaryKeyConstraint("name", "shard"),
+    )
+    op.execute(_FUNCTIONS)
+    op.execute(_BACKFILL)
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER IF EXISTS ai_calls_stats_insert ON ai_calls")
+    op.execute("DROP TRIGGER IF EXISTS sms_events_stats_delete ON sms_events")
+    op.execute("DROP TRIGGER IF EXISTS sms_events_stats_update ON sms_events")
+    op.execute("DROP TRIGGER IF EXISTS sms_events_stats_insert ON sms_events")
+    op.execute("DROP FUNCTION IF EXISTS ai_calls_stats_on_insert()")
+    op.execute("DROP FUNCTION IF EXISTS sms_events_stats_on_delete()")
+    op.execute("DROP FUNCTION IF EXISTS sms_events_stats_on_update()")
+    op.execute("DROP FUNCTION IF EXISTS sms_events_stats_on_insert()")
+    op.execute("DROP FUNCTION IF EXISTS stats_counters_add_statuses(jsonb)")
+    op.drop_table("stats_counters")
@@ -0,0 +1,156 @@
+"""Add hourly rollups for SMS events and AI calls
+
+Revision ID: 006
+Revises: 005
+Create Date: 2026-10-16
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "006"
+down_revision: Union[str, None] = "005"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Events are bucketed by the hour they were created in, so a status or provider
+# status change arriving later moves the row between keys of its original bucket.
+# provider_status 0 means "not reported yet". Rows are sharded like stats_counters.
+_EVENT_KEY = """
+    date_trunc('hour', COALESCE({r}.created_at, NOW()), 'UTC') AS bucket,
+    COALESCE({r}.status, '') AS status,
+    COALESCE({r}.provider_status, 0) AS provider_status
+"""
+
+_UPSERT_SMS = """
+    INSERT INTO sms_hourly_rollup (bucket, status, provider_status, shard, messages, segments)
+    SELECT bucket, status, provider_status, pg_backend_pid() % 16, SUM(messages), SUM(segments)
+    FROM ({deltas}) d
+    GROUP BY bucket, status, provider_status
+    HAVING SUM(messages) <> 0 OR SUM(segments) <> 0
+    ORDER BY bucket, status, provider_status
+    ON CONFLICT (bucket, status, provider_status, shard) DO UPDATE
+    SET messages = sms_hourly_rollup.messages + EXCLUDED.messages,
+        segments = sms_hourly_rollup.segments + EXCLUDED.segments;
+"""
+
+_CHANGED = """
+    FROM old_rows o JOIN new_rows n ON n.id = o.id
+    WHERE (o.status, o.provider_status, o.segment_count, o.created_at)
+          IS DISTINCT FROM (n.status, n.provider_status, n.segment_count, n.created_at)
+"""
+
+_FUNCTIONS = f"""
+CREATE OR REPLACE FUNCTION sms_events_rollup_on_insert() RETURNS trigger AS $$
+BEGIN
+    {_UPSERT_SMS.format(deltas=f"SELECT {_EVENT_KEY.format(r='n')}, 1 AS messages, COALESCE(n.segment_count, 0) AS segments FROM new_rows n")}
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION sms_events_rollup_on_update() RETURNS trigger AS $$
+BEGIN
+    {_UPSERT_SMS.format(deltas=f'''
+        SELECT {_EVENT_KEY.format(r='o')}, -1 AS messages, -COALESCE(o.segment_count, 0) AS segments {_CHANGED}
+        UNION ALL
+        SELECT {_EVENT_KEY.format(r='n')}, 1, COALESCE(n.segment_count, 0) {_CHANGED}
+    ''')}
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION sms_events_rollup_on_delete() RETURNS trigger AS $$
+BEGIN
+    {_UPSERT_SMS.format(deltas=f"SELECT {_EVENT_KEY.format(r='o')}, -1 AS messages, -COALESCE(o.segment_count, 0) AS segments FROM old_rows o")}
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION ai_calls_rollup_on_insert() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO ai_hourly_rollup (bucket, model, shard, calls, input_tokens, output_tokens)
+    SELECT date_trunc('hour', COALESCE(created_at, NOW()), 'UTC'), model, pg_backend_pid() % 16,
+           COUNT(*), COALESCE(SUM(input_tokens), 0), COALESCE(SUM(output_tokens), 0)
+    FROM new_rows
+    GROUP BY 1, 2
+    ORDER BY 1, 2
+    ON CONFLICT (bucket, model, shard) DO UPDATE
+    SET calls = ai_hourly_rollup.calls + EXCLUDED.calls,
+        input_tokens = ai_hourly_rollup.input_tokens + EXCLUDED.input_tokens,
+        output_tokens = ai_hourly_rollup.output_tokens + EXCLUDED.output_tokens;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER sms_events_rollup_insert AFTER INSERT ON sms_events
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION sms_events_rollup_on_insert();
+
+CREATE TRIGGER sms_events_rollup_update AFTER UPDATE ON sms_events
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION sms_events_rollup_on_update();
+
+CREATE TRIGGER sms_events_rollup_delete AFTER DELETE ON sms_events
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION sms_events_rollup_on_delete();
+
+CREATE TRIGGER ai_calls_rollup_insert AFTER INSERT ON ai_calls
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION ai_calls_rollup_on_insert();
+"""
+
+_BACKFILL = """
+INSERT INTO sms_hourly_rollup (bucket, status, provider_status, shard, messages, segments)
+SELECT date_trunc('hour', COALESCE(created_at, NOW()), 'UTC'), COALESCE(status, ''), COALESCE(provider_status, 0), -1,
+       COUNT(*), COALESCE(SUM(segment_count), 0)
+FROM sms_events
+GROUP BY 1, 2, 3;
+
+INSERT INTO ai_hourly_rollup (bucket, model, shard, calls, input_tokens, output_tokens)
+SELECT date_trunc('hour', COALESCE(created_at, NOW()), 'UTC'), model, -1,
+       COUNT(*), COALESCE(SUM(input_tokens), 0), COALESCE(SUM(output_tokens), 0)
+FROM ai_calls
+GROUP BY 1, 2;
+"""
+
+
+def upgrade() -> None:
+    op.create_table(
+        "sms_hourly_rollup",
+        sa.Column("bucket", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("status", sa.String(32), nullable=False),
+        sa.Column("provider_status", sa.Integer(), nullable=False),
+        sa.Column("shard", sa.SmallInteger(), nullable=False),
+        sa.Column("messages", sa.BigInteger(), server_default=sa.text("0"), nullable=False),
+        sa.Column("segments", sa.BigInteger(), server_default=sa.text("0"), nullable=False),
+        sa.PrimaryKeyConstraint("bucket", "status", "provider_status", "shard"),
+    )
+    op.create_table(
+        "ai_hourly_rollup",
+        sa.Column("bucket", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("model", sa.String(128), nullable=False),
+        sa.Column("shard", sa.SmallInteger(), nullable=False),
+        sa.Column("calls", sa.BigInteger(), server_default=sa.text("0"), nullable=False),
+        sa.Column("input_tokens", sa.BigInteger(), server_default=sa.text("0"), nullable=False),
+        sa.Column("output_tokens", sa.BigInteger(), server_default=sa.text("0"), nullable=False),
+        sa.PrimaryKeyConstraint("bucket", "model", "shard"),
+    )
+    op.execute(_FUNCTIONS)
+    op.execute(_BACKFILL)
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER IF EXISTS ai_calls_rollup_insert ON ai_calls")
+    op.execute("DROP TRIGGER IF EXISTS sms_events_rollup_delete ON sms_events")
+    op.execute("DROP TRIGGER IF EXISTS sms_events_rollup_update ON sms_events")
+    op.execute("DROP TRIGGER IF EXISTS sms_events_rollup_insert ON sms_events")
+    op.execute("DROP FUNCTION IF EXISTS ai_calls_rollup_on_insert()")
+    op.execute("DROP FUNCTION IF EXISTS sms_events_rollup_on_delete()")
+    op.execute("DROP FUNCTION IF EXISTS sms_events_rollup_on_update()")
+    op.execute("DROP FUNCTION IF EXISTS sms_events_rollup_on_insert()")
+    op.drop_table("ai_hourly_rollup")
+    op.drop_table("sms_hourly_rollup")
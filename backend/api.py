@@ -1,25 +1,40 @@
-import asyncio
 import json
 import os
 import random
-from datetime import datetime
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable
 from zoneinfo import ZoneInfo
 
 import redis
-from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy import text
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response
+from pydantic import BaseModel, ValidationError
+from sqlalchemy import insert, text
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from admission import PRIORITIES, admission_metrics, admit, retry_after_seconds
+from cache import TTLCache
 from config import get_settings
-from db import get_db
-from models import SmsEvent, SmsStatus
-from predictor import predict_sms_delivery_probability
-from publisher import _publish_to_main_queue
-from schemas import DeliveryPredictionResponse, SmsRequest, normalize_phone
+from db import get_db, pool_metrics
+from idempotency import IdempotencyKeyReused, IdempotencyRequestInProgress, run_idempotent
+from models import SmsEvent, SmsOutbox, SmsStatus
+from outbox import main_queue_payload, notify_outbox
+from predictor import predict_sms_delivery_probability, predictor_http_metrics
+from schemas import (
+    DeliveryPredictionResponse,
+    SmsBatchRequest,
+    SmsRequest,
+    SmsStatusBatchRequest,
+    count_segments,
+    normalize_phone,
+)
+from stats import TIMESERIES_GRANULARITIES, read_counters, read_timeseries
+from uploads import UPLOAD_FORMATS, UploadLineTooLong, get_upload_progress, load_upload
 
 router = APIRouter()
 settings = get_settings()
 _redis_client = None
+_final_status_cache = TTLCache(settings.STATUS_CACHE_MAX_ENTRIES, settings.STATUS_CACHE_TTL_SECONDS)
 
 _PROVIDER_STATUS_TEXT = {
     1: "Queued for sending",
@@ -34,6 +49,7 @@ _PROVIDER_STATUS_TEXT = {
     100: "Invalid message ID",
 }
 _FINAL_PROVIDER_CODES = {6, 10, 11, 13, 14, 100}
+_TERMINAL_PIPELINE_STATUSES = {SmsStatus.SENT.value, SmsStatus.BLOCKED.value, SmsStatus.FAILED.value}
 _NEXT_PROVIDER_STATUS_POOL = (
     10, 10, 10, 10, 10, 10, 10, 10, 10, 10, 10, 10, 10, 10,
     11, 11, 11, 11,
@@ -41,6 +57,13 @@ _NEXT_PROVIDER_STATUS_POOL = (
     13,
     14,
 )
+_UPLOAD_CONTENT_TYPES = {
+    "text/csv": "csv",
+    "application/csv": "csv",
+    "application/x-ndjson": "ndjson",
+    "application/ndjson": "ndjson",
+    "application/jsonl": "ndjson",
+}
 
 
 def _get_redis():
@@ -61,22 +84,19 @@ def _ai_daily_key() -> str:
     return f"ai_guard_calls:{day}"
 
 
+def _as_utc(value: datetime) -> datetime:
+    if value.tzinfo is None:
+        return value.replace(tzinfo=ZoneInfo("UTC"))
+    return value.astimezone(ZoneInfo("UTC"))
+
+
 def _pick_next_status_from_queue() -> int:
     return random.choice(_NEXT_PROVIDER_STATUS_POOL)
 
 
 @router.get("/stats")
 async def get_stats(db: AsyncSession = Depends(get_db)):
-    res = await db.execute(text("SELECT status, COUNT(*)::int AS cnt FROM sms_events GROUP BY status"))
-    rows = res.mappings().all()
-    by_status = {r["status"]: r["cnt"] for r in rows}
-
-    res = await db.execute(
-        text(
-            "SELECT COUNT(*)::int AS cnt, COALESCE(SUM(input_tokens), 0)::bigint AS in_tok, COALESCE(SUM(output_tokens), 0)::bigint AS out_tok FROM ai_calls"
-        )
-    )
-    ai = res.mappings().first() or {"cnt": 0, "in_tok": 0, "out_tok": 0}
+    by_status, ai = await read_counters(db)
 
     ai_daily_limit = int(os.environ.get("AI_DAILY_CALL_LIMIT", "50"))
     ai_today_used = 0
@@ -92,7 +112,7 @@ async def get_stats(db: AsyncSession = Depends(get_db)):
 
     return {
         "by_status": by_status,
-        "ai": dict(ai),
+        "ai": ai,
         "ai_today": {
             "cnt": ai_today_used,
             "limit": ai_daily_limit,
@@ -102,9 +122,68 @@ async def get_stats(db: AsyncSession = Depends(get_db)):
     }
 
 
-@router.post("/sms")
-async def send_sms(request: SmsRequest, db: AsyncSession = Depends(get_db)):
-    segment_count = max(1, (len(request.body) + (settings.MAX_BODY_CHARS - 1)) // settings.MAX_BODY_CHARS)
+@router.get("/stats/timeseries")
+async def get_stats_timeseries(
+    start: datetime | None = Query(None, alias="from", description="Range start (UTC if no offset); defaults to 24h before `to`"),
+    end: datetime | None = Query(None, alias="to", description="Range end, exclusive (UTC if no offset); defaults to now"),
+    granularity: str = Query("hour", description="hour or day"),
+    db: AsyncSession = Depends(get_db),
+):
+    if granularity not in TIMESERIES_GRANULARITIES:
+        raise HTTPException(status_code=422, detail="granularity must be 'hour' or 'day'")
+
+    end = _as_utc(end) if end else datetime.now(tz=ZoneInfo("UTC"))
+    start = _as_utc(start) if start else end - timedelta(hours=24)
+    if start >= end:
+        raise HTTPException(status_code=422, detail="'from' must be before 'to'")
+    if (end - start) / TIMESERIES_GRANULARITIES[granularity] > settings.STATS_TIMESERIES_MAX_BUCKETS:
+        raise HTTPException(status_code=422, detail=f"range exceeds {settings.STATS_TIMESERIES_MAX_BUCKETS} buckets")
+
+    buckets = await read_timeseries(db, start, end, granularity)
+    return {"from": start.isoformat(), "to": end.isoformat(), "granularity": granularity, "buckets": buckets}
+
+
+@router.get("/metrics")
+async def get_metrics():
+    return {
+        "db_pool": pool_metrics(),
+        "status_cache": _final_status_cache.stats(),
+        "admission": admission_metrics(),
+        "predictor_http": predictor_http_metrics(),
+    }
+
+
+async def _idempotent(
+    scope: str,
+    key: str | None,
+    request: BaseModel,
+    response: Response,
+    handler: Callable[[], Awaitable[dict[str, Any]]],
+) -> dict[str, Any]:
+    try:
+        result, replayed = await run_idempotent(scope, key, request.model_dump_json(), handler)
+    except IdempotencyKeyReused as e:
+        raise HTTPException(status_code=422, detail=str(e)) from e
+    except IdempotencyRequestInProgress as e:
+        raise HTTPException(status_code=409, detail=str(e)) from e
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return result
+
+
+def _overloaded() -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail="main queue is overloaded; retry later",
+        headers={"Retry-After": str(retry_after_seconds())},
+    )
+
+
+async def _create_sms(db: AsyncSession, request: SmsRequest) -> dict[str, Any]:
+    if not admit(request.priority):
+        raise _overloaded()
+
+    segment_count = count_segments(request.body, settings.MAX_BODY_CHARS)
 
     event = SmsEvent(
         message_id=None,
@@ -115,22 +194,125 @@ async def send_sms(request: SmsRequest, db: AsyncSession = Depends(get_db)):
         segment_count=segment_count,
     )
     db.add(event)
+    await db.flush()
+
+    payload = main_queue_payload(event.id, request.phone, request.body, segment_count)
+    db.add(SmsOutbox(sms_event_id=event.id, payload=json.dumps(payload)))
     await db.commit()
-    await db.refresh(event)
-
-    payload = {
-        "sms_event_id": event.id,
-        "phone": request.phone,
-        "body": request.body,
-        "retry_count": 0,
-        "segment_count": segment_count,
-        "last_dlr": None,
-    }
-    loop = asyncio.get_event_loop()
-    await loop.run_in_executor(None, lambda: _publish_to_main_queue(json.dumps(payload).encode()))
+    notify_outbox()
     return {"request_id": event.id, "status": "queued"}
 
 
+async def _create_sms_batch(db: AsyncSession, request: SmsBatchRequest) -> dict[str, Any]:
+    results: list[dict[str, Any]] = []
+    valid: list[tuple[int, SmsRequest]] = []
+    shed = 0
+    for index, item in enumerate(request.items):
+        try:
+            sms = SmsRequest.model_validate(item)
+        except ValidationError as e:
+            errors = [
+                {"field": ".".join(str(p) for p in err["loc"]), "message": err["msg"]}
+                for err in e.errors(include_url=False, include_context=False)
+            ]
+            results.append({"index": index, "status": "rejected", "errors": errors})
+            continue
+        if not admit(sms.priority):
+            shed += 1
+            results.append({"index": index, "status": "throttled", "retry_after": retry_after_seconds()})
+            continue
+        valid.append((index, sms))
+        results.append({"index": index, "status": "queued", "request_id": None})
+
+    if shed and not valid:
+        raise _overloaded()
+
+    if valid:
+        rows = [
+            {
+                "message_id": None,
+                "phone": sms.phone,
+                "body": sms.body,
+                "status": SmsStatus.PENDING.value,
+                "retry_count": 0,
+                "segment_count": count_segments(sms.body, settings.MAX_BODY_CHARS),
+            }
+            for _, sms in valid
+        ]
+        res = await db.execute(insert(SmsEvent).returning(SmsEvent.id, sort_by_parameter_order=True), rows)
+        event_ids = list(res.scalars().all())
+
+        outbox_rows: list[dict[str, Any]] = []
+        for (index, sms), row, event_id in zip(valid, rows, event_ids):
+            results[index]["request_id"] = event_id
+            payload = main_queue_payload(event_id, sms.phone, sms.body, row["segment_count"])
+            outbox_rows.append({"sms_event_id": event_id, "payload": json.dumps(payload)})
+        await db.execute(insert(SmsOutbox), outbox_rows)
+        await db.commit()
+        notify_outbox()
+
+    return {
+        "accepted": len(valid),
+        "rejected": len(results) - len(valid) - shed,
+        "throttled": shed,
+        "results": results,
+    }
+
+
+@router.post("/sms")
+async def send_sms(
+    request: SmsRequest,
+    response: Response,
+    idempotency_key: str | None = Header(None, alias="Idempotency-Key", max_length=128),
+    db: AsyncSession = Depends(get_db),
+):
+    return await _idempotent("sms", idempotency_key, request, response, lambda: _create_sms(db, request))
+
+
+@router.post("/sms/batch")
+async def send_sms_batch(
+    request: SmsBatchRequest,
+    response: Response,
+    idempotency_key: str | None = Header(None, alias="Idempotency-Key", max_length=128),
+    db: AsyncSession = Depends(get_db),
+):
+    if len(request.items) > settings.SMS_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"batch must contain at most {settings.SMS_BATCH_MAX_ITEMS} items")
+    return await _idempotent("sms_batch", idempotency_key, request, response, lambda: _create_sms_batch(db, request))
+
+
+@router.post("/sms/upload")
+async def upload_sms_campaign(
+    request: Request,
+    fmt: str | None = Query(None, alias="format", description="csv or ndjson; defaults to the Content-Type"),
+    upload_id: str | None = Query(None, min_length=1, max_length=64),
+    priority: str = Query("low", description="high, normal or low; campaign uploads default to low"),
+    db: AsyncSession = Depends(get_db),
+):
+    if priority not in PRIORITIES:
+        raise HTTPException(status_code=422, detail="priority must be one of: high, normal, low")
+    if not admit(priority):
+        raise _overloaded()
+    if fmt is None:
+        content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+        fmt = _UPLOAD_CONTENT_TYPES.get(content_type)
+    if fmt not in UPLOAD_FORMATS:
+        raise HTTPException(status_code=415, detail="upload must be CSV or NDJSON")
+
+    try:
+        return await load_upload(db, request.stream(), upload_id=upload_id or uuid.uuid4().hex, fmt=fmt)
+    except UploadLineTooLong as e:
+        raise HTTPException(status_code=413, detail=str(e)) from e
+
+
+@router.get("/sms/upload/{upload_id}")
+async def get_sms_upload_progress(upload_id: str):
+    progress = get_upload_progress(upload_id)
+    if progress is None:
+        raise HTTPException(status_code=404, detail="upload_id not found")
+    return progress
+
+
 @router.get("/sms/predict-delivery", response_model=DeliveryPredictionResponse)
 async def predict_delivery(
     phone: str = Query(..., min_length=10, max_length=16, description="Phone number"),
@@ -146,42 +328,94 @@ async def predict_delivery(
     return prediction
 
 
-@router.get("/sms/status")
-async def get_sms_provider_status(message_id: str = Query(..., min_length=1), db: AsyncSession = Depends(get_db)):
+async def _resolve_provider_statuses(db: AsyncSession, message_ids: list[str]) -> dict[str, dict[str, Any]]:
+    resolved: dict[str, dict[str, Any]] = {}
+    missing: list[str] = []
+    for message_id in dict.fromkeys(message_ids):
+        cached = _final_status_cache.get(message_id)
+        if cached is not None:
+            resolved[message_id] = cached
+        else:
+            missing.append(message_id)
+    if not missing:
+        return resolved
+
     res = await db.execute(
         text(
             """
             SELECT id, message_id, status, provider_status
             FROM sms_events
-            WHERE message_id = :message_id
-            LIMIT 1
+            WHERE message_id = ANY(:message_ids)
             """
         ),
-        {"message_id": message_id},
+        {"message_ids": missing},
     )
-    row = res.mappings().first()
-    if not row:
-        raise HTTPException(status_code=404, detail="message_id not found")
+    rows = res.mappings().all()
 
-    current_code = int(row.get("provider_status") or 1)
-    resolved_code = current_code
+    changed_ids: list[int] = []
+    changed_codes: list[int] = []
+    for row in rows:
+        current_code = int(row.get("provider_status") or 1)
+        resolved_code = current_code
+        if current_code == 1:
+            resolved_code = _pick_next_status_from_queue()
+        if resolved_code != current_code:
+            changed_ids.append(row["id"])
+            changed_codes.append(resolved_code)
 
-    if current_code == 1:
-        resolved_code = _pick_next_status_from_queue()
+        resolved[row["message_id"]] = {
+            "message_id": row["message_id"],
+            "provider_status": {
+                "code": resolved_code,
+                "text": _PROVIDER_STATUS_TEXT.get(resolved_code, "Unknown status"),
+                "final": resolved_code in _FINAL_PROVIDER_CODES,
+            },
+            "pipeline_status": row["status"],
+        }
 
-    if resolved_code != current_code:
+    if changed_ids:
         await db.execute(
-            text("UPDATE sms_events SET provider_status = :code, updated_at = NOW() WHERE id = :id"),
-            {"code": resolved_code, "id": row["id"]},
+            text(
+                """
+                UPDATE sms_events AS e
+                SET provider_status = v.code, updated_at = NOW()
+                FROM unnest(CAST(:ids AS integer[]), CAST(:codes AS integer[])) AS v(id, code)
+                WHERE e.id = v.id
+                """
+            ),
+            {"ids": changed_ids, "codes": changed_codes},
         )
         await db.commit()
 
-    return {
-        "message_id": message_id,
-        "provider_status": {
-            "code": resolved_code,
-            "text": _PROVIDER_STATUS_TEXT.get(resolved_code, "Unknown status"),
-            "final": resolved_code in _FINAL_PROVIDER_CODES,
-        },
-        "pipeline_status": row["status"],
-    }
+    # Only rows that are done on both sides are served from memory: the worker rewrites
+    # message_id (and the pipeline status) only while a row is PENDING after a TIMEOUT retry,
+    # so a row that is final at the provider and terminal in the pipeline never changes again.
+    for message_id in missing:
+        result = resolved.get(message_id)
+        if result and result["provider_status"]["final"] and result["pipeline_status"] in _TERMINAL_PIPELINE_STATUSES:
+            _final_status_cache.set(message_id, result)
+    return resolved
+
+
+@router.get("/sms/status")
+async def get_sms_provider_status(message_id: str = Query(..., min_length=1), db: AsyncSession = Depends(get_db)):
+    resolved = await _resolve_provider_statuses(db, [message_id])
+    if message_id not in resolved:
+        raise HTTPException(status_code=404, detail="message_id not found")
+    return resolved[message_id]
+
+
+@router.post("/sms/status/batch")
+async def get_sms_provider_status_batch(request: SmsStatusBatchRequest, db: AsyncSession = Depends(get_db)):
+    if len(request.message_ids) > settings.STATUS_BATCH_MAX_IDS:
+        raise HTTPException(status_code=413, detail=f"at most {settings.STATUS_BATCH_MAX_IDS} message_ids per request")
+
+    resolved = await _resolve_provider_statuses(db, request.message_ids)
+    results = []
+    for message_id in request.message_ids:
+        result = resolved.get(message_id)
+        if result is None:
+            results.append({"message_id": message_id, "found": False})
+        else:
+            results.append({**result, "found": True})
+    return {"results": results}
@@ -15,15 +15,55 @@ class Settings(BaseSettings):
     POSTGRES_USER: str 
     POSTGRES_PASSWORD: str 
     POSTGRES_DB: str 
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 30.0
+    DB_POOL_RECYCLE: int = 1800
+    DB_POOL_PRE_PING: bool = True
+    DB_PGBOUNCER_MODE: bool = False
+
+    REDIS_URL: str = "redis://redis:6379/0"
+    IDEMPOTENCY_TTL_SECONDS: int = 86400
+    IDEMPOTENCY_LOCK_TTL_SECONDS: int = 60
+    IDEMPOTENCY_WAIT_SECONDS: float = 10.0
 
     RABBITMQ_URL: str 
     RABBITMQ_MAIN_QUEUE: str 
+    RABBITMQ_PUBLISH_CHANNELS: int = 4
+    RABBITMQ_CONFIRM_BATCH_SIZE: int = 500
+
+    ADMISSION_ENABLED: bool = True
+    ADMISSION_POLL_INTERVAL_MS: int = 1000
+    ADMISSION_LOW_PRIORITY_MAX_DEPTH: int = 50000
+    ADMISSION_MAX_DEPTH: int = 200000
+    ADMISSION_RETRY_AFTER_SECONDS: int = 5
+
+    OUTBOX_RELAY_ENABLED: bool = True
+    OUTBOX_RELAY_TASKS: int = 1
+    OUTBOX_RELAY_BATCH_SIZE: int = 500
+    OUTBOX_RELAY_POLL_INTERVAL_MS: int = 200
+
+    STATS_RECONCILE_INTERVAL_SECONDS: int = 3600
+    STATS_TIMESERIES_MAX_BUCKETS: int = 2400
+    INPUT_COST_PER_1K: float = 0.000115
+    OUTPUT_COST_PER_1K: float = 0.00036
 
     MAX_BODY_CHARS: int = 320
+    SMS_BATCH_MAX_ITEMS: int = 10000
+    UPLOAD_CHUNK_ROWS: int = 5000
+    UPLOAD_MAX_LINE_CHARS: int = 65536
+    UPLOAD_MAX_REJECTED_SAMPLES: int = 100
+    STATUS_BATCH_MAX_IDS: int = 1000
+    STATUS_CACHE_MAX_ENTRIES: int = 100000
+    STATUS_CACHE_TTL_SECONDS: int = 3600
     OPENROUTER_API_KEY: str = ""
     OPENROUTER_MODEL: str = ""
     OPENROUTER_BASE_URL: str = "https://openrouter.ai/api/v1"
     OPENROUTER_TIMEOUT: int = 15
+    OPENROUTER_HTTP2: bool = True
+    OPENROUTER_MAX_CONNECTIONS: int = 20
+    OPENROUTER_MAX_KEEPALIVE_CONNECTIONS: int = 10
+    OPENROUTER_KEEPALIVE_SECONDS: float = 60.0
     PRED_MIN_PHONE_SAMPLES: int = 5
 
     model_config = SettingsConfigDict(
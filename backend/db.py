@@ -1,18 +1,66 @@
-from typing import AsyncGenerator
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Any, AsyncGenerator
 
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
-from sqlalchemy.pool import NullPool
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool
 from config import get_settings
 
 settings = get_settings()
 
 DATABASE_URL = settings.DATABASE_URL
 
-engine = create_async_engine(
-    DATABASE_URL,
-    echo=False,
-    poolclass=NullPool,
-)
+
+@dataclass
+class _PoolStats:
+    checkouts: int = 0
+    wait_seconds_total: float = 0.0
+    wait_seconds_max: float = 0.0
+    overflow_peak: int = 0
+
+
+_pool_stats = _PoolStats()
+
+
+class _TimedQueuePool(AsyncAdaptedQueuePool):
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            waited = time.perf_counter() - started
+            _pool_stats.checkouts += 1
+            _pool_stats.wait_seconds_total += waited
+            _pool_stats.wait_seconds_max = max(_pool_stats.wait_seconds_max, waited)
+            _pool_stats.overflow_peak = max(_pool_stats.overflow_peak, self.overflow())
+
+
+def _engine_options() -> dict[str, Any]:
+    options: dict[str, Any] = {"echo": False}
+    if settings.DB_POOL_SIZE <= 0:
+        options["poolclass"] = NullPool
+    else:
+        options.update(
+            poolclass=_TimedQueuePool,
+            pool_size=settings.DB_POOL_SIZE,
+            max_overflow=settings.DB_MAX_OVERFLOW,
+            pool_timeout=settings.DB_POOL_TIMEOUT,
+            pool_recycle=settings.DB_POOL_RECYCLE,
+            pool_pre_ping=settings.DB_POOL_PRE_PING,
+        )
+    if settings.DB_PGBOUNCER_MODE:
+        # Transaction-mode PgBouncer can hand each statement a different server
+        # connection, so named prepared statements must not be cached or reused.
+        options["connect_args"] = {
+            "statement_cache_size": 0,
+            "prepared_statement_cache_size": 0,
+            "prepared_statement_name_func": lambda: f"__asyncpg_{uuid.uuid4()}__",
+        }
+    return options
+
+
+engine = create_async_engine(DATABASE_URL, **_engine_options())
 
 async_session_factory = async_sessionmaker(
     engine,
@@ -29,3 +77,30 @@ async def get_db() -> AsyncGenerator[AsyncSession, None]:
             yield session
         finally:
             await session.close()
+
+
+def pool_metrics() -> dict[str, Any]:
+    pool = engine.pool
+    metrics: dict[str, Any] = {
+        "pool_class": type(pool).__name__,
+        "pgbouncer_mode": settings.DB_PGBOUNCER_MODE,
+    }
+    if not isinstance(pool, AsyncAdaptedQueuePool):
+        return metrics
+
+    checkouts = _pool_stats.checkouts
+    metrics.update(
+        {
+            "size": pool.size(),
+            "max_overflow": settings.DB_MAX_OVERFLOW,
+            "checked_out": pool.checkedout(),
+            "checked_in": pool.checkedin(),
+            "overflow_in_use": max(0, pool.overflow()),
+            "overflow_peak": max(0, _pool_stats.overflow_peak),
+            "checkouts": checkouts,
+            "wait_seconds_total": round(_pool_stats.wait_seconds_total, 6),
+            "wait_seconds_avg": round(_pool_stats.wait_seconds_total / checkouts, 6) if checkouts else 0.0,
+            "wait_seconds_max": round(_pool_stats.wait_seconds_max, 6),
+        }
+    )
+    return metrics
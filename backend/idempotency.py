@@ -0,0 +1,106 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from typing import Any, Awaitable, Callable
+
+import redis.asyncio as redis_async
+
+from config import get_settings
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+_POLL_INTERVAL_SECONDS = 0.05
+
+_redis_client: redis_async.Redis | None = None
+
+
+class IdempotencyKeyReused(Exception):
+    pass
+
+
+class IdempotencyRequestInProgress(Exception):
+    pass
+
+
+def _get_redis() -> redis_async.Redis:
+    global _redis_client
+    if _redis_client is None:
+        _redis_client = redis_async.Redis.from_url(
+            settings.REDIS_URL,
+            decode_responses=True,
+            socket_timeout=1.0,
+            socket_connect_timeout=1.0,
+        )
+    return _redis_client
+
+
+async def close_idempotency_store() -> None:
+    global _redis_client
+    if _redis_client is not None:
+        await _redis_client.aclose()
+        _redis_client = None
+
+
+async def run_idempotent(
+    scope: str,
+    key: str | None,
+    request_body: str,
+    handler: Callable[[], Awaitable[dict[str, Any]]],
+) -> tuple[dict[str, Any], bool]:
+    if not key:
+        return await handler(), False
+
+    fingerprint = hashlib.sha256(request_body.encode("utf-8")).hexdigest()
+    redis_key = f"idempotency:{scope}:{key}"
+    pending = json.dumps({"state": "pending", "fingerprint": fingerprint})
+    client = _get_redis()
+    deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT_SECONDS
+
+    while True:
+        try:
+            acquired = await client.set(redis_key, pending, nx=True, ex=settings.IDEMPOTENCY_LOCK_TTL_SECONDS)
+            raw = None if acquired else await client.get(redis_key)
+        except Exception as e:
+            # Redis is an optimization here; without it requests are simply not deduplicated.
+            logger.exception("Idempotency store unavailable (key=%s): %s", key, e)
+            return await handler(), False
+
+        if acquired:
+            return await _run_and_store(client, redis_key, fingerprint, handler), False
+
+        if raw is not None:
+            stored = json.loads(raw)
+            if stored.get("fingerprint") != fingerprint:
+                raise IdempotencyKeyReused("Idempotency-Key was already used with a different request body")
+            if stored.get("state") == "done":
+                return stored["response"], True
+
+        if time.monotonic() >= deadline:
+            raise IdempotencyRequestInProgress("a request with this Idempotency-Key is still in progress")
+        await asyncio.sleep(_POLL_INTERVAL_SECONDS)
+
+
+async def _run_and_store(
+    client: redis_async.Redis,
+    redis_key: str,
+    fingerprint: str,
+    handler: Callable[[], Awaitable[dict[str, Any]]],
+) -> dict[str, Any]:
+    try:
+        response = await handler()
+    except BaseException:
+        try:
+            await client.delete(redis_key)
+        except Exception:
+            logger.warning("Could not release idempotency key %s", redis_key)
+        raise
+
+    stored = json.dumps({"state": "done", "fingerprint": fingerprint, "response": response})
+    try:
+        await client.set(redis_key, stored, ex=settings.IDEMPOTENCY_TTL_SECONDS)
+    except Exception as e:
+        logger.exception("Could not store idempotent response %s: %s", redis_key, e)
+    return response
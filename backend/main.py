@@ -1,11 +1,28 @@
 from fastapi import FastAPI
 from contextlib import asynccontextmanager
 from db import engine
+from admission import start_admission_monitor, stop_admission_monitor
 from api import router
+from idempotency import close_idempotency_store
+from outbox import start_outbox_relay, stop_outbox_relay
+from predictor import start_predictor_client, stop_predictor_client
+from publisher import start_publisher, stop_publisher
+from stats import start_stats_reconciler, stop_stats_reconciler
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    await start_publisher()
+    await start_outbox_relay()
+    await start_stats_reconciler()
+    await start_admission_monitor()
+    await start_predictor_client()
     yield
+    await stop_predictor_client()
+    await stop_admission_monitor()
+    await stop_stats_reconciler()
+    await stop_outbox_relay()
+    await stop_publisher()
+    await close_idempotency_store()
     await engine.dispose()
 
 
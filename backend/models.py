@@ -1,5 +1,5 @@
 from datetime import datetime
-from sqlalchemy import String, Integer, DateTime, Text, ForeignKey
+from sqlalchemy import BigInteger, String, Integer, DateTime, Text, ForeignKey
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 import enum
 
@@ -49,3 +49,12 @@ class AiCall(Base):
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=datetime.utcnow)
 
     sms_event: Mapped["SmsEvent | None"] = relationship("SmsEvent", back_populates="ai_calls")
+
+
+class SmsOutbox(Base):
+    __tablename__ = "sms_outbox"
+
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
+    sms_event_id: Mapped[int] = mapped_column(ForeignKey("sms_events.id", ondelete="CASCADE"), nullable=False)
+    payload: Mapped[str] = mapped_column(Text, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=datetime.utcnow)
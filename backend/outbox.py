@@ -0,0 +1,105 @@
+import asyncio
+import logging
+from typing import Any
+
+from sqlalchemy import text
+
+from config import get_settings
+from db import async_session_factory
+from publisher import _publish_many_to_main_queue
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+_wakeup: asyncio.Event | None = None
+_relay_tasks: list[asyncio.Task] = []
+
+
+def main_queue_payload(sms_event_id: int, phone: str, body: str, segment_count: int) -> dict[str, Any]:
+    return {
+        "sms_event_id": sms_event_id,
+        "phone": phone,
+        "body": body,
+        "retry_count": 0,
+        "segment_count": segment_count,
+        "last_dlr": None,
+    }
+
+
+def notify_outbox() -> None:
+    if _wakeup is not None:
+        _wakeup.set()
+
+
+async def _drain_once(batch_size: int) -> int:
+    async with async_session_factory() as session:
+        res = await session.execute(
+            text(
+                """
+                SELECT id, payload
+                FROM sms_outbox
+                ORDER BY id
+                LIMIT :limit
+                FOR UPDATE SKIP LOCKED
+                """
+            ),
+            {"limit": batch_size},
+        )
+        rows = res.all()
+        if not rows:
+            await session.rollback()
+            return 0
+
+        # Rows stay locked until the confirms arrive; a failed publish rolls back and
+        # leaves them for the next pass (at-least-once).
+        await _publish_many_to_main_queue([row.payload.encode() for row in rows])
+        await session.execute(
+            text("DELETE FROM sms_outbox WHERE id = ANY(:ids)"),
+            {"ids": [row.id for row in rows]},
+        )
+        await session.commit()
+        return len(rows)
+
+
+async def _run_relay(relay_id: int) -> None:
+    batch_size = max(1, settings.OUTBOX_RELAY_BATCH_SIZE)
+    poll_interval = max(0.01, settings.OUTBOX_RELAY_POLL_INTERVAL_MS / 1000.0)
+    logger.info("Outbox relay %s started (batch_size=%s)", relay_id, batch_size)
+
+    while True:
+        try:
+            drained = await _drain_once(batch_size)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.exception("Outbox relay %s failed: %s", relay_id, e)
+            await asyncio.sleep(poll_interval)
+            continue
+
+        if drained >= batch_size:
+            continue
+
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=poll_interval)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
+
+
+async def start_outbox_relay() -> None:
+    global _wakeup
+    if not settings.OUTBOX_RELAY_ENABLED:
+        logger.info("Outbox relay disabled")
+        return
+    _wakeup = asyncio.Event()
+    for relay_id in range(max(1, settings.OUTBOX_RELAY_TASKS)):
+        _relay_tasks.append(asyncio.create_task(_run_relay(relay_id)))
+
+
+async def stop_outbox_relay() -> None:
+    global _wakeup
+    for task in _relay_tasks:
+        task.cancel()
+    await asyncio.gather(*_relay_tasks, return_exceptions=True)
+    _relay_tasks.clear()
+    _wakeup = None
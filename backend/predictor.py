@@ -1,4 +1,5 @@
 import json
+import time
 from typing import Any
 
 import httpx
@@ -35,6 +36,61 @@ _LLM_SYSTEM_PROMPT = (
 )
 
 
+_http_client: httpx.AsyncClient | None = None
+_http_stats = {"requests": 0, "new_connections": 0, "reused_connections": 0, "connect_seconds_total": 0.0}
+
+
+async def start_predictor_client() -> None:
+    # One keep-alive (HTTP/2 when available) client for the process instead of one per prediction.
+    global _http_client
+    _http_client = httpx.AsyncClient(
+        http2=settings.OPENROUTER_HTTP2,
+        limits=httpx.Limits(
+            max_connections=settings.OPENROUTER_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.OPENROUTER_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.OPENROUTER_KEEPALIVE_SECONDS,
+        ),
+        timeout=settings.OPENROUTER_TIMEOUT,
+    )
+
+
+async def stop_predictor_client() -> None:
+    global _http_client
+    if _http_client is None:
+        return
+    await _http_client.aclose()
+    _http_client = None
+
+
+def _connect_trace() -> Any:
+    # httpx "trace" extension; connect_tcp/start_tls only fire when a new connection is opened.
+    started: dict[str, float] = {}
+    state = {"new": False}
+
+    async def trace(event_name: str, info: dict[str, Any]) -> None:
+        step, _, phase = event_name.rpartition(".")
+        if step not in ("connection.connect_tcp", "connection.start_tls"):
+            return
+        if phase == "started":
+            started[step] = time.monotonic()
+            state["new"] = True
+        elif phase in ("complete", "failed") and step in started:
+            _http_stats["connect_seconds_total"] += time.monotonic() - started.pop(step)
+
+    return trace, state
+
+
+def predictor_http_metrics() -> dict[str, Any]:
+    new_connections = _http_stats["new_connections"]
+    return {
+        "http2": settings.OPENROUTER_HTTP2,
+        "requests": _http_stats["requests"],
+        "new_connections": new_connections,
+        "reused_connections": _http_stats["reused_connections"],
+        "avg_connect_ms": round(_http_stats["connect_seconds_total"] / new_connections * 1000, 2) if new_connections else None,
+    }
+
+
 def _clamp01(value: float) -> float:
     return max(0.0, min(1.0, value))
 
@@ -150,11 +206,15 @@ async def _ask_ai(requested_hour: int, requested_window: str, window_stats: list
         "Authorization": f"Bearer {settings.OPENROUTER_API_KEY}",
         "Content-Type": "application/json",
     }
+    if _http_client is None:
+        return None
+    trace, trace_state = _connect_trace()
     try:
-        async with httpx.AsyncClient(timeout=settings.OPENROUTER_TIMEOUT) as client:
-            response = await client.post(url, json=payload, headers=headers)
-            response.raise_for_status()
-            data = response.json()
+        response = await _http_client.post(url, json=payload, headers=headers, extensions={"trace": trace})
+        _http_stats["requests"] += 1
+        _http_stats["new_connections" if trace_state["new"] else "reused_connections"] += 1
+        response.raise_for_status()
+        data = response.json()
     except Exception:
         return None
 
@@ -1,19 +1,83 @@
-import pika
+import asyncio
+import logging
+from typing import Sequence
+
+import aio_pika
+from aio_pika.abc import AbstractChannel, AbstractRobustConnection
+from aio_pika.pool import Pool
+
 from config import get_settings
 
+logger = logging.getLogger(__name__)
 settings = get_settings()
 
 RABBITMQ_URL = settings.RABBITMQ_URL
 RABBITMQ_MAIN_QUEUE = settings.RABBITMQ_MAIN_QUEUE
 
-def _get_connection():
-    params = pika.URLParameters(RABBITMQ_URL)
-    return pika.BlockingConnection(params)
-
-def _publish_to_main_queue(body: bytes) -> None:
-    conn = _get_connection()
-    ch = conn.channel()
-    ch.queue_declare(queue=RABBITMQ_MAIN_QUEUE, durable=True)
-    ch.basic_publish(exchange="", routing_key=RABBITMQ_MAIN_QUEUE, body=body)
-    ch.close()
-    conn.close()
+_connection: AbstractRobustConnection | None = None
+_channel_pool: Pool[AbstractChannel] | None = None
+
+
+async def _open_channel() -> AbstractChannel:
+    if _connection is None:
+        raise RuntimeError("publisher is not started")
+    return await _connection.channel(publisher_confirms=True)
+
+
+async def start_publisher() -> None:
+    global _connection, _channel_pool
+    _connection = await aio_pika.connect_robust(RABBITMQ_URL)
+    _channel_pool = Pool(_open_channel, max_size=max(1, settings.RABBITMQ_PUBLISH_CHANNELS))
+    async with _channel_pool.acquire() as ch:
+        await ch.declare_queue(RABBITMQ_MAIN_QUEUE, durable=True)
+    logger.info("Publisher ready (queue=%s channels=%s)", RABBITMQ_MAIN_QUEUE, settings.RABBITMQ_PUBLISH_CHANNELS)
+
+
+async def stop_publisher() -> None:
+    global _connection, _channel_pool
+    if _channel_pool is not None:
+        await _channel_pool.close()
+        _channel_pool = None
+    if _connection is not None:
+        await _connection.close()
+        _connection = None
+
+
+async def main_queue_state() -> tuple[int, int]:
+    if _channel_pool is None:
+        raise RuntimeError("publisher is not started")
+    async with _channel_pool.acquire() as ch:
+        queue = await ch.declare_queue(RABBITMQ_MAIN_QUEUE, passive=True)
+        result = queue.declaration_result
+        return int(result.message_count or 0), int(result.consumer_count or 0)
+
+
+def _message(body: bytes) -> aio_pika.Message:
+    return aio_pika.Message(
+        body=body,
+        content_type="application/json",
+        delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+    )
+
+
+async def _publish_to_main_queue(body: bytes) -> None:
+    await _publish_many_to_main_queue([body])
+
+
+async def _publish_many_to_main_queue(bodies: Sequence[bytes]) -> None:
+    if not bodies:
+        return
+    if _channel_pool is None:
+        raise RuntimeError("publisher is not started")
+
+    batch_size = max(1, settings.RABBITMQ_CONFIRM_BATCH_SIZE)
+    async with _channel_pool.acquire() as ch:
+        exchange = ch.default_exchange
+        # Confirms are awaited per window so the broker can ack many messages at once.
+        for start in range(0, len(bodies), batch_size):
+            await asyncio.gather(
+                *(
+                    exchange.publish(_message(body), routing_key=RABBITMQ_MAIN_QUEUE)
+                    for body in bodies[start:start + batch_size]
+                )
+            )
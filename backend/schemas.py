@@ -1,5 +1,5 @@
 import re
-from typing import Any
+from typing import Any, Literal
 
 from pydantic import BaseModel, Field, field_validator
 
@@ -28,9 +28,14 @@ def normalize_phone(phone_input: str) -> str:
     return phone
 
 
+def count_segments(body: str, max_body_chars: int) -> int:
+    return max(1, (len(body) + (max_body_chars - 1)) // max_body_chars)
+
+
 class SmsRequest(BaseModel):
     phone: str = Field(..., min_length=1, max_length=32)
     body: str = Field(..., min_length=1)
+    priority: Literal["high", "normal", "low"] = "normal"
 
     @field_validator("phone")
     @classmethod
@@ -38,6 +43,21 @@ class SmsRequest(BaseModel):
         return normalize_phone(v)
 
 
+class SmsBatchRequest(BaseModel):
+    items: list[dict[str, Any]] = Field(..., min_length=1)
+
+
+class SmsStatusBatchRequest(BaseModel):
+    message_ids: list[str] = Field(..., min_length=1)
+
+    @field_validator("message_ids")
+    @classmethod
+    def _validate_message_ids(cls, v: list[str]) -> list[str]:
+        if any(not message_id for message_id in v):
+            raise ValueError("message_ids must not contain empty values")
+        return v
+
+
 class DeliveryPredictionResponse(BaseModel):
     probability: float = Field(..., ge=0.0, le=1.0)
     source: str
@@ -0,0 +1,208 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Any
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import get_settings
+from db import async_session_factory
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+_RECONCILE_LOCK_ID = 4_207_001
+_RECONCILE_SHARD = -1
+
+TIMESERIES_GRANULARITIES = {"hour": timedelta(hours=1), "day": timedelta(days=1)}
+
+_reconciler_task: asyncio.Task | None = None
+
+
+async def read_counters(db: AsyncSession) -> tuple[dict[str, int], dict[str, int]]:
+    res = await db.execute(text("SELECT name, SUM(value)::bigint AS value FROM stats_counters GROUP BY name"))
+    counters = {r["name"]: int(r["value"] or 0) for r in res.mappings().all()}
+
+    by_status = {
+        name.split(":", 1)[1]: value
+        for name, value in counters.items()
+        if name.startswith("status:") and value > 0
+    }
+    ai = {
+        "cnt": counters.get("ai:calls", 0),
+        "in_tok": counters.get("ai:input_tokens", 0),
+        "out_tok": counters.get("ai:output_tokens", 0),
+    }
+    return by_status, ai
+
+
+def _bucket_starts(start: datetime, end: datetime, granularity: str) -> list[datetime]:
+    if granularity == "day":
+        current = start.replace(hour=0, minute=0, second=0, microsecond=0)
+    else:
+        current = start.replace(minute=0, second=0, microsecond=0)
+    step = TIMESERIES_GRANULARITIES[granularity]
+    buckets = []
+    while current < end:
+        buckets.append(current)
+        current += step
+    return buckets
+
+
+def _empty_bucket(bucket: datetime) -> dict[str, Any]:
+    return {
+        "bucket": bucket.isoformat(),
+        "messages": 0,
+        "segments": 0,
+        "by_status": {},
+        "delivered": 0,
+        "block_rate": 0.0,
+        "ai": {"calls": 0, "input_tokens": 0, "output_tokens": 0, "cost_usd": 0.0, "by_model": {}},
+    }
+
+
+async def read_timeseries(db: AsyncSession, start: datetime, end: datetime, granularity: str) -> list[dict[str, Any]]:
+    buckets = {b: _empty_bucket(b) for b in _bucket_starts(start, end, granularity)}
+    if not buckets:
+        return []
+    # Rollups are hourly; the range is widened to whole buckets so partial hours/days are not cut off.
+    params = {"granularity": granularity, "start": min(buckets), "end": end}
+
+    res = await db.execute(
+        text(
+            """
+            SELECT date_trunc(:granularity, bucket, 'UTC') AS bucket, status, provider_status,
+                   SUM(messages)::bigint AS messages, SUM(segments)::bigint AS segments
+            FROM sms_hourly_rollup
+            WHERE bucket >= :start AND bucket < :end
+            GROUP BY 1, 2, 3
+            """
+        ),
+        params,
+    )
+    for row in res.mappings().all():
+        item = buckets.get(row["bucket"])
+        if item is None:
+            continue
+        messages = int(row["messages"] or 0)
+        item["messages"] += messages
+        item["segments"] += int(row["segments"] or 0)
+        item["by_status"][row["status"]] = item["by_status"].get(row["status"], 0) + messages
+        if row["provider_status"] == 10:
+            item["delivered"] += messages
+
+    res = await db.execute(
+        text(
+            """
+            SELECT date_trunc(:granularity, bucket, 'UTC') AS bucket, model,
+                   SUM(calls)::bigint AS calls, SUM(input_tokens)::bigint AS input_tokens,
+                   SUM(output_tokens)::bigint AS output_tokens
+            FROM ai_hourly_rollup
+            WHERE bucket >= :start AND bucket < :end
+            GROUP BY 1, 2
+            """
+        ),
+        params,
+    )
+    for row in res.mappings().all():
+        item = buckets.get(row["bucket"])
+        if item is None:
+            continue
+        ai = item["ai"]
+        calls, in_tok, out_tok = int(row["calls"] or 0), int(row["input_tokens"] or 0), int(row["output_tokens"] or 0)
+        ai["calls"] += calls
+        ai["input_tokens"] += in_tok
+        ai["output_tokens"] += out_tok
+        ai["by_model"][row["model"]] = {"calls": calls, "input_tokens": in_tok, "output_tokens": out_tok}
+
+    for item in buckets.values():
+        if item["messages"] > 0:
+            item["block_rate"] = round(item["by_status"].get("BLOCKED", 0) / item["messages"], 4)
+        ai = item["ai"]
+        ai["cost_usd"] = round(
+            (ai["input_tokens"] / 1000.0) * settings.INPUT_COST_PER_1K
+            + (ai["output_tokens"] / 1000.0) * settings.OUTPUT_COST_PER_1K,
+            8,
+        )
+    return list(buckets.values())
+
+
+async def reconcile_counters() -> dict[str, int]:
+    async with async_session_factory() as session:
+        await session.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+        locked = (
+            await session.execute(text("SELECT pg_try_advisory_xact_lock(:lock_id)"), {"lock_id": _RECONCILE_LOCK_ID})
+        ).scalar()
+        if not locked:
+            await session.rollback()
+            return {}
+
+        # Actual totals and counter sums come from the same snapshot, so the
+        # difference is exactly the drift; it is added as a delta to leave
+        # concurrent increments committed after the snapshot intact.
+        res = await session.execute(
+            text(
+                """
+                WITH actual AS (
+                    SELECT 'status:' || COALESCE(status, '') AS name, COUNT(*)::bigint AS value
+                    FROM sms_events
+                    GROUP BY 1
+                    UNION ALL
+                    SELECT 'ai:calls', COUNT(*)::bigint FROM ai_calls
+                    UNION ALL
+                    SELECT 'ai:input_tokens', COALESCE(SUM(input_tokens), 0)::bigint FROM ai_calls
+                    UNION ALL
+                    SELECT 'ai:output_tokens', COALESCE(SUM(output_tokens), 0)::bigint FROM ai_calls
+                ),
+                counted AS (
+                    SELECT name, SUM(value)::bigint AS value FROM stats_counters GROUP BY name
+                ),
+                drift AS (
+                    SELECT COALESCE(a.name, c.name) AS name, COALESCE(a.value, 0) - COALESCE(c.value, 0) AS delta
+                    FROM actual a
+                    FULL OUTER JOIN counted c ON c.name = a.name
+                ),
+                corrected AS (
+                    INSERT INTO stats_counters (name, shard, value)
+                    SELECT name, :shard, delta FROM drift WHERE delta <> 0 ORDER BY name
+                    ON CONFLICT (name, shard) DO UPDATE SET value = stats_counters.value + EXCLUDED.value
+                )
+                SELECT name, delta FROM drift WHERE delta <> 0
+                """
+            ),
+            {"shard": _RECONCILE_SHARD},
+        )
+        drift = {r["name"]: int(r["delta"]) for r in res.mappings().all()}
+        await session.commit()
+
+    if drift:
+        logger.warning("Stats counters drift corrected: %s", drift)
+    return drift
+
+
+async def _run_reconciler(interval_seconds: int) -> None:
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            await reconcile_counters()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.exception("Stats reconcile failed: %s", e)
+
+
+async def start_stats_reconciler() -> None:
+    global _reconciler_task
+    if settings.STATS_RECONCILE_INTERVAL_SECONDS <= 0:
+        return
+    _reconciler_task = asyncio.create_task(_run_reconciler(settings.STATS_RECONCILE_INTERVAL_SECONDS))
+
+
+async def stop_stats_reconciler() -> None:
+    global _reconciler_task
+    if _reconciler_task is None:
+        return
+    _reconciler_task.cancel()
+    await asyncio.gather(_reconciler_task, return_exceptions=True)
+    _reconciler_task = None
@@ -0,0 +1,42 @@
+import asyncio
+
+import uploads
+
+
+async def _stream(data: bytes, chunk_size: int):
+    for i in range(0, len(data), chunk_size):
+        yield data[i:i + chunk_size]
+
+
+def _load(monkeypatch, data: bytes, fmt: str, chunk_size: int = 5) -> tuple[dict, list[tuple[str, str]]]:
+    loaded: list[tuple[str, str]] = []
+
+    async def copy_chunk(db, rows):
+        loaded.extend(rows)
+
+    monkeypatch.setattr(uploads, "_copy_chunk", copy_chunk)
+    monkeypatch.setattr(uploads, "notify_outbox", lambda: None)
+    progress = asyncio.run(uploads.load_upload(None, _stream(data, chunk_size), upload_id="test", fmt=fmt))
+    return progress, loaded
+
+
+def test_csv_quoted_body_spans_lines(monkeypatch):
+    data = b'phone,body\r\n+15550000001,"Hello\r\nworld, ""friend"""\r\n+15550000002,plain\r\n'
+    progress, loaded = _load(monkeypatch, data, "csv")
+    assert loaded == [("+15550000001", 'Hello\nworld, "friend"'), ("+15550000002", "plain")]
+    assert progress["rejected"] == 0
+    assert progress["lines"] == 4
+
+
+def test_csv_unterminated_quote_is_rejected(monkeypatch):
+    data = b'+15550000001,ok\n+15550000002,"never closed\nstill open\n'
+    progress, loaded = _load(monkeypatch, data, "csv")
+    assert loaded == [("+15550000001", "ok")]
+    assert progress["rejected_rows"] == [{"line": 2, "error": "unterminated quoted field"}]
+
+
+def test_ndjson_is_split_per_line(monkeypatch):
+    data = b'{"phone": "+15550000001", "body": "a\\nb"}\n\n[1]\n'
+    progress, loaded = _load(monkeypatch, data, "ndjson")
+    assert loaded == [("+15550000001", "a\nb")]
+    assert progress["rejected_rows"] == [{"line": 3, "error": "line must be a JSON object"}]
@@ -0,0 +1,249 @@
+import codecs
+import csv
+import json
+import logging
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Any, AsyncIterator
+from zoneinfo import ZoneInfo
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import get_settings
+from models import SmsStatus
+from outbox import main_queue_payload, notify_outbox
+from schemas import count_segments, normalize_phone
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+UPLOAD_FORMATS = ("csv", "ndjson")
+
+_SMS_EVENT_COPY_COLUMNS = (
+    "id",
+    "phone",
+    "body",
+    "status",
+    "retry_count",
+    "segment_count",
+    "created_at",
+    "updated_at",
+)
+_OUTBOX_COPY_COLUMNS = ("sms_event_id", "payload", "created_at")
+_MAX_TRACKED_UPLOADS = 100
+
+_uploads: OrderedDict[str, dict[str, Any]] = OrderedDict()
+
+
+class UploadLineTooLong(Exception):
+    pass
+
+
+def get_upload_progress(upload_id: str) -> dict[str, Any] | None:
+    return _uploads.get(upload_id)
+
+
+def _track_upload(upload_id: str, fmt: str) -> dict[str, Any]:
+    progress = {
+        "upload_id": upload_id,
+        "format": fmt,
+        "state": "running",
+        "lines": 0,
+        "loaded": 0,
+        "rejected": 0,
+        "chunks": 0,
+        "rejected_rows": [],
+        "error": None,
+    }
+    _uploads[upload_id] = progress
+    _uploads.move_to_end(upload_id)
+    while len(_uploads) > _MAX_TRACKED_UPLOADS:
+        _uploads.popitem(last=False)
+    return progress
+
+
+async def _iter_lines(stream: AsyncIterator[bytes], max_line_bytes: int) -> AsyncIterator[str]:
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    pending = ""
+    async for chunk in stream:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+        if len(pending) > max_line_bytes:
+            raise UploadLineTooLong(f"line exceeds {max_line_bytes} characters")
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending.rstrip("\r")
+
+
+async def _numbered_lines(lines: AsyncIterator[str], progress: dict[str, Any]) -> AsyncIterator[tuple[int, str]]:
+    async for line in lines:
+        progress["lines"] += 1
+        yield progress["lines"], line
+
+
+class _LineFeed:
+    # Input of the upload's csv.reader. Lines are pushed as they are decoded and the reader is only
+    # advanced once a whole record is queued, so it never runs dry inside a quoted field.
+    def __init__(self) -> None:
+        self.lines: deque[str] = deque()
+
+    def __iter__(self) -> "_LineFeed":
+        return self
+
+    def __next__(self) -> str:
+        if not self.lines:
+            raise StopIteration
+        return self.lines.popleft()
+
+
+async def _iter_csv_records(
+    lines: AsyncIterator[tuple[int, str]], max_record_chars: int
+) -> AsyncIterator[tuple[int, list[str] | csv.Error]]:
+    # One csv.reader for the whole upload, so quoted fields may span lines (SMS bodies often do).
+    # A record is complete once its lines hold an even number of quote characters; "" escapes
+    # come in pairs. Yields the record's first line number with its fields, or the parse error.
+    feed = _LineFeed()
+    reader = csv.reader(feed)
+    start = size = quotes = 0
+    async for line_no, line in lines:
+        if not feed.lines:
+            if not line.strip():
+                continue
+            start, size, quotes = line_no, 0, 0
+        feed.lines.append(line + "\n")
+        size += len(line) + 1
+        quotes += line.count('"')
+        if quotes % 2:
+            if size > max_record_chars:
+                raise UploadLineTooLong(f"record exceeds {max_record_chars} characters")
+            continue
+        try:
+            record: list[str] | csv.Error = next(reader)
+        except csv.Error as e:
+            feed.lines.clear()
+            record = e
+        yield start, record
+    if feed.lines:
+        feed.lines.clear()
+        yield start, csv.Error("unterminated quoted field")
+
+
+def _parse_ndjson(line: str) -> tuple[Any, Any]:
+    item = json.loads(line)
+    if not isinstance(item, dict):
+        raise ValueError("line must be a JSON object")
+    return item.get("phone"), item.get("body")
+
+
+def _parse_csv(fields: list[str], columns: tuple[int, int]) -> tuple[Any, Any]:
+    phone_idx, body_idx = columns
+    if len(fields) <= max(phone_idx, body_idx):
+        raise ValueError("missing phone/body column")
+    return fields[phone_idx], fields[body_idx]
+
+
+def _csv_header_columns(fields: list[str]) -> tuple[int, int] | None:
+    names = [f.strip().lower() for f in fields]
+    if "phone" in names and "body" in names:
+        return names.index("phone"), names.index("body")
+    return None
+
+
+def _validate_row(phone: Any, body: Any) -> tuple[str, str]:
+    if not isinstance(phone, str):
+        raise ValueError("phone is required")
+    if not isinstance(body, str) or not body:
+        raise ValueError("body is required")
+    return normalize_phone(phone), body
+
+
+async def _copy_chunk(db: AsyncSession, rows: list[tuple[str, str]]) -> None:
+    conn = await db.connection()
+    raw = await conn.get_raw_connection()
+    pg = raw.driver_connection
+
+    id_rows = await pg.fetch(
+        "SELECT nextval(pg_get_serial_sequence('sms_events', 'id')) AS id FROM generate_series(1, $1)",
+        len(rows),
+    )
+    now = datetime.now(tz=ZoneInfo("UTC"))
+    events = []
+    outbox = []
+    for id_row, (phone, body) in zip(id_rows, rows):
+        event_id = int(id_row["id"])
+        segment_count = count_segments(body, settings.MAX_BODY_CHARS)
+        events.append((event_id, phone, body, SmsStatus.PENDING.value, 0, segment_count, now, now))
+        payload = main_queue_payload(event_id, phone, body, segment_count)
+        outbox.append((event_id, json.dumps(payload), now))
+
+    await pg.copy_records_to_table("sms_events", records=events, columns=_SMS_EVENT_COPY_COLUMNS)
+    await pg.copy_records_to_table("sms_outbox", records=outbox, columns=_OUTBOX_COPY_COLUMNS)
+    await db.commit()
+
+
+async def load_upload(
+    db: AsyncSession,
+    stream: AsyncIterator[bytes],
+    *,
+    upload_id: str,
+    fmt: str,
+) -> dict[str, Any]:
+    progress = _track_upload(upload_id, fmt)
+    chunk_rows = max(1, settings.UPLOAD_CHUNK_ROWS)
+    max_rejected_samples = max(0, settings.UPLOAD_MAX_REJECTED_SAMPLES)
+    csv_columns: tuple[int, int] | None = None
+    rows: list[tuple[str, str]] = []
+
+    def reject(line_no: int, reason: str) -> None:
+        progress["rejected"] += 1
+        if len(progress["rejected_rows"]) < max_rejected_samples:
+            progress["rejected_rows"].append({"line": line_no, "error": reason})
+
+    async def flush() -> None:
+        await _copy_chunk(db, rows)
+        progress["loaded"] += len(rows)
+        progress["chunks"] += 1
+        rows.clear()
+        notify_outbox()
+        logger.info("Upload %s: loaded=%s rejected=%s", upload_id, progress["loaded"], progress["rejected"])
+
+    try:
+        lines = _numbered_lines(_iter_lines(stream, settings.UPLOAD_MAX_LINE_CHARS), progress)
+        if fmt == "csv":
+            records = _iter_csv_records(lines, settings.UPLOAD_MAX_LINE_CHARS)
+        else:
+            records = ((line_no, line) async for line_no, line in lines if line.strip())
+
+        async for line_no, record in records:
+            try:
+                if isinstance(record, csv.Error):
+                    raise record
+                if fmt == "csv" and csv_columns is None:
+                    csv_columns = _csv_header_columns(record)
+                    if csv_columns is not None:
+                        continue
+                    csv_columns = (0, 1)
+
+                if fmt == "csv":
+                    phone, body = _parse_csv(record, csv_columns)
+                else:
+                    phone, body = _parse_ndjson(record)
+                rows.append(_validate_row(phone, body))
+            except (ValueError, csv.Error) as e:
+                reject(line_no, str(e))
+                continue
+
+            if len(rows) >= chunk_rows:
+                await flush()
+
+        if rows:
+            await flush()
+    except Exception as e:
+        progress["state"] = "failed"
+        progress["error"] = str(e)
+        raise
+
+    progress["state"] = "done"
+    return progress
@@ -1,11 +1,18 @@
+import asyncio
 import json
 import logging
 import re
-from typing import Any
+from typing import Any, NamedTuple
 
 import httpx
+import redis.asyncio as redis_async
 
+import decision_cache
+import metrics
+import semantic_cache
 from env import (
+    AI_DECISION_CACHE_ENABLED,
+    SEMANTIC_CACHE_ENABLED,
     OPENROUTER_API_KEY,
     OPENROUTER_BASE_URL,
     OPENROUTER_MODEL,
@@ -15,7 +22,8 @@ from env import (
     MAX_BODY_CHARS,
     AI_GUARD_MAX_TOKENS,
 )
-from rate_limiter import try_consume_daily_limit
+from http_client import post_json, post_json_async
+from rate_limiter import try_consume_daily_limit, try_consume_daily_limit_async
 
 logger = logging.getLogger(__name__)
 
@@ -25,6 +33,23 @@ Output format:
 - DROP: do not send, avoid cost (duplicate, low value, permanent failure).
 - REWRITE: provide a shortened SMS that preserves meaning. The "body" must be <= max_chars."""
 
+BATCH_SYSTEM_PROMPT = """You are an SMS cost guard. You will get several SMS messages; judge each one independently.
+Reply only with a single JSON object, no other text.
+Output format:
+{"results": [{"message_id": "<message_id as given>", "decision": "DROP"|"REWRITE", "reason": "short reason", "body": "shortened sms when decision=REWRITE"}]}
+Return exactly one result per message_id.
+- DROP: do not send, avoid cost (duplicate, low value, permanent failure).
+- REWRITE: provide a shortened SMS that preserves meaning. The "body" must be <= max_chars."""
+
+
+class ReviewItem(NamedTuple):
+    message_id: str
+    phone: str
+    body: str
+    retry_count: int = 0
+    last_dlr: str | None = None
+    segment_count: int = 1
+
 
 def _build_user_prompt(message_id: str, phone: str, body: str, retry_count: int, last_dlr: str | None, segment_count: int) -> str:
     return (
@@ -52,7 +77,7 @@ def _safe_json_parse(text: str) -> dict[str, Any]:
 
 def _extract_partial_fields(text: str) -> dict[str, Any]:
     def _extract_string_field(name: str) -> str | None:
-        match = re.search(rf"\"{name}\"\\s*:\\s*\"", text)
+        match = re.search(rf"\"{name}\"\s*:\s*\"", text)
         if not match:
             return None
         start = match.end()
@@ -67,7 +92,8 @@ def _extract_partial_fields(text: str) -> dict[str, Any]:
             elif ch == "\"":
                 return text[start:i]
             i += 1
-        return text[start:] if start < len(text) else None
+        # Unterminated string: the response was cut off mid-field, so the value is incomplete.
+        return None
 
     result: dict[str, Any] = {}
     for field in ("decision", "reason", "body"):
@@ -82,37 +108,35 @@ def _extract_partial_fields(text: str) -> dict[str, Any]:
     return result
 
 
-def call_ai_guard(
-    message_id: str,
-    phone: str,
-    body: str,
-    retry_count: int = 0,
-    last_dlr: str | None = None,
-    segment_count: int = 1,
-) -> tuple[dict[str, Any], int, int]:
-    if not OPENROUTER_API_KEY:
-        logger.warning("OPENROUTER_API_KEY not set; returning default DROP")
-        return ({"decision": "DROP", "reason": "AI not configured"}, 0, 0)
+def _fallback_decision(reason: str) -> dict[str, Any]:
+    # A DROP produced by this module (error, misconfiguration, unusable response) rather than by
+    # the model; "uncacheable" keeps it out of the decision cache and the near-match index.
+    return {"decision": "DROP", "reason": reason, "uncacheable": True}
 
-    limit_result = try_consume_daily_limit(
-        REDIS_URL,
-        key_prefix="ai_guard_calls",
-        limit=AI_DAILY_CALL_LIMIT,
-        tz_name="UTC",
+
+def _rate_limited_decision(used_today: int) -> tuple[dict[str, Any], int, int]:
+    return (
+        {
+            "decision": "DROP",
+            "reason": "AI daily usage limit reached.",
+            "rate_limited": True,
+            "uncacheable": True,
+            "used_today": used_today,
+            "limit": AI_DAILY_CALL_LIMIT,
+        },
+        0,
+        0,
     )
-    if not limit_result.allowed:
-        return (
-            {
-                "decision": "DROP",
-                "reason": "AI daily usage limit reached.",
-                "rate_limited": True,
-                "used_today": limit_result.used_today,
-                "limit": AI_DAILY_CALL_LIMIT,
-            },
-            0,
-            0,
-        )
 
+
+def _build_request(
+    message_id: str,
+    phone: str,
+    body: str,
+    retry_count: int,
+    last_dlr: str | None,
+    segment_count: int,
+) -> tuple[str, dict[str, Any], dict[str, str]]:
     url = f"{OPENROUTER_BASE_URL}/chat/completions"
     payload = {
         "model": OPENROUTER_MODEL,
@@ -124,21 +148,14 @@ def call_ai_guard(
         "temperature": 0,
         "response_format": {"type": "json_object"},
     }
-    logger.info(payload)
     headers = {
         "Authorization": f"Bearer {OPENROUTER_API_KEY}",
         "Content-Type": "application/json",
     }
-    try:
-        with httpx.Client(timeout=OPENROUTER_TIMEOUT) as client:
-            r = client.post(url, json=payload, headers=headers)
-            r.raise_for_status()
-            data = r.json()
-            logger.info(data)
-    except Exception as e:
-        logger.exception("OpenRouter request failed: %s", e)
-        return ({"decision": "DROP", "reason": f"AI error: {e}"}, 0, 0)
+    return url, payload, headers
+
 
+def _parse_response(data: dict[str, Any]) -> tuple[dict[str, Any], int, int]:
     usage = data.get("usage", {}) or {}
     input_tokens = int(usage.get("prompt_tokens", 0))
     output_tokens = int(usage.get("completion_tokens", 0))
@@ -156,11 +173,346 @@ def call_ai_guard(
         logger.warning("AI returned non-JSON: %s", content[:200])
         decision_data = _extract_partial_fields(content)
         if not decision_data:
-            decision_data = {"decision": "DROP", "reason": "Invalid AI response"}
+            decision_data = _fallback_decision("Invalid AI response")
     if finish_reason == "length" and decision_data.get("decision") == "REWRITE" and not decision_data.get("body"):
-        decision_data = {"decision": "DROP", "reason": "AI response truncated"}
+        decision_data = _fallback_decision("AI response truncated")
     if "decision" not in decision_data:
         decision_data["decision"] = "DROP"
+        decision_data["uncacheable"] = True
     if "reason" not in decision_data:
         decision_data["reason"] = "Unknown"
     return (decision_data, input_tokens, output_tokens)
+
+
+def call_ai_guard(
+    message_id: str,
+    phone: str,
+    body: str,
+    retry_count: int = 0,
+    last_dlr: str | None = None,
+    segment_count: int = 1,
+    timeout: float | None = None,
+) -> tuple[dict[str, Any], int, int]:
+    if not OPENROUTER_API_KEY:
+        logger.warning("OPENROUTER_API_KEY not set; returning default DROP")
+        return (_fallback_decision("AI not configured"), 0, 0)
+
+    item = ReviewItem(message_id, phone, body, retry_count, last_dlr, segment_count)
+    if not AI_DECISION_CACHE_ENABLED:
+        return _review_with_limit(item, timeout)
+
+    key = decision_cache.decision_key(body, segment_count)
+    state, value = decision_cache.claim(key)
+    if state == "hit":
+        return decision_cache.hit_result(value)
+    if state == "wait":
+        entry = value.result()
+        return decision_cache.hit_result(entry) if entry is not None else _review_with_limit(item, timeout)
+
+    result = None
+    try:
+        result = _review_with_limit(item, timeout)
+    finally:
+        entry = decision_cache.resolve(key, value, result)
+    if entry is not None:
+        decision_cache.store(key, entry)
+    return result
+
+
+def _review_with_limit(item: ReviewItem, timeout: float | None) -> tuple[dict[str, Any], int, int]:
+    # Cache hits and near matches never reach the limit, so only real model calls take a slot.
+    if SEMANTIC_CACHE_ENABLED:
+        near = semantic_cache.lookup(item.body)
+        if near is not None:
+            return near
+    limit_result = try_consume_daily_limit(
+        REDIS_URL,
+        key_prefix="ai_guard_calls",
+        limit=AI_DAILY_CALL_LIMIT,
+        tz_name="UTC",
+    )
+    if not limit_result.allowed:
+        return _rate_limited_decision(limit_result.used_today)
+    result = _request_decision(item, timeout)
+    if SEMANTIC_CACHE_ENABLED:
+        semantic_cache.remember(item.body, result)
+    return result
+
+
+def _request_decision(item: ReviewItem, timeout: float | None) -> tuple[dict[str, Any], int, int]:
+    metrics.incr("ai_guard.model_reviews")
+    url, payload, headers = _build_request(*item)
+    logger.info(payload)
+    try:
+        data = post_json(url, payload, headers, timeout or OPENROUTER_TIMEOUT)
+        logger.info(data)
+    except Exception as e:
+        logger.exception("OpenRouter request failed: %s", e)
+        return (_fallback_decision(f"AI error: {e}"), 0, 0)
+
+    return _parse_response(data)
+
+
+def _build_batch_request(items: list[ReviewItem]) -> tuple[str, dict[str, Any], dict[str, str]]:
+    url, payload, headers = _build_request(*items[0])
+    user_prompt = "\n---\n".join(_build_user_prompt(*item) for item in items)
+    payload["messages"] = [
+        {"role": "system", "content": BATCH_SYSTEM_PROMPT},
+        {"role": "user", "content": user_prompt},
+    ]
+    payload["max_tokens"] = AI_GUARD_MAX_TOKENS * len(items)
+    return url, payload, headers
+
+
+def _split_json_objects(text: str) -> list[str]:
+    # Complete top-level {...} elements of the first JSON array in `text` (or of `text` itself
+    # when the model dropped the array). A truncated trailing element is dropped; its item falls
+    # back to a single call.
+    start = text.find("[")
+    if start != -1:
+        text = text[start + 1:]
+    objects: list[str] = []
+    depth = 0
+    begin = 0
+    in_string = False
+    escaped = False
+    for i, ch in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == "\"":
+                in_string = False
+        elif ch == "\"":
+            in_string = True
+        elif ch == "{":
+            if depth == 0:
+                begin = i
+            depth += 1
+        elif ch == "}" and depth > 0:
+            depth -= 1
+            if depth == 0:
+                objects.append(text[begin:i + 1])
+    return objects
+
+
+def _parse_batch_element(text: str, salvage: bool) -> dict[str, Any]:
+    try:
+        element = _safe_json_parse(text)
+    except json.JSONDecodeError:
+        if not salvage:
+            return {}
+        element = _extract_partial_fields(text)
+        match = re.search(r"\"message_id\"\s*:\s*\"?([^\",}\s]+)", text)
+        if match:
+            element["message_id"] = match.group(1)
+    return element if isinstance(element, dict) else {}
+
+
+def _parse_batch_response(data: dict[str, Any], message_ids: set[str]) -> tuple[dict[str, dict[str, Any]], int, int]:
+    usage = data.get("usage", {}) or {}
+    input_tokens = int(usage.get("prompt_tokens", 0))
+    output_tokens = int(usage.get("completion_tokens", 0))
+    choice = (data.get("choices") or [{}])[0]
+    content = (choice.get("message") or {}).get("content", "") or ""
+    # A response cut off by max_tokens is only trusted for elements that parse as complete JSON.
+    salvage = choice.get("finish_reason") != "length"
+
+    decisions: dict[str, dict[str, Any]] = {}
+    for raw in _split_json_objects(content):
+        element = _parse_batch_element(raw, salvage)
+        message_id = str(element.get("message_id", ""))
+        decision = str(element.get("decision") or "").upper()
+        if message_id not in message_ids or message_id in decisions:
+            continue
+        if decision not in ("DROP", "REWRITE") or (decision == "REWRITE" and not (element.get("body") or "").strip()):
+            continue
+        decisions[message_id] = {
+            "decision": decision,
+            "reason": element.get("reason") or "Unknown",
+            "body": element.get("body") or "",
+        }
+    return decisions, input_tokens, output_tokens
+
+
+def _split_tokens(total: int, parts: int) -> list[int]:
+    share, remainder = divmod(total, parts)
+    return [share + (1 if i < remainder else 0) for i in range(parts)]
+
+
+def call_ai_guard_many(items: list[ReviewItem], timeout: float | None = None) -> list[tuple[dict[str, Any], int, int]]:
+    # Cached bodies are answered up front; the rest share one chat completion. Repeats of a body
+    # within the group (or already in flight on another thread) wait for that single answer.
+    if not OPENROUTER_API_KEY:
+        logger.warning("OPENROUTER_API_KEY not set; returning default DROP")
+        return [(_fallback_decision("AI not configured"), 0, 0)] * len(items)
+
+    results: list[tuple[dict[str, Any], int, int] | None] = [None] * len(items)
+    pending: list[int] = []
+    leads: list[tuple[int, str, Any]] = []
+    waits: list[tuple[int, Any]] = []
+    for i, item in enumerate(items):
+        if AI_DECISION_CACHE_ENABLED:
+            key = decision_cache.decision_key(item.body, item.segment_count)
+            state, value = decision_cache.claim(key)
+            if state == "hit":
+                results[i] = decision_cache.hit_result(value)
+                continue
+            if state == "wait":
+                waits.append((i, value))
+                continue
+            leads.append((i, key, value))
+        pending.append(i)
+
+    # Leads are resolved before waiting on anyone else's, so two threads can never wait on each other.
+    try:
+        _review_batch(items, pending, results, timeout)
+    finally:
+        entries = [(key, decision_cache.resolve(key, future, results[i])) for i, key, future in leads]
+    for key, entry in entries:
+        if entry is not None:
+            decision_cache.store(key, entry)
+
+    for i, future in waits:
+        entry = future.result()
+        results[i] = decision_cache.hit_result(entry) if entry is not None else _review_with_limit(items[i], timeout)
+    return results
+
+
+def _review_batch(
+    items: list[ReviewItem],
+    indices: list[int],
+    results: list[tuple[dict[str, Any], int, int] | None],
+    timeout: float | None,
+) -> None:
+    # One chat completion for items[indices]. Every item still takes its own daily-limit slot;
+    # items the model skipped or answered malformed fall back to a single call (reusing that
+    # slot), and the batch's token usage is split evenly over all items it carried.
+    batch: list[int] = []
+    seen_ids: set[str] = set()
+    for i in indices:
+        item = items[i]
+        if SEMANTIC_CACHE_ENABLED:
+            results[i] = semantic_cache.lookup(item.body)
+            if results[i] is not None:
+                continue
+        limit_result = try_consume_daily_limit(
+            REDIS_URL,
+            key_prefix="ai_guard_calls",
+            limit=AI_DAILY_CALL_LIMIT,
+            tz_name="UTC",
+        )
+        if not limit_result.allowed:
+            results[i] = _rate_limited_decision(limit_result.used_today)
+        elif item.message_id in seen_ids:
+            # Answers are keyed by message_id, so a repeated id is reviewed on its own.
+            results[i] = _request_decision(item, timeout)
+        else:
+            seen_ids.add(item.message_id)
+            batch.append(i)
+
+    if len(batch) == 1:
+        results[batch[0]] = _request_decision(items[batch[0]], timeout)
+    elif batch:
+        batch_items = [items[i] for i in batch]
+        url, payload, headers = _build_batch_request(batch_items)
+        logger.info(payload)
+        try:
+            data = post_json(url, payload, headers, timeout or OPENROUTER_TIMEOUT)
+            logger.info(data)
+        except Exception as e:
+            logger.exception("OpenRouter batch request failed: %s", e)
+            for i in batch:
+                results[i] = (_fallback_decision(f"AI error: {e}"), 0, 0)
+            return
+
+        decisions, input_tokens, output_tokens = _parse_batch_response(data, {item.message_id for item in batch_items})
+        metrics.incr("ai_guard.model_reviews", len(decisions))
+        metrics.incr("ai_guard.batch.calls")
+        metrics.incr("ai_guard.batch.items", len(batch))
+        metrics.incr("ai_guard.batch.fallbacks", len(batch) - len(decisions))
+        for i, in_tok, out_tok in zip(batch, _split_tokens(input_tokens, len(batch)), _split_tokens(output_tokens, len(batch))):
+            decision_data = decisions.get(items[i].message_id)
+            if decision_data is None:
+                decision_data, single_in, single_out = _request_decision(items[i], timeout)
+                in_tok += single_in
+                out_tok += single_out
+            results[i] = (decision_data, in_tok, out_tok)
+            if SEMANTIC_CACHE_ENABLED:
+                semantic_cache.remember(items[i].body, results[i])
+
+
+async def call_ai_guard_async(
+    http_client: httpx.AsyncClient,
+    redis_client: redis_async.Redis,
+    message_id: str,
+    phone: str,
+    body: str,
+    retry_count: int = 0,
+    last_dlr: str | None = None,
+    segment_count: int = 1,
+    timeout: float | None = None,
+) -> tuple[dict[str, Any], int, int]:
+    if not OPENROUTER_API_KEY:
+        logger.warning("OPENROUTER_API_KEY not set; returning default DROP")
+        return (_fallback_decision("AI not configured"), 0, 0)
+
+    item = ReviewItem(message_id, phone, body, retry_count, last_dlr, segment_count)
+    if not AI_DECISION_CACHE_ENABLED:
+        return await _review_with_limit_async(http_client, redis_client, item, timeout)
+
+    key = decision_cache.decision_key(body, segment_count)
+    state, value = await decision_cache.claim_async(redis_client, key)
+    if state == "hit":
+        return decision_cache.hit_result(value)
+    if state == "wait":
+        entry = await asyncio.wrap_future(value)
+        if entry is not None:
+            return decision_cache.hit_result(entry)
+        return await _review_with_limit_async(http_client, redis_client, item, timeout)
+
+    result = None
+    try:
+        result = await _review_with_limit_async(http_client, redis_client, item, timeout)
+    finally:
+        entry = decision_cache.resolve(key, value, result)
+    if entry is not None:
+        await decision_cache.store_async(redis_client, key, entry)
+    return result
+
+
+async def _review_with_limit_async(
+    http_client: httpx.AsyncClient,
+    redis_client: redis_async.Redis,
+    item: ReviewItem,
+    timeout: float | None,
+) -> tuple[dict[str, Any], int, int]:
+    if SEMANTIC_CACHE_ENABLED:
+        near = semantic_cache.lookup(item.body)
+        if near is not None:
+            return near
+    limit_result = await try_consume_daily_limit_async(
+        redis_client,
+        redis_url=REDIS_URL,
+        key_prefix="ai_guard_calls",
+        limit=AI_DAILY_CALL_LIMIT,
+        tz_name="UTC",
+    )
+    if not limit_result.allowed:
+        return _rate_limited_decision(limit_result.used_today)
+
+    metrics.incr("ai_guard.model_reviews")
+    url, payload, headers = _build_request(*item)
+    logger.info(payload)
+    try:
+        data = await post_json_async(http_client, url, payload, headers, timeout or OPENROUTER_TIMEOUT)
+        logger.info(data)
+    except Exception as e:
+        logger.exception("OpenRouter request failed: %s", e)
+        return (_fallback_decision(f"AI error: {e}"), 0, 0)
+
+    result = _parse_response(data)
+    if SEMANTIC_CACHE_ENABLED:
+        semantic_cache.remember(item.body, result)
+    return result
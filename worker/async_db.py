@@ -0,0 +1,82 @@
+import logging
+
+import asyncpg
+
+from db import SmsOutcome
+from env import ASYNC_DB_POOL_SIZE, DATABASE_URL
+
+logger = logging.getLogger(__name__)
+
+_pool: asyncpg.Pool | None = None
+
+
+async def open_pool() -> None:
+    global _pool
+    size = max(1, ASYNC_DB_POOL_SIZE)
+    _pool = await asyncpg.create_pool(DATABASE_URL, min_size=min(2, size), max_size=size)
+    logger.info("asyncpg pool ready (max_size=%s)", size)
+
+
+async def close_pool() -> None:
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+def _get_pool() -> asyncpg.Pool:
+    if _pool is None:
+        raise RuntimeError("async db pool is not open")
+    return _pool
+
+
+async def get_sms_by_id(sms_event_id: int) -> dict | None:
+    row = await _get_pool().fetchrow(
+        """
+        SELECT id, message_id, phone, body, rewritten_body, status, retry_count, segment_count, last_dlr, provider_status
+        FROM sms_events
+        WHERE id = $1
+        """,
+        sms_event_id,
+    )
+    return dict(row) if row else None
+
+
+_APPLY_OUTCOME_UPDATE = """
+    UPDATE sms_events
+    SET status = $2,
+        retry_count = COALESCE($3, retry_count),
+        last_dlr = COALESCE($4, last_dlr),
+        rewritten_body = COALESCE($5, rewritten_body),
+        segment_count = COALESCE($6, segment_count),
+        message_id = COALESCE($7, message_id),
+        provider_status = COALESCE($8, provider_status),
+        updated_at = NOW()
+    WHERE id = $1
+"""
+
+_APPLY_OUTCOME_WITH_AI_CALL = f"""
+    WITH updated AS ({_APPLY_OUTCOME_UPDATE} RETURNING id)
+    INSERT INTO ai_calls (sms_event_id, model, input_tokens, output_tokens, decision, reason, created_at)
+    VALUES ($1, $9, $10, $11, $12, $13, NOW())
+"""
+
+
+async def apply_outcome(outcome: SmsOutcome) -> None:
+    args = [
+        outcome.sms_event_id,
+        outcome.status,
+        outcome.retry_count,
+        outcome.last_dlr,
+        outcome.rewritten_body,
+        outcome.segment_count,
+        outcome.message_id,
+        outcome.provider_status,
+    ]
+    if outcome.ai_call is None:
+        await _get_pool().execute(_APPLY_OUTCOME_UPDATE, *args)
+        return
+    ai = outcome.ai_call
+    await _get_pool().execute(
+        _APPLY_OUTCOME_WITH_AI_CALL, *args, ai.model, ai.input_tokens, ai.output_tokens, ai.decision, ai.reason
+    )
@@ -0,0 +1,248 @@
+import asyncio
+import functools
+import json
+import logging
+import signal
+from dataclasses import dataclass
+from typing import Awaitable, Callable
+
+import aio_pika
+import httpx
+import redis.asyncio as redis_async
+from aio_pika.abc import AbstractChannel, AbstractIncomingMessage, AbstractQueue
+
+import async_db
+import dedup
+import metrics
+from ai_guard import call_ai_guard_async
+from env import (
+    ASYNC_WORKER_MAX_IN_FLIGHT,
+    DUPLICATE_WINDOW_SECONDS,
+    METRICS_LOG_INTERVAL_SECONDS,
+    RABBITMQ_DLQ,
+    RABBITMQ_MAIN_QUEUE,
+    RABBITMQ_REVIEW_QUEUE,
+    RABBITMQ_URL,
+    REDIS_URL,
+    REVIEW_AI_TIMEOUT_SECONDS,
+    REVIEW_CONCURRENCY,
+    REVIEW_PREFETCH,
+    WORKER_DRAIN_TIMEOUT_SECONDS,
+)
+from http_client import new_async_http_client
+from process import (
+    _Plan,
+    _blocked_plan,
+    _build_message,
+    _dlq_plan,
+    _parse_sms_event_id,
+    _poison_plan,
+    _review_plan,
+    _route_to_review_plan,
+    _send_plan,
+)
+from rule_engine import classify_async
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _Clients:
+    channel: AbstractChannel
+    redis: redis_async.Redis
+    http: httpx.AsyncClient
+
+
+async def _publish(channel: AbstractChannel, queue: str, body: bytes) -> None:
+    await channel.default_exchange.publish(
+        aio_pika.Message(body=body, delivery_mode=aio_pika.DeliveryMode.PERSISTENT),
+        routing_key=queue,
+    )
+
+
+async def _run_side_effects(clients: _Clients, plan: _Plan, body: bytes) -> None:
+    if plan.republish is not None:
+        await _publish(clients.channel, RABBITMQ_MAIN_QUEUE, json.dumps(plan.republish).encode())
+    if plan.to_review:
+        await _publish(clients.channel, RABBITMQ_REVIEW_QUEUE, body)
+    if plan.to_dlq:
+        await _publish(clients.channel, RABBITMQ_DLQ, body)
+    if plan.mark_id:
+        await dedup.mark_message_id_async(
+            clients.redis, redis_url=REDIS_URL, message_id=plan.mark_id, ttl_seconds=DUPLICATE_WINDOW_SECONDS
+        )
+
+
+async def _plan_main_message(clients: _Clients, body: bytes) -> _Plan | None:
+    parsed = _parse_sms_event_id(body, "Main")
+    if parsed is None:
+        return None
+    payload, sms_event_id = parsed
+
+    sms_row = await async_db.get_sms_by_id(sms_event_id)
+    if not sms_row:
+        logger.warning("sms_event not found id=%s", sms_event_id)
+        return None
+
+    msg = _build_message(payload, sms_event_id, sms_row)
+    result = await classify_async(
+        clients.redis, msg.processing_id, msg.phone, msg.body, msg.retry_count, msg.last_dlr, msg.segment_count
+    )
+
+    if result == "SEND":
+        return _send_plan(msg)
+    if result == "DROP":
+        return _blocked_plan(msg)
+    if result == "REVIEW":
+        return _route_to_review_plan(msg)
+    return _poison_plan(msg)
+
+
+async def _plan_review_message(clients: _Clients, body: bytes) -> _Plan | None:
+    parsed = _parse_sms_event_id(body, "Review")
+    if parsed is None:
+        return None
+    payload, sms_event_id = parsed
+
+    sms_row = await async_db.get_sms_by_id(sms_event_id)
+    if not sms_row:
+        logger.warning("sms_event not found id=%s", sms_event_id)
+        return None
+
+    msg = _build_message(payload, sms_event_id, sms_row)
+    decision_data, in_tok, out_tok = await call_ai_guard_async(
+        clients.http,
+        clients.redis,
+        msg.processing_id,
+        msg.phone,
+        msg.body,
+        msg.retry_count,
+        msg.last_dlr,
+        msg.segment_count,
+        timeout=REVIEW_AI_TIMEOUT_SECONDS,
+    )
+    return _review_plan(msg, decision_data, in_tok, out_tok)
+
+
+async def _process_main_message(clients: _Clients, body: bytes) -> None:
+    plan = await _plan_main_message(clients, body)
+    if plan is None:
+        return
+    await async_db.apply_outcome(plan.outcome)
+    await _run_side_effects(clients, plan, body)
+
+
+async def _process_review_message(clients: _Clients, body: bytes) -> None:
+    plan = await _plan_review_message(clients, body)
+    if plan is None:
+        return
+    await async_db.apply_outcome(plan.outcome)
+    await _run_side_effects(clients, plan, body)
+
+
+async def _process_dlq_message(clients: _Clients, body: bytes) -> None:
+    parsed = _parse_sms_event_id(body, "DLQ")
+    if parsed is None:
+        return
+    plan = _dlq_plan(parsed[1])
+    await async_db.apply_outcome(plan.outcome)
+    await _run_side_effects(clients, plan, body)
+
+
+async def _consume(
+    queue: AbstractQueue,
+    process: Callable[[bytes], Awaitable[None]],
+    limit: asyncio.Semaphore,
+    in_flight: set[asyncio.Task],
+    name: str,
+) -> str:
+    async def handle(message: AbstractIncomingMessage) -> None:
+        async with limit:
+            try:
+                await process(message.body)
+                ok = True
+                metrics.incr(f"{name.lower()}.processed")
+            except Exception as e:
+                logger.exception("%s consumer error: %s", name, e)
+                ok = False
+                metrics.incr(f"{name.lower()}.failed")
+        if ok:
+            await message.ack()
+        else:
+            await message.nack(requeue=False)
+
+    async def on_message(message: AbstractIncomingMessage) -> None:
+        task = asyncio.create_task(handle(message))
+        in_flight.add(task)
+        task.add_done_callback(in_flight.discard)
+
+    return await queue.consume(on_message)
+
+
+async def _run(max_in_flight: int) -> None:
+    max_in_flight = max(1, max_in_flight)
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stopping.set)
+
+    await async_db.open_pool()
+    connection = await aio_pika.connect_robust(RABBITMQ_URL)
+    redis_client = redis_async.Redis.from_url(REDIS_URL, decode_responses=True, socket_timeout=1.0, socket_connect_timeout=1.0)
+    http_client = new_async_http_client()
+    try:
+        publish_channel = await connection.channel(publisher_confirms=True)
+        clients = _Clients(channel=publish_channel, redis=redis_client, http=http_client)
+        # (queue, handler, concurrency, prefetch, name): prefetch bounds the deliveries held by
+        # this process, the semaphore bounds concurrent processing. Reviews get their own budget
+        # so slow LLM calls never occupy main-queue slots.
+        specs = [
+            (RABBITMQ_MAIN_QUEUE, _process_main_message, max_in_flight, max_in_flight, "Main"),
+            (RABBITMQ_REVIEW_QUEUE, _process_review_message, REVIEW_CONCURRENCY, REVIEW_PREFETCH, "Review"),
+            (RABBITMQ_DLQ, _process_dlq_message, 1, 1, "DLQ"),
+        ]
+        in_flight: set[asyncio.Task] = set()
+        consumers: list[tuple[AbstractQueue, str]] = []
+        for queue_name, handler, concurrency, prefetch, name in specs:
+            concurrency = max(1, concurrency)
+            channel = await connection.channel()
+            await channel.set_qos(prefetch_count=max(prefetch, concurrency))
+            queue = await channel.declare_queue(queue_name, durable=True)
+            tag = await _consume(
+                queue,
+                functools.partial(handler, clients),
+                asyncio.Semaphore(concurrency),
+                in_flight,
+                name,
+            )
+            consumers.append((queue, tag))
+        metrics.register_gauge("main.in_flight", lambda: len(in_flight))
+        logger.info(
+            "Async worker consuming from %s (max_in_flight=%s review_concurrency=%s)",
+            ", ".join(spec[0] for spec in specs), max_in_flight, REVIEW_CONCURRENCY,
+        )
+
+        await stopping.wait()
+        logger.info("Received stop signal; draining %s in-flight messages", len(in_flight))
+        for queue, tag in consumers:
+            await queue.cancel(tag)
+        # Unacked prefetched messages that never started are requeued by the broker on close.
+        if in_flight:
+            _, pending = await asyncio.wait(set(in_flight), timeout=WORKER_DRAIN_TIMEOUT_SECONDS)
+            if pending:
+                logger.warning("%s messages did not finish draining; they will be redelivered", len(pending))
+                for task in pending:
+                    task.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
+    finally:
+        await http_client.aclose()
+        await redis_client.aclose()
+        await connection.close()
+        await async_db.close_pool()
+        logger.info("Async worker stopped")
+
+
+def run_async_consumers() -> None:
+    metrics.start_reporter(METRICS_LOG_INTERVAL_SECONDS)
+    asyncio.run(_run(ASYNC_WORKER_MAX_IN_FLIGHT))
@@ -0,0 +1,199 @@
+import hashlib
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable
+
+import db as worker_db
+import dedup
+import metrics
+from env import (
+    DUPLICATE_WINDOW_SECONDS,
+    REDIS_URL,
+    WORKER_OUTCOME_WRITE_REQUEUES,
+    WORKER_OUTCOME_WRITE_RETRIES,
+)
+from process import _Plan, _run_publishes
+from publisher import _publish_to_dlq
+from ttl_lru import TTLLRU
+
+logger = logging.getLogger(__name__)
+
+_WRITE_RETRY_BACKOFF_SECONDS = 0.2
+_WRITE_RETRY_BACKOFF_MAX_SECONDS = 5.0
+_FAILURES_MAX_ENTRIES = 10_000
+_FAILURES_TTL_SECONDS = 3600
+
+
+@dataclass
+class _Pending:
+    delivery_tag: int
+    plan: _Plan
+    body: bytes
+
+
+class OutcomeBatcher:
+    def __init__(
+        self,
+        name: str,
+        max_items: int,
+        linger_seconds: float,
+        on_settled: Callable[[int, bool, bool], None],
+    ) -> None:
+        self._name = name
+        self._max_items = max(1, max_items)
+        self._linger_seconds = max(0.0, linger_seconds)
+        self._on_settled = on_settled
+        self._cond = threading.Condition()
+        self._items: list[_Pending] = []
+        self._first_at = 0.0
+        self._closed = False
+        # Delivery body digest -> failures seen here. Counted per message rather than taken from
+        # the broker's redelivered flag, which is also set after a consumer restart.
+        self._failures = TTLLRU(_FAILURES_MAX_ENTRIES)
+        self._thread = threading.Thread(target=self._run, name=f"{name}-flusher", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def add(self, delivery_tag: int, plan: _Plan, body: bytes) -> None:
+        with self._cond:
+            if not self._items:
+                self._first_at = time.monotonic()
+            self._items.append(_Pending(delivery_tag, plan, body))
+            self._cond.notify()
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+
+    def _next_batch(self) -> list[_Pending] | None:
+        with self._cond:
+            while not self._items and not self._closed:
+                self._cond.wait()
+            if not self._items:
+                return None
+            deadline = self._first_at + self._linger_seconds
+            while len(self._items) < self._max_items and not self._closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = self._items[:self._max_items]
+            del self._items[:self._max_items]
+            if self._items:
+                self._first_at = time.monotonic()
+            return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            self._flush(batch)
+
+    def _flush(self, batch: list[_Pending]) -> None:
+        started = time.monotonic()
+        failed: list[_Pending] = []
+        try:
+            worker_db.apply_outcomes([p.plan.outcome for p in batch])
+            committed = batch
+        except Exception as e:
+            # One bad row must not poison the whole batch: fall back to per-outcome writes.
+            logger.exception("%s batch flush of %s outcomes failed: %s", self._name, len(batch), e)
+            metrics.incr(f"{self._name.lower()}.flush_failed")
+            committed = []
+            for pending in batch:
+                try:
+                    worker_db.apply_outcome(pending.plan.outcome)
+                    committed.append(pending)
+                except Exception:
+                    logger.exception("%s outcome write failed for delivery %s", self._name, pending.delivery_tag)
+                    failed.append(pending)
+        metrics.observe(f"{self._name.lower()}.flush", time.monotonic() - started)
+        metrics.incr(f"{self._name.lower()}.flush_items", len(batch))
+
+        # Publishes and dedup marks only happen once the outcome is durable.
+        settled = [(pending.delivery_tag, self._run_publishes(pending)) for pending in committed]
+        dedup.mark_message_ids_many(
+            REDIS_URL,
+            message_ids=[p.plan.mark_id for p in committed if p.plan.mark_id],
+            ttl_seconds=DUPLICATE_WINDOW_SECONDS,
+        )
+        for delivery_tag, ok in settled:
+            self._on_settled(delivery_tag, ok, False)
+        for pending in failed:
+            self._settle_unwritten(pending)
+
+    def _run_publishes(self, pending: _Pending) -> bool:
+        try:
+            _run_publishes(pending.plan, pending.body)
+            return True
+        except Exception as e:
+            logger.exception("%s post-commit publish failed: %s", self._name, e)
+            return False
+
+    def _settle_unwritten(self, pending: _Pending) -> None:
+        if pending.plan.sent_id:
+            self._settle_sent_unwritten(pending)
+            return
+        self.retry_or_dead_letter(pending.delivery_tag, pending.body)
+
+    def retry_or_dead_letter(self, delivery_tag: int, body: bytes) -> None:
+        # For deliveries that failed before anything left the worker (outcome write, or review
+        # planning), so replanning is safe. Failures are mostly a short outage: requeue a few
+        # times, then park the message in the DLQ instead of dropping it. If even the DLQ publish
+        # fails, requeue again rather than lose it.
+        key = hashlib.sha256(body).hexdigest()
+        failures = (self._failures.get(key) or 0) + 1
+        self._failures.set(key, failures, _FAILURES_TTL_SECONDS)
+        if failures <= WORKER_OUTCOME_WRITE_REQUEUES:
+            metrics.incr(f"{self._name.lower()}.requeued")
+            self._on_settled(delivery_tag, False, True)
+            return
+        try:
+            _publish_to_dlq(body)
+        except Exception as e:
+            logger.exception("%s DLQ publish failed for delivery %s: %s", self._name, delivery_tag, e)
+            self._on_settled(delivery_tag, False, True)
+            return
+        metrics.incr(f"{self._name.lower()}.dead_lettered")
+        self._on_settled(delivery_tag, True, False)
+
+    def _settle_sent_unwritten(self, pending: _Pending) -> None:
+        # The provider already has this SMS; a redelivery would be classified and sent again.
+        # Its id is marked first, so a redelivery after this process dies is dropped as a
+        # duplicate, and the write is retried here instead of requeueing the delivery.
+        plan = pending.plan
+        dedup.mark_message_id(REDIS_URL, message_id=plan.sent_id, ttl_seconds=DUPLICATE_WINDOW_SECONDS)
+        for attempt in range(max(0, WORKER_OUTCOME_WRITE_RETRIES)):
+            time.sleep(min(_WRITE_RETRY_BACKOFF_MAX_SECONDS, _WRITE_RETRY_BACKOFF_SECONDS * 2**attempt))
+            try:
+                worker_db.apply_outcome(plan.outcome)
+            except Exception as e:
+                logger.warning(
+                    "%s outcome write retry %s failed for delivery %s: %s",
+                    self._name,
+                    attempt + 1,
+                    pending.delivery_tag,
+                    e,
+                )
+                continue
+            metrics.incr(f"{self._name.lower()}.write_retried")
+            ok = self._run_publishes(pending)
+            if plan.mark_id:
+                dedup.mark_message_id(REDIS_URL, message_id=plan.mark_id, ttl_seconds=DUPLICATE_WINDOW_SECONDS)
+            self._on_settled(pending.delivery_tag, ok, False)
+            return
+        # Acked without a row update: a stale row is recoverable from this log, a second SMS is not.
+        logger.error(
+            "%s outcome for already-sent delivery %s could not be written: %s",
+            self._name,
+            pending.delivery_tag,
+            plan.outcome,
+        )
+        metrics.incr(f"{self._name.lower()}.sent_unwritten")
+        self._on_settled(pending.delivery_tag, True, False)
@@ -0,0 +1,74 @@
+import hashlib
+import math
+import threading
+import time
+
+
+class _BloomGeneration:
+    def __init__(self, bits: int, hashes: int) -> None:
+        self.bits = bits
+        self.hashes = hashes
+        self.array = bytearray((bits + 7) // 8)
+        self.count = 0
+
+    def positions(self, key: str) -> list[int]:
+        digest = hashlib.blake2b(key.encode("utf-8", errors="replace"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def contains(self, positions: list[int]) -> bool:
+        return all(self.array[p >> 3] & (1 << (p & 7)) for p in positions)
+
+    def add(self, positions: list[int]) -> None:
+        for p in positions:
+            self.array[p >> 3] |= 1 << (p & 7)
+        self.count += 1
+
+
+class RotatingBloomFilter:
+    # Two generations, each covering one window: a key added at time t stays visible for at
+    # least `window_seconds` (until the generation it landed in is rotated out twice), and
+    # memory is fixed at 2 * bits regardless of traffic.
+    def __init__(self, capacity: int, error_rate: float, window_seconds: float) -> None:
+        capacity = max(1, capacity)
+        error_rate = min(max(error_rate, 1e-9), 0.5)
+        self.capacity = capacity
+        self.bits = max(8, int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))))
+        self.hashes = max(1, int(round(self.bits / capacity * math.log(2))))
+        self.window_seconds = max(1.0, window_seconds)
+        self._lock = threading.Lock()
+        self._current = _BloomGeneration(self.bits, self.hashes)
+        self._previous = _BloomGeneration(self.bits, self.hashes)
+        self._rotated_at = time.monotonic()
+
+    def _maybe_rotate(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self._rotated_at
+        if elapsed < self.window_seconds:
+            return
+        # Rotating more than one window late means both generations are expired.
+        self._previous = self._current if elapsed < 2 * self.window_seconds else _BloomGeneration(self.bits, self.hashes)
+        self._current = _BloomGeneration(self.bits, self.hashes)
+        self._rotated_at = now
+
+    def might_contain(self, key: str) -> bool:
+        positions = self._current.positions(key)
+        with self._lock:
+            self._maybe_rotate()
+            return self._current.contains(positions) or self._previous.contains(positions)
+
+    def add(self, key: str) -> None:
+        positions = self._current.positions(key)
+        with self._lock:
+            self._maybe_rotate()
+            self._current.add(positions)
+
+    def fill_ratio(self) -> float:
+        # Past 1.0 the generation holds more keys than it was sized for and its false-positive
+        # rate climbs above the configured target (more Redis checks, never missed duplicates).
+        with self._lock:
+            return self._current.count / self.capacity
+
+    def memory_bytes(self) -> int:
+        return 2 * len(self._current.array)
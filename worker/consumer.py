@@ -1,51 +1,243 @@
+import functools
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
 import pika
+from pika.adapters.blocking_connection import BlockingChannel
 
 from env import (
     RABBITMQ_DLQ,
     RABBITMQ_MAIN_QUEUE,
+    RABBITMQ_REVIEW_QUEUE,
     RABBITMQ_URL,
+    REVIEW_BATCH_LINGER_MS,
+    REVIEW_BATCH_SIZE,
+    REVIEW_CONCURRENCY,
+    REVIEW_PREFETCH,
+    WORKER_CONCURRENCY,
+    WORKER_OUTCOME_BATCH_SIZE,
+    WORKER_OUTCOME_LINGER_MS,
+    WORKER_PLAN_GROUP_SIZE,
+    WORKER_PREFETCH,
+)
+import metrics
+from batcher import OutcomeBatcher
+from process import (
+    _Plan,
+    _plan_main_messages,
+    _plan_review_messages,
+    _process_dlq_message,
+    _process_main_message,
+    _process_review_message,
 )
-from process import _process_main_message, _process_dlq_message
 from publisher import _ensure_queues
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+_stopping = threading.Event()
+_active_lock = threading.Lock()
+_active: list[tuple[pika.BlockingConnection, pika.adapters.blocking_connection.BlockingChannel]] = []
 
-def _run_main_consumer() -> None:
-    conn = pika.BlockingConnection(pika.URLParameters(RABBITMQ_URL))
-    ch = conn.channel()
-    _ensure_queues(ch)
-    ch.basic_qos(prefetch_count=1)
 
-    def on_message(channel, method, properties, body):
+def is_stopping() -> bool:
+    return _stopping.is_set()
+
+
+def request_stop() -> None:
+    _stopping.set()
+    with _active_lock:
+        active = list(_active)
+    for conn, ch in active:
         try:
-            _process_main_message(body)
-            channel.basic_ack(method.delivery_tag)
-        except Exception as e:
-            logger.exception("Main consumer error: %s", e)
-            channel.basic_nack(method.delivery_tag, requeue=False)
+            conn.add_callback_threadsafe(ch.stop_consuming)
+        except Exception:
+            logger.debug("Consumer connection already closed", exc_info=True)
 
-    ch.basic_consume(queue=RABBITMQ_MAIN_QUEUE, on_message_callback=on_message)
-    logger.info("Consuming from %s", RABBITMQ_MAIN_QUEUE)
-    ch.start_consuming()
 
+class _AckTracker:
+    # Delivery tags are sequential per channel, so one basic_ack(multiple=True) can settle a
+    # whole range -- but only up to the lowest delivery that is still being processed.
+    def __init__(self, ch: BlockingChannel) -> None:
+        self._ch = ch
+        self._next_tag = 1
+        self._acked: set[int] = set()
+        self._nacked: set[int] = set()
 
-def _run_dlq_consumer() -> None:
+    def settle(self, delivery_tag: int, ok: bool, requeue: bool = False) -> None:
+        if ok:
+            self._acked.add(delivery_tag)
+        else:
+            self._ch.basic_nack(delivery_tag, requeue=requeue)
+            self._nacked.add(delivery_tag)
+
+        ack_up_to = None
+        while self._next_tag in self._acked or self._next_tag in self._nacked:
+            if self._next_tag in self._acked:
+                self._acked.discard(self._next_tag)
+                ack_up_to = self._next_tag
+            else:
+                self._nacked.discard(self._next_tag)
+            self._next_tag += 1
+        if ack_up_to is not None:
+            self._ch.basic_ack(ack_up_to, multiple=True)
+
+
+def _run_consumer(
+    queue: str,
+    process: Callable[[bytes], None],
+    concurrency: int,
+    prefetch: int,
+    name: str,
+    plan_many: Callable[[list[bytes]], list[_Plan | None | Exception]] | None = None,
+    batch_size: int = 1,
+    group_size: int = 1,
+    linger_ms: float = WORKER_OUTCOME_LINGER_MS,
+    retry_failed: bool = False,
+) -> None:
+    concurrency = max(1, concurrency)
+    batch_size = max(1, batch_size) if plan_many is not None else 1
+    group_size = max(1, min(group_size, batch_size))
     conn = pika.BlockingConnection(pika.URLParameters(RABBITMQ_URL))
     ch = conn.channel()
     _ensure_queues(ch)
-    ch.basic_qos(prefetch_count=1)
+    # Prefetch bounds the number of in-flight deliveries, so it is never below the worker
+    # count (or the outcome batch size, which could otherwise never fill).
+    prefetch = max(prefetch, concurrency, batch_size)
+    ch.basic_qos(prefetch_count=prefetch)
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=f"{name}-worker")
 
-    def on_message(channel, method, properties, body):
+    tracker = _AckTracker(ch) if batch_size > 1 else None
+
+    def settle(delivery_tag: int, ok: bool, requeue: bool = False) -> None:
+        if tracker is not None:
+            tracker.settle(delivery_tag, ok, requeue)
+        elif ok:
+            ch.basic_ack(delivery_tag)
+        else:
+            ch.basic_nack(delivery_tag, requeue=requeue)
+
+    batcher = None
+    if tracker is not None:
+
+        def on_settled(delivery_tag: int, ok: bool, requeue: bool) -> None:
+            metrics.incr(f"{name.lower()}.processed" if ok else f"{name.lower()}.failed")
+            conn.add_callback_threadsafe(functools.partial(settle, delivery_tag, ok, requeue))
+
+        batcher = OutcomeBatcher(name, batch_size, linger_ms / 1000.0, on_settled)
+        batcher.start()
+
+    def handle(delivery_tag: int, body: bytes) -> None:
+        try:
+            process(body)
+            ok = True
+            metrics.incr(f"{name.lower()}.processed")
+        except Exception as e:
+            logger.exception("%s consumer error: %s", name, e)
+            ok = False
+            metrics.incr(f"{name.lower()}.failed")
+        # pika channels are not thread-safe; acks must run on the connection's thread.
+        conn.add_callback_threadsafe(functools.partial(settle, delivery_tag, ok))
+
+    def handle_group(group: list[tuple[int, bytes]]) -> None:
         try:
-            _process_dlq_message(body)
-            channel.basic_ack(method.delivery_tag)
+            plans = plan_many([body for _, body in group])
         except Exception as e:
-            logger.exception("DLQ consumer error: %s", e)
-            channel.basic_nack(method.delivery_tag, requeue=False)
+            logger.exception("%s group planning failed: %s", name, e)
+            plans = [e] * len(group)
+        for (delivery_tag, body), planned in zip(group, plans):
+            if isinstance(planned, _Plan):
+                # Counted and settled by the batcher once the flush commits.
+                batcher.add(delivery_tag, planned, body)
+                continue
+            ok = not isinstance(planned, Exception)
+            if not ok:
+                logger.error("%s consumer error: %s", name, planned)
+                if retry_failed:
+                    batcher.retry_or_dead_letter(delivery_tag, body)
+                    continue
+            metrics.incr(f"{name.lower()}.processed" if ok else f"{name.lower()}.failed")
+            conn.add_callback_threadsafe(functools.partial(settle, delivery_tag, ok))
+
+    # Batch mode groups deliveries on the connection thread before handing them to the pool.
+    group: list[tuple[int, bytes]] = []
+    group_timer = None
+
+    def submit_group() -> None:
+        nonlocal group, group_timer
+        if group_timer is not None:
+            conn.remove_timeout(group_timer)
+            group_timer = None
+        if group:
+            executor.submit(handle_group, group)
+            group = []
+
+    def on_message(channel, method, properties, body):
+        nonlocal group_timer
+        if batcher is None:
+            executor.submit(handle, method.delivery_tag, body)
+            return
+        group.append((method.delivery_tag, body))
+        if len(group) >= group_size:
+            submit_group()
+        elif group_timer is None:
+            group_timer = conn.call_later(linger_ms / 1000.0, submit_group)
 
-    ch.basic_consume(queue=RABBITMQ_DLQ, on_message_callback=on_message)
-    logger.info("Consuming from %s", RABBITMQ_DLQ)
-    ch.start_consuming()
+    ch.basic_consume(queue=queue, on_message_callback=on_message)
+    with _active_lock:
+        _active.append((conn, ch))
+    logger.info("Consuming from %s (concurrency=%s prefetch=%s batch=%s)", queue, concurrency, prefetch, batch_size)
+    try:
+        if not _stopping.is_set():
+            ch.start_consuming()
+    finally:
+        with _active_lock:
+            _active.remove((conn, ch))
+        # Drain: finish in-flight deliveries and flush their acks before closing;
+        # anything prefetched but not started is requeued by the broker on close.
+        if group and conn.is_open:
+            submit_group()
+        executor.shutdown(wait=True)
+        if batcher is not None:
+            batcher.close()
+        if conn.is_open:
+            conn.process_data_events(time_limit=0)
+            conn.close()
+        logger.info("Stopped consuming from %s", queue)
+
+
+def _run_main_consumer() -> None:
+    _run_consumer(
+        RABBITMQ_MAIN_QUEUE,
+        _process_main_message,
+        WORKER_CONCURRENCY,
+        WORKER_PREFETCH,
+        "Main",
+        plan_many=_plan_main_messages,
+        batch_size=WORKER_OUTCOME_BATCH_SIZE,
+        group_size=WORKER_PLAN_GROUP_SIZE,
+    )
+
+
+def _run_review_consumer() -> None:
+    # A review group is one AI call, so its plans are also flushed as one outcome batch.
+    _run_consumer(
+        RABBITMQ_REVIEW_QUEUE,
+        _process_review_message,
+        REVIEW_CONCURRENCY,
+        REVIEW_PREFETCH,
+        "Review",
+        plan_many=_plan_review_messages,
+        batch_size=REVIEW_BATCH_SIZE,
+        group_size=REVIEW_BATCH_SIZE,
+        linger_ms=REVIEW_BATCH_LINGER_MS,
+        # Nothing is sent while planning a review, so failed deliveries are retried, then
+        # dead-lettered; the review queue has no dead-letter route of its own.
+        retry_failed=True,
+    )
+
+
+def _run_dlq_consumer() -> None:
+    _run_consumer(RABBITMQ_DLQ, _process_dlq_message, 1, 1, "DLQ")
@@ -1,25 +1,233 @@
 import logging
+import threading
+import time
+import weakref
 from contextlib import contextmanager
+from dataclasses import asdict, dataclass
 
 import psycopg2
-from psycopg2.extras import RealDictCursor
+import psycopg2.pool
+from psycopg2.extras import RealDictCursor, execute_values
 
-from env import DATABASE_URL
+import metrics
+from env import (
+    DATABASE_URL,
+    WORKER_DB_HEALTHCHECK_IDLE_SECONDS,
+    WORKER_DB_POOL_MAX_SIZE,
+    WORKER_DB_POOL_MIN_SIZE,
+    WORKER_DB_POOL_TIMEOUT_SECONDS,
+)
 
 logger = logging.getLogger(__name__)
 
+_pool_lock = threading.Lock()
+_pool: psycopg2.pool.ThreadedConnectionPool | None = None
+# ThreadedConnectionPool raises instead of waiting when exhausted; the semaphore makes callers queue.
+_pool_slots: threading.BoundedSemaphore | None = None
+_in_use = 0
+# Keyed by the connection itself: id() values are reused once a discarded connection is freed.
+_last_used: "weakref.WeakKeyDictionary[object, float]" = weakref.WeakKeyDictionary()
+
+
+def _get_pool() -> tuple[psycopg2.pool.ThreadedConnectionPool, threading.BoundedSemaphore]:
+    global _pool, _pool_slots
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                max_size = max(1, WORKER_DB_POOL_MAX_SIZE)
+                min_size = max(0, min(WORKER_DB_POOL_MIN_SIZE, max_size))
+                _pool_slots = threading.BoundedSemaphore(max_size)
+                _pool = psycopg2.pool.ThreadedConnectionPool(min_size, max_size, DATABASE_URL)
+                metrics.register_gauge("db.pool.max_size", lambda: max_size)
+                metrics.register_gauge("db.pool.in_use", lambda: _in_use)
+                metrics.register_gauge("db.pool.utilization", lambda: _in_use / max_size)
+                logger.info("Postgres pool ready (min=%s max=%s)", min_size, max_size)
+    return _pool, _pool_slots
+
+
+def _is_healthy(conn, force: bool = False) -> bool:
+    if conn.closed:
+        return False
+    last_used = _last_used.get(conn)
+    if not force and (last_used is None or time.monotonic() - last_used < WORKER_DB_HEALTHCHECK_IDLE_SECONDS):
+        return True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def _checkout(pool: psycopg2.pool.ThreadedConnectionPool):
+    # One stale connection (server restart, idle timeout) usually means the rest of the pool is
+    # stale too, so after the first discard every candidate is pinged before it is handed out.
+    # Worst case this drains every pooled connection and then opens a fresh one.
+    force = False
+    for _ in range(max(1, WORKER_DB_POOL_MAX_SIZE) + 1):
+        conn = pool.getconn()
+        if _is_healthy(conn, force):
+            return conn
+        logger.warning("Discarding unhealthy pooled Postgres connection")
+        metrics.incr("db.pool.reconnects")
+        _last_used.pop(conn, None)
+        pool.putconn(conn, close=True)
+        force = True
+    raise psycopg2.OperationalError("no healthy Postgres connection available")
+
+
+def _release(pool: psycopg2.pool.ThreadedConnectionPool, conn, broken: bool) -> None:
+    if broken:
+        _last_used.pop(conn, None)
+    else:
+        _last_used[conn] = time.monotonic()
+    pool.putconn(conn, close=broken)
+
+
+def close_pool() -> None:
+    global _pool, _pool_slots
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+            _pool_slots = None
+            _last_used.clear()
+
 
 @contextmanager
 def get_conn():
-    conn = psycopg2.connect(DATABASE_URL)
+    global _in_use
+    pool, slots = _get_pool()
+    started = time.monotonic()
+    if not slots.acquire(timeout=WORKER_DB_POOL_TIMEOUT_SECONDS):
+        metrics.incr("db.pool.timeouts")
+        raise psycopg2.pool.PoolError(f"timed out after {WORKER_DB_POOL_TIMEOUT_SECONDS}s waiting for a Postgres connection")
+    try:
+        conn = _checkout(pool)
+    except Exception:
+        slots.release()
+        raise
+    metrics.observe("db.pool.wait", time.monotonic() - started)
+    with _pool_lock:
+        _in_use += 1
+
+    broken = False
     try:
         yield conn
         conn.commit()
-    except Exception:
-        conn.rollback()
+    except Exception as e:
+        broken = conn.closed or isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError))
+        if not conn.closed:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                broken = True
         raise
     finally:
-        conn.close()
+        with _pool_lock:
+            _in_use -= 1
+        _release(pool, conn, broken)
+        slots.release()
+
+
+@dataclass(frozen=True)
+class AiCallRecord:
+    model: str
+    input_tokens: int
+    output_tokens: int
+    decision: str | None
+    reason: str | None
+
+
+@dataclass(frozen=True)
+class SmsOutcome:
+    sms_event_id: int
+    status: str
+    retry_count: int | None = None
+    last_dlr: str | None = None
+    rewritten_body: str | None = None
+    segment_count: int | None = None
+    message_id: str | None = None
+    provider_status: int | None = None
+    ai_call: AiCallRecord | None = None
+
+
+# None means "leave the column as it is", matching the COALESCE style of the single-column helpers.
+_APPLY_OUTCOME_UPDATE = """
+    UPDATE sms_events
+    SET status = %(status)s,
+        retry_count = COALESCE(%(retry_count)s, retry_count),
+        last_dlr = COALESCE(%(last_dlr)s, last_dlr),
+        rewritten_body = COALESCE(%(rewritten_body)s, rewritten_body),
+        segment_count = COALESCE(%(segment_count)s, segment_count),
+        message_id = COALESCE(%(message_id)s, message_id),
+        provider_status = COALESCE(%(provider_status)s, provider_status),
+        updated_at = NOW()
+    WHERE id = %(sms_event_id)s
+"""
+
+_APPLY_OUTCOME_WITH_AI_CALL = f"""
+    WITH updated AS ({_APPLY_OUTCOME_UPDATE} RETURNING id)
+    INSERT INTO ai_calls (sms_event_id, model, input_tokens, output_tokens, decision, reason, created_at)
+    VALUES (%(sms_event_id)s, %(model)s, %(input_tokens)s, %(output_tokens)s, %(decision)s, %(reason)s, NOW())
+"""
+
+
+def _outcome_params(outcome: SmsOutcome) -> dict:
+    params = asdict(outcome)
+    params.update(params.pop("ai_call") or {})
+    return params
+
+
+def apply_outcome(outcome: SmsOutcome) -> None:
+    sql = _APPLY_OUTCOME_WITH_AI_CALL if outcome.ai_call else _APPLY_OUTCOME_UPDATE
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(sql, _outcome_params(outcome))
+
+
+_APPLY_OUTCOMES_UPDATE = """
+    UPDATE sms_events AS e
+    SET status = v.status,
+        retry_count = COALESCE(v.retry_count, e.retry_count),
+        last_dlr = COALESCE(v.last_dlr, e.last_dlr),
+        rewritten_body = COALESCE(v.rewritten_body, e.rewritten_body),
+        segment_count = COALESCE(v.segment_count, e.segment_count),
+        message_id = COALESCE(v.message_id, e.message_id),
+        provider_status = COALESCE(v.provider_status, e.provider_status),
+        updated_at = NOW()
+    FROM (VALUES %s) AS v(id, status, retry_count, last_dlr, rewritten_body, segment_count, message_id, provider_status)
+    WHERE e.id = v.id
+"""
+_APPLY_OUTCOMES_TEMPLATE = "(%s::integer, %s::varchar, %s::integer, %s::varchar, %s::text, %s::integer, %s::varchar, %s::integer)"
+
+_INSERT_AI_CALLS = """
+    INSERT INTO ai_calls (sms_event_id, model, input_tokens, output_tokens, decision, reason, created_at)
+    VALUES %s
+"""
+_INSERT_AI_CALLS_TEMPLATE = "(%s, %s, %s, %s, %s, %s, NOW())"
+
+
+def apply_outcomes(outcomes: list[SmsOutcome]) -> None:
+    if not outcomes:
+        return
+    # UPDATE ... FROM with a repeated id applies an arbitrary row; keep the latest outcome per event.
+    latest = {o.sms_event_id: o for o in outcomes}
+    rows = [
+        (o.sms_event_id, o.status, o.retry_count, o.last_dlr, o.rewritten_body, o.segment_count, o.message_id, o.provider_status)
+        for o in latest.values()
+    ]
+    ai_rows = [
+        (o.sms_event_id, o.ai_call.model, o.ai_call.input_tokens, o.ai_call.output_tokens, o.ai_call.decision, o.ai_call.reason)
+        for o in outcomes
+        if o.ai_call is not None
+    ]
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            execute_values(cur, _APPLY_OUTCOMES_UPDATE, rows, template=_APPLY_OUTCOMES_TEMPLATE, page_size=len(rows))
+            if ai_rows:
+                execute_values(cur, _INSERT_AI_CALLS, ai_rows, template=_INSERT_AI_CALLS_TEMPLATE, page_size=len(ai_rows))
 
 
 def get_sms_by_id(sms_event_id: int) -> dict | None:
@@ -37,6 +245,22 @@ def get_sms_by_id(sms_event_id: int) -> dict | None:
             return dict(row) if row else None
 
 
+def get_sms_by_ids(sms_event_ids: list[int]) -> dict[int, dict]:
+    if not sms_event_ids:
+        return {}
+    with get_conn() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(
+                """
+                SELECT id, message_id, phone, body, rewritten_body, status, retry_count, segment_count, last_dlr, provider_status
+                FROM sms_events
+                WHERE id = ANY(%s)
+                """,
+                (sms_event_ids,),
+            )
+            return {row["id"]: dict(row) for row in cur.fetchall()}
+
+
 def get_sms_by_message_id(message_id: str) -> dict | None:
     with get_conn() as conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
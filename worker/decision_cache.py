@@ -0,0 +1,148 @@
+import hashlib
+import json
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Any
+
+import redis.asyncio as redis_async
+
+import metrics
+from dedup import _normalize_body
+from env import (
+    AI_DECISION_CACHE_LOCAL_MAX_ENTRIES,
+    AI_DECISION_CACHE_TTL_SECONDS,
+    OPENROUTER_MODEL,
+    REDIS_URL,
+)
+from redis_client import get_breaker, get_redis
+from ttl_lru import TTLLRU
+
+logger = logging.getLogger(__name__)
+
+_KEY_PREFIX = "ai_guard:decision"
+
+_local = TTLLRU(AI_DECISION_CACHE_LOCAL_MAX_ENTRIES)
+_inflight_lock = threading.Lock()
+_inflight: dict[str, Future] = {}
+
+metrics.register_gauge("ai_guard.cache.local_entries", lambda: float(len(_local)))
+
+
+def decision_key(body: str, segment_count: int, model: str | None = OPENROUTER_MODEL) -> str:
+    payload = f"{model}\n{segment_count}\n{_normalize_body(body)}".encode("utf-8", errors="replace")
+    return f"{_KEY_PREFIX}:{hashlib.sha256(payload).hexdigest()}"
+
+
+def cache_entry(decision_data: dict[str, Any], input_tokens: int, output_tokens: int) -> dict[str, Any] | None:
+    # Only real model answers are shared. Results built by ai_guard itself (errors, rate limits,
+    # unusable responses) carry "uncacheable"; reuses of earlier answers are not stored again.
+    if decision_data.get("uncacheable") or decision_data.get("cached") or decision_data.get("near_match"):
+        return None
+    decision = (decision_data.get("decision") or "").upper()
+    if decision not in ("DROP", "REWRITE") or (decision == "REWRITE" and not (decision_data.get("body") or "").strip()):
+        return None
+    return {
+        "decision": decision,
+        "reason": decision_data.get("reason") or "",
+        "body": decision_data.get("body") or "",
+        "tokens": input_tokens + output_tokens,
+    }
+
+
+def hit_result(entry: dict[str, Any]) -> tuple[dict[str, Any], int, int]:
+    metrics.incr("ai_guard.cache.hits")
+    metrics.incr("ai_guard.cache.saved_tokens", entry.get("tokens", 0))
+    decision_data = {"decision": entry["decision"], "reason": entry["reason"], "body": entry["body"], "cached": True}
+    return (decision_data, 0, 0)
+
+
+def _claim_local(key: str) -> tuple[str, Any]:
+    entry = _local.get(key)
+    if entry is not None:
+        return ("hit", entry)
+    with _inflight_lock:
+        future = _inflight.get(key)
+        if future is not None:
+            metrics.incr("ai_guard.cache.coalesced")
+            return ("wait", future)
+        future = Future()
+        _inflight[key] = future
+        return ("lead", future)
+
+
+def _finish(key: str, future: Future, entry: dict[str, Any] | None) -> None:
+    if entry is not None:
+        _local.set(key, entry, AI_DECISION_CACHE_TTL_SECONDS)
+    with _inflight_lock:
+        _inflight.pop(key, None)
+    future.set_result(entry)
+
+
+def claim(key: str) -> tuple[str, Any]:
+    # ("hit", entry): answer from the local LRU or Redis.
+    # ("wait", future): another caller is already asking the model for this key; the future
+    #   resolves to its entry, or None if that answer was not cacheable.
+    # ("lead", future): the caller must ask the model and then call resolve(key, future, ...).
+    state, value = _claim_local(key)
+    if state != "lead":
+        return state, value
+
+    breaker = get_breaker(REDIS_URL)
+    if breaker.allow():
+        try:
+            raw = get_redis(REDIS_URL).get(key)
+            breaker.record_success()
+        except Exception as e:
+            breaker.record_failure()
+            logger.warning("AI decision cache lookup failed: %s", e)
+            raw = None
+        if raw:
+            entry = json.loads(raw)
+            _finish(key, value, entry)
+            return ("hit", entry)
+    metrics.incr("ai_guard.cache.misses")
+    return state, value
+
+
+async def claim_async(client: redis_async.Redis, key: str) -> tuple[str, Any]:
+    state, value = _claim_local(key)
+    if state != "lead":
+        return state, value
+    try:
+        raw = await client.get(key)
+    except Exception as e:
+        logger.warning("AI decision cache lookup failed: %s", e)
+        raw = None
+    if raw:
+        entry = json.loads(raw)
+        _finish(key, value, entry)
+        return ("hit", entry)
+    metrics.incr("ai_guard.cache.misses")
+    return state, value
+
+
+def resolve(key: str, future: Future, result: tuple[dict[str, Any], int, int] | None) -> dict[str, Any] | None:
+    # Always call this for a "lead" claim (result=None on failure) so waiters are released.
+    entry = cache_entry(*result) if result is not None else None
+    _finish(key, future, entry)
+    return entry
+
+
+def store(key: str, entry: dict[str, Any]) -> None:
+    breaker = get_breaker(REDIS_URL)
+    if not breaker.allow():
+        return
+    try:
+        get_redis(REDIS_URL).set(key, json.dumps(entry), ex=AI_DECISION_CACHE_TTL_SECONDS)
+        breaker.record_success()
+    except Exception as e:
+        breaker.record_failure()
+        logger.warning("AI decision cache store failed: %s", e)
+
+
+async def store_async(client: redis_async.Redis, key: str, entry: dict[str, Any]) -> None:
+    try:
+        await client.set(key, json.dumps(entry), ex=AI_DECISION_CACHE_TTL_SECONDS)
+    except Exception as e:
+        logger.warning("AI decision cache store failed: %s", e)
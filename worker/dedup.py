@@ -3,35 +3,92 @@ from __future__ import annotations
 import hashlib
 import logging
 import re
+import threading
 import unicodedata
+from itertools import islice
+from typing import NamedTuple, Sequence
 
-import redis
+import redis.asyncio as redis_async
+
+import metrics
+from bloom import RotatingBloomFilter
+from env import DEDUP_LOCAL_MAX_ENTRIES, DEDUP_PREFILTER_CAPACITY, DEDUP_PREFILTER_ENABLED, DEDUP_PREFILTER_FPR
+from redis_client import get_breaker, get_redis, get_script
+from ttl_lru import TTLLRU
 
 logger = logging.getLogger(__name__)
 
 
-_LUA_PHONE_BODY_WINDOW = """
-local pb_key = KEYS[1]
+_LUA_DUPLICATE_FLAGS = """
+local mid_key = KEYS[1]
+local pb_key = KEYS[2]
 local ttl_seconds = tonumber(ARGV[1])
 local message_id = ARGV[2]
 
+local duplicate_mid = redis.call('EXISTS', mid_key)
+
 local existing = redis.call('GET', pb_key)
 
 if existing == false then
   redis.call('SET', pb_key, message_id, 'EX', ttl_seconds)
-  return 0
+  return {duplicate_mid, 0}
 end
 
+redis.call('EXPIRE', pb_key, ttl_seconds)
 if existing == message_id then
-  redis.call('EXPIRE', pb_key, ttl_seconds)
-  return 0
+  return {duplicate_mid, 0}
 end
 
-redis.call('EXPIRE', pb_key, ttl_seconds)
-return 1
+return {duplicate_mid, 1}
 """
 
 
+# Items are checked in order inside one script call, so within a batch the first
+# occurrence of a message id or phone+body wins and later ones are flagged.
+_LUA_DUPLICATE_FLAGS_MANY = """
+local ttl_seconds = tonumber(ARGV[1])
+local seen_mids = {}
+local result = {}
+
+for i = 1, #KEYS / 2 do
+  local mid_key = KEYS[2 * i - 1]
+  local pb_key = KEYS[2 * i]
+  local message_id = ARGV[i + 1]
+
+  local duplicate_mid = redis.call('EXISTS', mid_key)
+  if seen_mids[mid_key] then
+    duplicate_mid = 1
+  end
+  seen_mids[mid_key] = true
+
+  local duplicate_pb = 0
+  local existing = redis.call('GET', pb_key)
+  if existing == false then
+    redis.call('SET', pb_key, message_id, 'EX', ttl_seconds)
+  else
+    redis.call('EXPIRE', pb_key, ttl_seconds)
+    if existing ~= message_id then
+      duplicate_pb = 1
+    end
+  end
+
+  result[2 * i - 1] = duplicate_mid
+  result[2 * i] = duplicate_pb
+end
+
+return result
+"""
+
+# Bounds how long a single script call can block Redis.
+_MANY_CHUNK_SIZE = 500
+
+
+class DedupItem(NamedTuple):
+    message_id: str
+    phone: str
+    body: str
+
+
 def _normalize_phone(phone: str) -> str:
     return phone.strip()
 
@@ -52,6 +109,129 @@ def _phone_body_fingerprint(phone: str, body: str) -> str:
     return hashlib.sha256(payload).hexdigest()
 
 
+def _mid_key(key_prefix: str, message_id: str) -> str:
+    return f"{key_prefix}:mid:{message_id}"
+
+
+def _pb_key(key_prefix: str, phone: str, body: str) -> str:
+    return f"{key_prefix}:pb:{_phone_body_fingerprint(phone, body)}"
+
+
+class _CircuitOpen(Exception):
+    # Raised to reach the local fallback when the breaker short-circuits. It is not a Redis
+    # error, so it is never counted as one: every path calls record_failure() for real
+    # Redis errors only.
+    pass
+
+
+# Process-local mirror of recently seen dedup keys. While the Redis circuit is open, checks
+# are answered from here instead of failing open on every message.
+_local = TTLLRU(DEDUP_LOCAL_MAX_ENTRIES)
+metrics.register_gauge("dedup.local.entries", lambda: len(_local))
+
+
+def _local_flags(mid_key: str, pb_key: str, message_id: str, window_seconds: int) -> tuple[bool, bool]:
+    duplicate_message_id = _local.get(mid_key) is not None
+    first_message_id = _local.setdefault(pb_key, message_id, window_seconds)
+    return (duplicate_message_id, first_message_id != message_id)
+
+
+# Optional per-process prefilter. A Bloom miss on both the message id and the phone+body
+# fingerprint means this process has not seen either within the window, so Redis is skipped
+# and the fingerprint is recorded there in the background. Only correct when the same
+# phones are routed to the same worker; other workers' records are invisible to the filter.
+_PENDING_RECORDS_MAX = 100_000
+_RECORD_BATCH_SIZE = 500
+
+_prefilter: RotatingBloomFilter | None = None
+_prefilter_cond = threading.Condition()
+# pb_key -> (message_id, ttl_seconds) for fingerprints accepted locally but not yet in Redis.
+_pending_records: dict[str, tuple[str, int]] = {}
+_recorder: threading.Thread | None = None
+
+
+def _get_prefilter(window_seconds: int) -> RotatingBloomFilter | None:
+    global _prefilter
+    if not DEDUP_PREFILTER_ENABLED:
+        return None
+    if _prefilter is None:
+        with _prefilter_cond:
+            if _prefilter is None:
+                _prefilter = RotatingBloomFilter(DEDUP_PREFILTER_CAPACITY, DEDUP_PREFILTER_FPR, window_seconds)
+                metrics.register_gauge("dedup.prefilter.fill_ratio", _prefilter.fill_ratio)
+                metrics.register_gauge("dedup.prefilter.memory_bytes", _prefilter.memory_bytes)
+                metrics.register_gauge("dedup.prefilter.pending_records", lambda: len(_pending_records))
+                logger.info(
+                    "Dedup prefilter enabled (capacity=%s fpr=%s bits=%s hashes=%s)",
+                    DEDUP_PREFILTER_CAPACITY, DEDUP_PREFILTER_FPR, _prefilter.bits, _prefilter.hashes,
+                )
+    return _prefilter
+
+
+def _record_loop(redis_url: str, socket_timeout_seconds: float) -> None:
+    while True:
+        with _prefilter_cond:
+            while not _pending_records:
+                _prefilter_cond.wait()
+            batch = list(islice(_pending_records.items(), _RECORD_BATCH_SIZE))
+        breaker = get_breaker(redis_url)
+        try:
+            if not breaker.allow():
+                raise _CircuitOpen()
+            pipe = get_redis(redis_url, socket_timeout_seconds).pipeline(transaction=False)
+            for pb_key, (message_id, ttl_seconds) in batch:
+                pipe.set(pb_key, message_id, ex=ttl_seconds, nx=True)
+            pipe.execute()
+            breaker.record_success()
+        except Exception as e:
+            # Same fail-open policy as the synchronous check; the local mirror still has them.
+            if not isinstance(e, _CircuitOpen):
+                breaker.record_failure()
+            logger.warning("Redis dedup background record failed (count=%s): %s", len(batch), e)
+            metrics.incr("dedup.prefilter.record_failed", len(batch))
+        with _prefilter_cond:
+            for pb_key, record in batch:
+                if _pending_records.get(pb_key) == record:
+                    del _pending_records[pb_key]
+
+
+def _prefilter_check(
+    prefilter: RotatingBloomFilter,
+    mid_key: str,
+    pb_key: str,
+    message_id: str,
+    window_seconds: int,
+    redis_url: str,
+    socket_timeout_seconds: float,
+) -> tuple[bool, bool] | None:
+    global _recorder
+    with _prefilter_cond:
+        pending = _pending_records.get(pb_key)
+        if pending is not None and pending[0] != message_id:
+            metrics.incr("dedup.prefilter.pending_hits")
+            return (False, True)
+        if (
+            pending is not None
+            or len(_pending_records) >= _PENDING_RECORDS_MAX
+            or prefilter.might_contain(mid_key)
+            or prefilter.might_contain(pb_key)
+        ):
+            metrics.incr("dedup.prefilter.maybe")
+            return None
+
+        prefilter.add(pb_key)
+        _local.setdefault(pb_key, message_id, window_seconds)
+        _pending_records[pb_key] = (message_id, window_seconds)
+        if _recorder is None:
+            _recorder = threading.Thread(
+                target=_record_loop, args=(redis_url, socket_timeout_seconds), name="dedup-recorder", daemon=True
+            )
+            _recorder.start()
+        _prefilter_cond.notify()
+    metrics.incr("dedup.prefilter.skipped")
+    return (False, False)
+
+
 def get_duplicate_flags(
     redis_url: str,
     *,
@@ -65,24 +245,131 @@ def get_duplicate_flags(
     if window_seconds <= 0:
         return (False, False)
 
-    mid_key = f"{key_prefix}:mid:{message_id}"
-    pb_key = f"{key_prefix}:pb:{_phone_body_fingerprint(phone, body)}"
+    keys = [_mid_key(key_prefix, message_id), _pb_key(key_prefix, phone, body)]
+    prefilter = _get_prefilter(window_seconds)
+    if prefilter is not None:
+        flags = _prefilter_check(prefilter, *keys, message_id, window_seconds, redis_url, socket_timeout_seconds)
+        if flags is not None:
+            return flags
 
-    client = redis.Redis.from_url(
-        redis_url,
-        decode_responses=True,
-        socket_timeout=socket_timeout_seconds,
-        socket_connect_timeout=socket_timeout_seconds,
-    )
+    breaker = get_breaker(redis_url)
+    if not breaker.allow():
+        metrics.incr("dedup.local.checks")
+        return _local_flags(*keys, message_id, window_seconds)
+
+    client = get_redis(redis_url, socket_timeout_seconds)
 
     try:
-        duplicate_message_id = bool(int(client.exists(mid_key)))
-        duplicate_phone_body = bool(int(client.eval(_LUA_PHONE_BODY_WINDOW, 1, pb_key, str(window_seconds), message_id)))
-        return (duplicate_message_id, duplicate_phone_body)
+        script = get_script(client, _LUA_DUPLICATE_FLAGS)
+        duplicate_mid, duplicate_pb = script(keys=keys, args=[str(window_seconds), message_id])
+        breaker.record_success()
+        if prefilter is not None:
+            prefilter.add(keys[1])
+        _local.setdefault(keys[1], message_id, window_seconds)
+        return (bool(int(duplicate_mid)), bool(int(duplicate_pb)))
     except Exception as e:
+        breaker.record_failure()
         logger.exception("Redis dedup check failed (mid=%s): %s", message_id, e)
+        metrics.incr("dedup.local.checks")
+        return _local_flags(*keys, message_id, window_seconds)
+
+
+async def get_duplicate_flags_async(
+    client: redis_async.Redis,
+    *,
+    redis_url: str,
+    message_id: str,
+    phone: str,
+    body: str,
+    window_seconds: int,
+    key_prefix: str = "dedup:sms",
+) -> tuple[bool, bool]:
+    # Same breaker (keyed by `redis_url`, shared with the sync paths) and local fallback as
+    # get_duplicate_flags; the prefilter is not used by the asyncio runtime.
+    if window_seconds <= 0:
         return (False, False)
 
+    keys = [_mid_key(key_prefix, message_id), _pb_key(key_prefix, phone, body)]
+    breaker = get_breaker(redis_url)
+    if not breaker.allow():
+        metrics.incr("dedup.local.checks")
+        return _local_flags(*keys, message_id, window_seconds)
+
+    try:
+        script = get_script(client, _LUA_DUPLICATE_FLAGS)
+        duplicate_mid, duplicate_pb = await script(keys=keys, args=[str(window_seconds), message_id])
+        breaker.record_success()
+        _local.setdefault(keys[1], message_id, window_seconds)
+        return (bool(int(duplicate_mid)), bool(int(duplicate_pb)))
+    except Exception as e:
+        breaker.record_failure()
+        logger.exception("Redis dedup check failed (mid=%s): %s", message_id, e)
+        metrics.incr("dedup.local.checks")
+        return _local_flags(*keys, message_id, window_seconds)
+
+
+def get_duplicate_flags_many(
+    redis_url: str,
+    items: Sequence[DedupItem],
+    *,
+    window_seconds: int,
+    key_prefix: str = "dedup:sms",
+    socket_timeout_seconds: float = 1.0,
+) -> list[tuple[bool, bool]]:
+    if window_seconds <= 0 or not items:
+        return [(False, False)] * len(items)
+
+    keyed = [(item, _mid_key(key_prefix, item.message_id), _pb_key(key_prefix, item.phone, item.body)) for item in items]
+    results: list[tuple[bool, bool] | None] = [None] * len(items)
+    prefilter = _get_prefilter(window_seconds)
+    if prefilter is not None:
+        # Checked in order, so an earlier item in the batch is already pending when a later
+        # duplicate of it is checked.
+        seen_mids: set[str] = set()
+        for i, (item, mid_key, pb_key) in enumerate(keyed):
+            if mid_key in seen_mids:
+                results[i] = (True, False)
+                continue
+            seen_mids.add(mid_key)
+            results[i] = _prefilter_check(
+                prefilter, mid_key, pb_key, item.message_id, window_seconds, redis_url, socket_timeout_seconds
+            )
+    remaining = [i for i, flags in enumerate(results) if flags is None]
+
+    breaker = get_breaker(redis_url)
+    client = get_redis(redis_url, socket_timeout_seconds)
+    try:
+        if remaining and not breaker.allow():
+            raise _CircuitOpen()
+        script = get_script(client, _LUA_DUPLICATE_FLAGS_MANY)
+        for start in range(0, len(remaining), _MANY_CHUNK_SIZE):
+            chunk = remaining[start:start + _MANY_CHUNK_SIZE]
+            keys: list[str] = []
+            for i in chunk:
+                keys.append(keyed[i][1])
+                keys.append(keyed[i][2])
+            result = script(keys=keys, args=[str(window_seconds), *(keyed[i][0].message_id for i in chunk)])
+            breaker.record_success()
+            for n, i in enumerate(chunk):
+                results[i] = (bool(int(result[2 * n])), bool(int(result[2 * n + 1])))
+                if prefilter is not None:
+                    prefilter.add(keyed[i][2])
+                _local.setdefault(keyed[i][2], keyed[i][0].message_id, window_seconds)
+    except Exception as e:
+        if not isinstance(e, _CircuitOpen):
+            breaker.record_failure()
+            logger.exception("Redis batch dedup check failed (items=%s): %s", len(items), e)
+        seen_mids = set()
+        for i in remaining:
+            if results[i] is not None:
+                continue
+            item, mid_key, pb_key = keyed[i]
+            metrics.incr("dedup.local.checks")
+            duplicate_message_id, duplicate_phone_body = _local_flags(mid_key, pb_key, item.message_id, window_seconds)
+            results[i] = (duplicate_message_id or mid_key in seen_mids, duplicate_phone_body)
+            seen_mids.add(mid_key)
+    return [flags or (False, False) for flags in results]
+
 
 def mark_message_id(
     redis_url: str,
@@ -95,14 +382,74 @@ def mark_message_id(
     if ttl_seconds <= 0:
         return
 
-    mid_key = f"{key_prefix}:mid:{message_id}"
-    client = redis.Redis.from_url(
-        redis_url,
-        decode_responses=True,
-        socket_timeout=socket_timeout_seconds,
-        socket_connect_timeout=socket_timeout_seconds,
-    )
+    mid_key = _mid_key(key_prefix, message_id)
+    prefilter = _get_prefilter(ttl_seconds)
+    if prefilter is not None:
+        prefilter.add(mid_key)
+    _local.set(mid_key, "1", ttl_seconds)
+    breaker = get_breaker(redis_url)
+    if not breaker.allow():
+        return
+    client = get_redis(redis_url, socket_timeout_seconds)
     try:
         client.set(mid_key, "1", ex=ttl_seconds)
+        breaker.record_success()
+    except Exception as e:
+        breaker.record_failure()
+        logger.exception("Redis dedup mark_message_id failed (mid=%s): %s", message_id, e)
+
+
+def mark_message_ids_many(
+    redis_url: str,
+    *,
+    message_ids: Sequence[str],
+    ttl_seconds: int,
+    key_prefix: str = "dedup:sms",
+    socket_timeout_seconds: float = 1.0,
+) -> None:
+    if ttl_seconds <= 0 or not message_ids:
+        return
+
+    prefilter = _get_prefilter(ttl_seconds)
+    mid_keys = [_mid_key(key_prefix, message_id) for message_id in message_ids]
+    for mid_key in mid_keys:
+        if prefilter is not None:
+            prefilter.add(mid_key)
+        _local.set(mid_key, "1", ttl_seconds)
+    breaker = get_breaker(redis_url)
+    if not breaker.allow():
+        return
+    client = get_redis(redis_url, socket_timeout_seconds)
+    try:
+        pipe = client.pipeline(transaction=False)
+        for mid_key in mid_keys:
+            pipe.set(mid_key, "1", ex=ttl_seconds)
+        pipe.execute()
+        breaker.record_success()
+    except Exception as e:
+        breaker.record_failure()
+        logger.exception("Redis dedup mark_message_ids_many failed (count=%s): %s", len(message_ids), e)
+
+
+async def mark_message_id_async(
+    client: redis_async.Redis,
+    *,
+    redis_url: str,
+    message_id: str,
+    ttl_seconds: int,
+    key_prefix: str = "dedup:sms",
+) -> None:
+    if ttl_seconds <= 0:
+        return
+
+    mid_key = _mid_key(key_prefix, message_id)
+    _local.set(mid_key, "1", ttl_seconds)
+    breaker = get_breaker(redis_url)
+    if not breaker.allow():
+        return
+    try:
+        await client.set(mid_key, "1", ex=ttl_seconds)
+        breaker.record_success()
     except Exception as e:
+        breaker.record_failure()
         logger.exception("Redis dedup mark_message_id failed (mid=%s): %s", message_id, e)
@@ -12,8 +12,17 @@ OPENROUTER_API_KEY = os.environ.get("OPENROUTER_API_KEY", "")
 OPENROUTER_MODEL = os.environ.get("OPENROUTER_MODEL")
 OPENROUTER_BASE_URL = os.environ.get("OPENROUTER_BASE_URL").rstrip("/")
 OPENROUTER_TIMEOUT = int(os.environ.get("OPENROUTER_TIMEOUT", "300"))
+# One long-lived HTTP/2 keep-alive client per process instead of a new connection per review
+OPENROUTER_HTTP2 = os.environ.get("OPENROUTER_HTTP2", "true").strip().lower() in ("1", "true", "yes")
+OPENROUTER_MAX_CONNECTIONS = int(os.environ.get("OPENROUTER_MAX_CONNECTIONS", "20"))
+OPENROUTER_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("OPENROUTER_MAX_KEEPALIVE_CONNECTIONS", "10"))
+OPENROUTER_KEEPALIVE_SECONDS = float(os.environ.get("OPENROUTER_KEEPALIVE_SECONDS", "60"))
 
 REDIS_URL = os.environ.get("REDIS_URL", "redis://redis:6379/0")
+# Consecutive Redis failures before dedup stops calling Redis and falls back to a local TTL LRU
+REDIS_BREAKER_FAILURE_THRESHOLD = int(os.environ.get("REDIS_BREAKER_FAILURE_THRESHOLD", "3"))
+REDIS_BREAKER_PROBE_INTERVAL_SECONDS = float(os.environ.get("REDIS_BREAKER_PROBE_INTERVAL_SECONDS", "2"))
+DEDUP_LOCAL_MAX_ENTRIES = int(os.environ.get("DEDUP_LOCAL_MAX_ENTRIES", "200000"))
 AI_DAILY_CALL_LIMIT = int(os.environ.get("AI_DAILY_CALL_LIMIT", "50"))
 
 RABBITMQ_URL = os.environ.get("RABBITMQ_URL")
@@ -23,11 +32,55 @@ RABBITMQ_DLQ = os.environ.get("RABBITMQ_DLQ")
 
 WATCH_PATH = os.environ.get("WATCH_PATH", "/app")
 
+WORKER_CONCURRENCY = int(os.environ.get("WORKER_CONCURRENCY", "8"))
+WORKER_PREFETCH = int(os.environ.get("WORKER_PREFETCH", "32"))
+WORKER_PROCESSES = int(os.environ.get("WORKER_PROCESSES", "1"))
+WORKER_RESTART_BACKOFF_SECONDS = float(os.environ.get("WORKER_RESTART_BACKOFF_SECONDS", "1"))
+WORKER_RESTART_BACKOFF_MAX_SECONDS = float(os.environ.get("WORKER_RESTART_BACKOFF_MAX_SECONDS", "60"))
+WORKER_DRAIN_TIMEOUT_SECONDS = float(os.environ.get("WORKER_DRAIN_TIMEOUT_SECONDS", "30"))
+# >1 buffers main-queue outcomes and writes/acks them per batch (sync runtime only)
+WORKER_OUTCOME_BATCH_SIZE = int(os.environ.get("WORKER_OUTCOME_BATCH_SIZE", "1"))
+WORKER_OUTCOME_LINGER_MS = int(os.environ.get("WORKER_OUTCOME_LINGER_MS", "20"))
+# A delivery whose outcome write (or, on the review queue, whose planning) fails is requeued this many
+# times before it is dead-lettered; already-sent messages are never requeued and retry the write locally
+WORKER_OUTCOME_WRITE_REQUEUES = int(os.environ.get("WORKER_OUTCOME_WRITE_REQUEUES", "1"))
+WORKER_OUTCOME_WRITE_RETRIES = int(os.environ.get("WORKER_OUTCOME_WRITE_RETRIES", "5"))
+# In batch mode, deliveries are planned in groups of up to this size (one row fetch + one dedup call each)
+WORKER_PLAN_GROUP_SIZE = int(os.environ.get("WORKER_PLAN_GROUP_SIZE", "16"))
+WORKER_DB_POOL_MIN_SIZE = int(os.environ.get("WORKER_DB_POOL_MIN_SIZE", "1"))
+WORKER_DB_POOL_MAX_SIZE = int(os.environ.get("WORKER_DB_POOL_MAX_SIZE", "16"))
+WORKER_DB_POOL_TIMEOUT_SECONDS = float(os.environ.get("WORKER_DB_POOL_TIMEOUT_SECONDS", "30"))
+WORKER_DB_HEALTHCHECK_IDLE_SECONDS = float(os.environ.get("WORKER_DB_HEALTHCHECK_IDLE_SECONDS", "30"))
+# REVIEW messages are handled by their own consumer pool so LLM latency never blocks the main queue
+REVIEW_CONCURRENCY = int(os.environ.get("REVIEW_CONCURRENCY", "4"))
+REVIEW_PREFETCH = int(os.environ.get("REVIEW_PREFETCH", "8"))
+# Up to REVIEW_BATCH_SIZE reviews (or whatever arrives within REVIEW_BATCH_LINGER_MS) share one AI call; 1 disables
+REVIEW_BATCH_SIZE = int(os.environ.get("REVIEW_BATCH_SIZE", "1"))
+REVIEW_BATCH_LINGER_MS = float(os.environ.get("REVIEW_BATCH_LINGER_MS", "200"))
+REVIEW_AI_TIMEOUT_SECONDS = float(os.environ.get("REVIEW_AI_TIMEOUT_SECONDS", os.environ.get("OPENROUTER_TIMEOUT", "300")))
+# "sync" (pika + thread pool) or "asyncio" (aio-pika + asyncpg + redis.asyncio + httpx.AsyncClient)
+WORKER_RUNTIME = os.environ.get("WORKER_RUNTIME", "sync").strip().lower()
+ASYNC_WORKER_MAX_IN_FLIGHT = int(os.environ.get("ASYNC_WORKER_MAX_IN_FLIGHT", "200"))
+ASYNC_DB_POOL_SIZE = int(os.environ.get("ASYNC_DB_POOL_SIZE", "20"))
+METRICS_LOG_INTERVAL_SECONDS = float(os.environ.get("METRICS_LOG_INTERVAL_SECONDS", "60"))
+
 DUPLICATE_WINDOW_SECONDS = int(os.environ.get("DUPLICATE_WINDOW_SECONDS", "300"))
+# Per-process Bloom prefilter in front of Redis dedup; only safe with sticky phone->worker routing
+DEDUP_PREFILTER_ENABLED = os.environ.get("DEDUP_PREFILTER_ENABLED", "false").strip().lower() in ("1", "true", "yes")
+DEDUP_PREFILTER_CAPACITY = int(os.environ.get("DEDUP_PREFILTER_CAPACITY", "1000000"))
+DEDUP_PREFILTER_FPR = float(os.environ.get("DEDUP_PREFILTER_FPR", "0.01"))
 MAX_RETRY_BEFORE_DLQ = int(os.environ.get("MAX_RETRY_BEFORE_DLQ", "3"))
 MULTIPART_SEGMENT_THRESHOLD = int(os.environ.get("MULTIPART_SEGMENT_THRESHOLD", "2"))
 MAX_BODY_CHARS = int(os.environ.get("MAX_BODY_CHARS", "320"))
 AI_GUARD_MAX_TOKENS = int(os.environ.get("AI_GUARD_MAX_TOKENS", "160"))
+# AI decisions shared across messages with the same normalized body, segment count and model
+AI_DECISION_CACHE_ENABLED = os.environ.get("AI_DECISION_CACHE_ENABLED", "true").strip().lower() in ("1", "true", "yes")
+AI_DECISION_CACHE_TTL_SECONDS = int(os.environ.get("AI_DECISION_CACHE_TTL_SECONDS", "21600"))
+AI_DECISION_CACHE_LOCAL_MAX_ENTRIES = int(os.environ.get("AI_DECISION_CACHE_LOCAL_MAX_ENTRIES", "10000"))
+# Reuse a decision for bodies that differ only in names, amounts or codes (local n-gram LSH index)
+SEMANTIC_CACHE_ENABLED = os.environ.get("SEMANTIC_CACHE_ENABLED", "false").strip().lower() in ("1", "true", "yes")
+SEMANTIC_CACHE_THRESHOLD = float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", "0.9"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.environ.get("SEMANTIC_CACHE_MAX_ENTRIES", "5000"))
 
 
 def _prob(name: str, default: str) -> float:
@@ -0,0 +1,101 @@
+import threading
+import time
+from typing import Any
+
+import httpx
+
+import metrics
+from env import (
+    OPENROUTER_HTTP2,
+    OPENROUTER_KEEPALIVE_SECONDS,
+    OPENROUTER_MAX_CONNECTIONS,
+    OPENROUTER_MAX_KEEPALIVE_CONNECTIONS,
+    OPENROUTER_TIMEOUT,
+)
+
+_lock = threading.Lock()
+_client: httpx.Client | None = None
+
+# httpcore trace events that make up opening a new connection; a request served from a
+# kept-alive connection emits none of them.
+_SETUP_STEPS = ("connection.connect_tcp", "connection.start_tls")
+
+
+class ConnectTrace:
+    # Per-request httpx "trace" extension: sums TCP connect + TLS handshake time.
+    def __init__(self) -> None:
+        self.setup_seconds = 0.0
+        self.new_connection = False
+        self._started: dict[str, float] = {}
+
+    def __call__(self, event_name: str, info: dict[str, Any]) -> None:
+        step, _, phase = event_name.rpartition(".")
+        if step not in _SETUP_STEPS:
+            return
+        if phase == "started":
+            self._started[step] = time.monotonic()
+            self.new_connection = True
+        elif phase in ("complete", "failed") and step in self._started:
+            self.setup_seconds += time.monotonic() - self._started.pop(step)
+
+    async def async_trace(self, event_name: str, info: dict[str, Any]) -> None:
+        self(event_name, info)
+
+    def record(self, request_seconds: float) -> None:
+        metrics.observe("ai_guard.http.request", request_seconds)
+        if self.new_connection:
+            metrics.incr("ai_guard.http.new_connections")
+            metrics.observe("ai_guard.http.connect", self.setup_seconds)
+        else:
+            metrics.incr("ai_guard.http.reused_connections")
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=max(1, OPENROUTER_MAX_CONNECTIONS),
+        max_keepalive_connections=max(0, OPENROUTER_MAX_KEEPALIVE_CONNECTIONS),
+        keepalive_expiry=OPENROUTER_KEEPALIVE_SECONDS,
+    )
+
+
+def get_http_client() -> httpx.Client:
+    # One pooled keep-alive client per process; httpx.Client is safe to share across threads.
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = httpx.Client(http2=OPENROUTER_HTTP2, limits=_limits(), timeout=OPENROUTER_TIMEOUT)
+    return _client
+
+
+def new_async_http_client() -> httpx.AsyncClient:
+    # AsyncClient is bound to the event loop it first runs on, so the asyncio runtime owns its own.
+    return httpx.AsyncClient(http2=OPENROUTER_HTTP2, limits=_limits(), timeout=OPENROUTER_TIMEOUT)
+
+
+def post_json(url: str, payload: dict[str, Any], headers: dict[str, str], timeout: float) -> Any:
+    trace = ConnectTrace()
+    started = time.monotonic()
+    r = get_http_client().post(url, json=payload, headers=headers, timeout=timeout, extensions={"trace": trace})
+    trace.record(time.monotonic() - started)
+    r.raise_for_status()
+    return r.json()
+
+
+async def post_json_async(
+    client: httpx.AsyncClient, url: str, payload: dict[str, Any], headers: dict[str, str], timeout: float
+) -> Any:
+    trace = ConnectTrace()
+    started = time.monotonic()
+    r = await client.post(url, json=payload, headers=headers, timeout=timeout, extensions={"trace": trace.async_trace})
+    trace.record(time.monotonic() - started)
+    r.raise_for_status()
+    return r.json()
+
+
+def close_http_client() -> None:
+    global _client
+    with _lock:
+        if _client is not None:
+            _client.close()
+            _client = None
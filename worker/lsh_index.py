@@ -0,0 +1,117 @@
+import hashlib
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Any
+
+_SIGNATURE_BITS = 64
+_VECTOR_DIMS = 1 << 20
+
+
+def _feature_hash(gram: str) -> int:
+    return int.from_bytes(hashlib.blake2b(gram.encode("utf-8", errors="replace"), digest_size=8).digest(), "little")
+
+
+def ngram_features(text: str, n: int = 3) -> dict[int, float]:
+    # Character n-gram counts keyed by their 64-bit hash; the padding makes word edges grams too.
+    padded = f" {text} "
+    features: dict[int, float] = {}
+    for i in range(max(1, len(padded) - n + 1)):
+        h = _feature_hash(padded[i:i + n])
+        features[h] = features.get(h, 0.0) + 1.0
+    return features
+
+
+def hashed_vector(features: dict[int, float]) -> dict[int, float]:
+    # Sparse L2-normalized vector in a fixed 2^20-dimensional hashing space.
+    vector: dict[int, float] = {}
+    for h, weight in features.items():
+        index = h % _VECTOR_DIMS
+        vector[index] = vector.get(index, 0.0) + weight
+    norm = sum(w * w for w in vector.values()) ** 0.5 or 1.0
+    return {index: w / norm for index, w in vector.items()}
+
+
+def simhash(features: dict[int, float]) -> int:
+    # Random-hyperplane signature: bit b is the sign of the weighted vote of every feature's bit b,
+    # so the fraction of agreeing bits tracks the cosine similarity of the two vectors.
+    votes = [0.0] * _SIGNATURE_BITS
+    for h, weight in features.items():
+        for b in range(_SIGNATURE_BITS):
+            votes[b] += weight if (h >> b) & 1 else -weight
+    signature = 0
+    for b, vote in enumerate(votes):
+        if vote > 0:
+            signature |= 1 << b
+    return signature
+
+
+def cosine(a: dict[int, float], b: dict[int, float]) -> float:
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(w * b.get(index, 0.0) for index, w in a.items())
+
+
+class LSHIndex:
+    # Bounded nearest-neighbour index over hashed n-gram vectors. The 64-bit SimHash signature is
+    # split into bands; entries sharing any band are candidates and are re-ranked by exact cosine.
+    # Only the `max_candidates` sharing the most bands are re-ranked, which bounds lookup cost when
+    # the index is full of near-identical campaign bodies. Oldest entries are evicted past
+    # `max_entries`, and entries older than `ttl_seconds` are ignored.
+    def __init__(self, max_entries: int, ttl_seconds: float, bands: int = 8, max_candidates: int = 64) -> None:
+        self.max_entries = max(1, max_entries)
+        self.max_candidates = max(1, max_candidates)
+        self.ttl_seconds = max(1.0, ttl_seconds)
+        self.bands = bands if bands > 0 and _SIGNATURE_BITS % bands == 0 else 8
+        self._band_bits = _SIGNATURE_BITS // self.bands
+        self._lock = threading.Lock()
+        self._next_id = 0
+        self._entries: OrderedDict[int, tuple[dict[int, float], int, Any, float]] = OrderedDict()
+        self._buckets: list[dict[int, set[int]]] = [{} for _ in range(self.bands)]
+
+    def _band_keys(self, signature: int) -> list[int]:
+        mask = (1 << self._band_bits) - 1
+        return [(signature >> (band * self._band_bits)) & mask for band in range(self.bands)]
+
+    def _remove_locked(self, entry_id: int) -> None:
+        _, signature, _, _ = self._entries.pop(entry_id)
+        for band, key in enumerate(self._band_keys(signature)):
+            bucket = self._buckets[band].get(key)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self._buckets[band][key]
+
+    def add(self, text: str, value: Any) -> None:
+        features = ngram_features(text)
+        vector, signature = hashed_vector(features), simhash(features)
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (vector, signature, value, time.monotonic() + self.ttl_seconds)
+            for band, key in enumerate(self._band_keys(signature)):
+                self._buckets[band].setdefault(key, set()).add(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._remove_locked(next(iter(self._entries)))
+
+    def nearest(self, text: str) -> tuple[float, Any] | None:
+        features = ngram_features(text)
+        vector, signature = hashed_vector(features), simhash(features)
+        now = time.monotonic()
+        best: tuple[float, Any] | None = None
+        with self._lock:
+            band_matches: Counter[int] = Counter()
+            for band, key in enumerate(self._band_keys(signature)):
+                band_matches.update(self._buckets[band].get(key, ()))
+            for entry_id, _ in band_matches.most_common(self.max_candidates):
+                entry_vector, _, value, expires_at = self._entries[entry_id]
+                if expires_at <= now:
+                    self._remove_locked(entry_id)
+                    continue
+                similarity = cosine(vector, entry_vector)
+                if best is None or similarity > best[0]:
+                    best = (similarity, value)
+        return best
+
+    def __len__(self) -> int:
+        return len(self._entries)
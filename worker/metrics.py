@@ -0,0 +1,64 @@
+import logging
+import threading
+import time
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_counters: dict[str, float] = {}
+_gauges: dict[str, float] = {}
+_gauge_callbacks: dict[str, Callable[[], float]] = {}
+
+
+def incr(name: str, value: float = 1) -> None:
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def set_gauge(name: str, value: float) -> None:
+    with _lock:
+        _gauges[name] = value
+
+
+def register_gauge(name: str, callback: Callable[[], float]) -> None:
+    with _lock:
+        _gauge_callbacks[name] = callback
+
+
+def observe(name: str, seconds: float) -> None:
+    with _lock:
+        _counters[f"{name}.count"] = _counters.get(f"{name}.count", 0) + 1
+        _counters[f"{name}.seconds"] = _counters.get(f"{name}.seconds", 0) + seconds
+        _gauges[f"{name}.max_seconds"] = max(_gauges.get(f"{name}.max_seconds", 0.0), seconds)
+
+
+def counter(name: str) -> float:
+    with _lock:
+        return _counters.get(name, 0)
+
+
+def snapshot() -> dict[str, float]:
+    with _lock:
+        values = {**_counters, **_gauges}
+        callbacks = dict(_gauge_callbacks)
+    for name, callback in callbacks.items():
+        try:
+            values[name] = callback()
+        except Exception:
+            logger.debug("Gauge callback %s failed", name, exc_info=True)
+    return values
+
+
+def start_reporter(interval_seconds: float) -> None:
+    if interval_seconds <= 0:
+        return
+
+    def _report() -> None:
+        while True:
+            time.sleep(interval_seconds)
+            values = snapshot()
+            if values:
+                logger.info("metrics %s", " ".join(f"{k}={round(v, 6)}" for k, v in sorted(values.items())))
+
+    threading.Thread(target=_report, name="metrics-reporter", daemon=True).start()
@@ -1,138 +1,337 @@
 import json
 import logging
 import random
+from dataclasses import dataclass
+from typing import Any
 
 import db as worker_db
 
 import dedup
-from ai_guard import call_ai_guard
+from ai_guard import ReviewItem, call_ai_guard, call_ai_guard_many
+from db import AiCallRecord, SmsOutcome
 from env import (
     DUPLICATE_WINDOW_SECONDS,
     MAX_RETRY_BEFORE_DLQ,
     MOCK_TIMEOUT_RETRY_PROB,
     OPENROUTER_MODEL,
     REDIS_URL,
+    REVIEW_AI_TIMEOUT_SECONDS,
 )
-from publisher import _publish_to_dlq, _publish_to_main
-from rule_engine import classify
+from publisher import _publish_to_dlq, _publish_to_main, _publish_to_review
+from rule_engine import classify, classify_many
 from sms_sender_mock import send_sms
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-def _process_main_message(body: bytes) -> None:
+@dataclass
+class _Message:
+    sms_event_id: int
+    processing_id: str
+    phone: str
+    body: str
+    retry_count: int
+    segment_count: int
+    last_dlr: str | None
+    payload: dict[str, Any]
+
+
+@dataclass
+class _Plan:
+    outcome: SmsOutcome
+    # Side effects run only after the outcome is committed, so a redelivered or
+    # republished message never races with (and gets overwritten by) this write.
+    republish: dict[str, Any] | None = None
+    to_review: bool = False
+    to_dlq: bool = False
+    mark_id: str | None = None
+    # Set once the provider has been called for this message (its processing id), so the
+    # delivery must never be classified and sent again.
+    sent_id: str | None = None
+
+
+def _parse_sms_event_id(body: bytes, label: str) -> tuple[dict[str, Any], int] | None:
     try:
         payload = json.loads(body)
     except json.JSONDecodeError:
-        logger.warning("Invalid JSON, nacking")
-        return
+        logger.warning("%s invalid JSON", label)
+        return None
 
     sms_event_id = int(payload.get("sms_event_id", 0) or 0)
     if sms_event_id <= 0:
-        logger.warning("Missing sms_event_id in payload")
-        return
+        logger.warning("%s message missing sms_event_id", label)
+        return None
+    return payload, sms_event_id
 
-    sms_row = worker_db.get_sms_by_id(sms_event_id)
-    if not sms_row:
-        logger.warning("sms_event not found id=%s", sms_event_id)
-        return
 
+def _build_message(payload: dict[str, Any], sms_event_id: int, sms_row: dict) -> _Message:
     message_id = sms_row.get("message_id") or ""
-    processing_id = message_id or f"event:{sms_event_id}"
-    phone = payload.get("phone") or sms_row.get("phone") or ""
-    body_text = payload.get("body") or sms_row.get("rewritten_body") or sms_row.get("body") or ""
-    retry_count = int(payload.get("retry_count", sms_row.get("retry_count") or 0))
-    segment_count = int(payload.get("segment_count", sms_row.get("segment_count") or 1))
-    last_dlr = payload.get("last_dlr", sms_row.get("last_dlr"))
+    return _Message(
+        sms_event_id=sms_event_id,
+        processing_id=message_id or f"event:{sms_event_id}",
+        phone=payload.get("phone") or sms_row.get("phone") or "",
+        body=payload.get("body") or sms_row.get("rewritten_body") or sms_row.get("body") or "",
+        retry_count=int(payload.get("retry_count", sms_row.get("retry_count") or 0)),
+        segment_count=int(payload.get("segment_count", sms_row.get("segment_count") or 1)),
+        last_dlr=payload.get("last_dlr", sms_row.get("last_dlr")),
+        payload=payload,
+    )
 
-    result = classify(processing_id, phone, body_text, retry_count, last_dlr, segment_count)
 
-    if result == "SEND":
-        provider_response = send_sms(phone, body_text)
-        provider_message_id = str(provider_response.get("message_id") or "")
-        provider_status = int(provider_response.get("status", 1) or 1)
-        if not provider_message_id:
-            logger.warning("Provider did not return message_id for sms_event_id=%s", sms_event_id)
-            worker_db.update_sms_status_by_id(sms_event_id, "PENDING", retry_count=retry_count + 1)
-            return
-
-        worker_db.assign_provider_message(sms_event_id, provider_message_id, provider_status)
-
-        # Rare timeout simulation for realistic retry testing.
-        if retry_count < MAX_RETRY_BEFORE_DLQ and random.random() < MOCK_TIMEOUT_RETRY_PROB:
-            payload["retry_count"] = retry_count + 1
-            payload["last_dlr"] = "TIMEOUT"
-            _publish_to_main(payload)
-            worker_db.update_sms_status_by_id(
-                sms_event_id,
+def _blocked_plan(msg: _Message, ai_call: AiCallRecord | None = None) -> _Plan:
+    return _Plan(SmsOutcome(msg.sms_event_id, "BLOCKED", ai_call=ai_call), mark_id=msg.processing_id)
+
+
+def _send_plan(msg: _Message) -> _Plan:
+    provider_response = send_sms(msg.phone, msg.body)
+    provider_message_id = str(provider_response.get("message_id") or "")
+    provider_status = int(provider_response.get("status", 1) or 1)
+    if not provider_message_id:
+        logger.warning("Provider did not return message_id for sms_event_id=%s", msg.sms_event_id)
+        return _Plan(
+            SmsOutcome(msg.sms_event_id, "PENDING", retry_count=msg.retry_count + 1), sent_id=msg.processing_id
+        )
+
+    # Rare timeout simulation for realistic retry testing.
+    if msg.retry_count < MAX_RETRY_BEFORE_DLQ and random.random() < MOCK_TIMEOUT_RETRY_PROB:
+        logger.info(
+            "Injected TIMEOUT for retry test sms_event_id=%s message_id=%s retry_count=%s",
+            msg.sms_event_id,
+            provider_message_id,
+            msg.retry_count + 1,
+        )
+        return _Plan(
+            SmsOutcome(
+                msg.sms_event_id,
                 "PENDING",
+                retry_count=msg.retry_count + 1,
                 last_dlr="TIMEOUT",
-                retry_count=retry_count + 1,
-            )
-            logger.info(
-                "Injected TIMEOUT for retry test sms_event_id=%s message_id=%s retry_count=%s",
-                sms_event_id,
-                provider_message_id,
-                retry_count + 1,
-            )
-            return
-
-        worker_db.update_sms_status_by_id(sms_event_id, "SENT", retry_count=retry_count)
-        dedup.mark_message_id(REDIS_URL, message_id=provider_message_id, ttl_seconds=DUPLICATE_WINDOW_SECONDS)
-        return
+                message_id=provider_message_id,
+                provider_status=provider_status,
+            ),
+            republish={**msg.payload, "retry_count": msg.retry_count + 1, "last_dlr": "TIMEOUT"},
+            sent_id=msg.processing_id,
+        )
 
-    if result == "DROP":
-        worker_db.update_sms_status_by_id(sms_event_id, "BLOCKED")
-        dedup.mark_message_id(REDIS_URL, message_id=processing_id, ttl_seconds=DUPLICATE_WINDOW_SECONDS)
-        return
+    return _Plan(
+        SmsOutcome(
+            msg.sms_event_id,
+            "SENT",
+            retry_count=msg.retry_count,
+            message_id=provider_message_id,
+            provider_status=provider_status,
+        ),
+        mark_id=provider_message_id,
+        sent_id=msg.processing_id,
+    )
 
+
+def _review_plan(msg: _Message, decision_data: dict[str, Any], in_tok: int, out_tok: int) -> _Plan:
+    decision = (decision_data.get("decision") or "DROP").upper()
+    reason = decision_data.get("reason") or ""
+    ai_call = AiCallRecord(OPENROUTER_MODEL, in_tok, out_tok, decision, reason)
+    if decision_data.get("rate_limited") or decision != "REWRITE":
+        return _blocked_plan(msg, ai_call)
+
+    rewritten_body = (decision_data.get("body") or "").strip()
+    if not rewritten_body:
+        return _blocked_plan(msg, ai_call)
+
+    return _Plan(
+        SmsOutcome(
+            msg.sms_event_id,
+            "PENDING",
+            retry_count=msg.retry_count,
+            rewritten_body=rewritten_body,
+            segment_count=1,
+            ai_call=ai_call,
+        ),
+        republish={**msg.payload, "body": rewritten_body, "segment_count": 1},
+    )
+
+
+def _route_to_review_plan(msg: _Message) -> _Plan:
+    # The AI call happens on the review consumer pool, off the main queue's threads.
+    return _Plan(SmsOutcome(msg.sms_event_id, "IN_REVIEW"), to_review=True)
+
+
+def _poison_plan(msg: _Message) -> _Plan:
+    return _Plan(SmsOutcome(msg.sms_event_id, "IN_DLQ"), to_dlq=True, mark_id=msg.processing_id)
+
+
+def _run_publishes(plan: _Plan, body: bytes) -> None:
+    if plan.republish is not None:
+        _publish_to_main(plan.republish)
+    if plan.to_review:
+        _publish_to_review(body)
+    if plan.to_dlq:
+        _publish_to_dlq(body)
+
+
+def _run_side_effects(plan: _Plan, body: bytes) -> None:
+    _run_publishes(plan, body)
+    if plan.mark_id:
+        dedup.mark_message_id(REDIS_URL, message_id=plan.mark_id, ttl_seconds=DUPLICATE_WINDOW_SECONDS)
+
+
+def _plan_for_result(msg: _Message, result: str) -> _Plan:
+    if result == "SEND":
+        return _send_plan(msg)
+    if result == "DROP":
+        return _blocked_plan(msg)
     if result == "REVIEW":
-        decision_data, in_tok, out_tok = call_ai_guard(processing_id, phone, body_text, retry_count, last_dlr, segment_count)
-        decision = (decision_data.get("decision") or "DROP").upper()
-        reason = decision_data.get("reason") or ""
-        worker_db.insert_ai_call(sms_event_id, OPENROUTER_MODEL, in_tok, out_tok, decision, reason)
-        if decision_data.get("rate_limited"):
-            worker_db.update_sms_status_by_id(sms_event_id, "BLOCKED")
-            dedup.mark_message_id(REDIS_URL, message_id=processing_id, ttl_seconds=DUPLICATE_WINDOW_SECONDS)
-            return
-
-        worker_db.update_sms_status_by_id(sms_event_id, "IN_REVIEW")
-        if decision == "REWRITE":
-            rewritten_body = (decision_data.get("body") or "").strip()
-            if not rewritten_body:
-                worker_db.update_sms_status_by_id(sms_event_id, "BLOCKED")
-                dedup.mark_message_id(REDIS_URL, message_id=processing_id, ttl_seconds=DUPLICATE_WINDOW_SECONDS)
-                return
-
-            worker_db.update_sms_rewritten_body_by_id(sms_event_id, rewritten_body)
-            worker_db.update_sms_segment_count_by_id(sms_event_id, 1)
-            payload["body"] = rewritten_body
-            payload["segment_count"] = 1
-            _publish_to_main(payload)
-            worker_db.update_sms_status_by_id(sms_event_id, "PENDING", retry_count=retry_count)
-        else:
-            worker_db.update_sms_status_by_id(sms_event_id, "BLOCKED")
-            dedup.mark_message_id(REDIS_URL, message_id=processing_id, ttl_seconds=DUPLICATE_WINDOW_SECONDS)
-        return
+        return _route_to_review_plan(msg)
+    return _poison_plan(msg)
 
-    _publish_to_dlq(body)
-    worker_db.update_sms_status_by_id(sms_event_id, "IN_DLQ")
-    dedup.mark_message_id(REDIS_URL, message_id=processing_id, ttl_seconds=DUPLICATE_WINDOW_SECONDS)
 
+def _plan_main_message(body: bytes) -> _Plan | None:
+    parsed = _parse_sms_event_id(body, "Main")
+    if parsed is None:
+        return None
+    payload, sms_event_id = parsed
 
-def _process_dlq_message(body: bytes) -> None:
+    sms_row = worker_db.get_sms_by_id(sms_event_id)
+    if not sms_row:
+        logger.warning("sms_event not found id=%s", sms_event_id)
+        return None
+
+    msg = _build_message(payload, sms_event_id, sms_row)
+    result = classify(msg.processing_id, msg.phone, msg.body, msg.retry_count, msg.last_dlr, msg.segment_count)
+    return _plan_for_result(msg, result)
+
+
+def _build_messages(bodies: list[bytes], label: str) -> list[_Message | None]:
+    parsed = [_parse_sms_event_id(body, label) for body in bodies]
+    rows = worker_db.get_sms_by_ids([p[1] for p in parsed if p is not None])
+
+    messages: list[_Message | None] = []
+    for p in parsed:
+        if p is None:
+            messages.append(None)
+            continue
+        payload, sms_event_id = p
+        sms_row = rows.get(sms_event_id)
+        if not sms_row:
+            logger.warning("sms_event not found id=%s", sms_event_id)
+            messages.append(None)
+            continue
+        messages.append(_build_message(payload, sms_event_id, sms_row))
+    return messages
+
+
+def _plan_main_messages(bodies: list[bytes]) -> list[_Plan | None | Exception]:
+    # Group variant of _plan_main_message: one row fetch and one dedup call for the whole
+    # group. Per-message failures (provider, AI) are returned in place instead of raised.
+    messages = _build_messages(bodies, "Main")
+    live = [msg for msg in messages if msg is not None]
+    results = iter(classify_many(
+        [(m.processing_id, m.phone, m.body, m.retry_count, m.last_dlr, m.segment_count) for m in live]
+    ))
+
+    plans: list[_Plan | None | Exception] = []
+    for msg in messages:
+        if msg is None:
+            plans.append(None)
+            continue
+        try:
+            plans.append(_plan_for_result(msg, next(results)))
+        except Exception as e:
+            plans.append(e)
+    return plans
+
+
+def _plan_review_message(body: bytes) -> _Plan | None:
+    parsed = _parse_sms_event_id(body, "Review")
+    if parsed is None:
+        return None
+    payload, sms_event_id = parsed
+
+    sms_row = worker_db.get_sms_by_id(sms_event_id)
+    if not sms_row:
+        logger.warning("sms_event not found id=%s", sms_event_id)
+        return None
+
+    msg = _build_message(payload, sms_event_id, sms_row)
+    decision_data, in_tok, out_tok = call_ai_guard(
+        msg.processing_id,
+        msg.phone,
+        msg.body,
+        msg.retry_count,
+        msg.last_dlr,
+        msg.segment_count,
+        timeout=REVIEW_AI_TIMEOUT_SECONDS,
+    )
+    return _review_plan(msg, decision_data, in_tok, out_tok)
+
+
+def _plan_review_messages(bodies: list[bytes]) -> list[_Plan | None | Exception]:
+    # Group variant of _plan_review_message: one row fetch and one AI call for the whole group.
+    # Failures are returned in place, as in _plan_main_messages; if the group call itself fails,
+    # each message is reviewed on its own so one bad item does not fail the rest.
     try:
-        payload = json.loads(body)
-    except json.JSONDecodeError:
-        logger.warning("DLQ invalid JSON")
+        messages = _build_messages(bodies, "Review")
+    except Exception as e:
+        return [e] * len(bodies)
+    live = [msg for msg in messages if msg is not None]
+    try:
+        decisions = iter(call_ai_guard_many(
+            [ReviewItem(m.processing_id, m.phone, m.body, m.retry_count, m.last_dlr, m.segment_count) for m in live],
+            timeout=REVIEW_AI_TIMEOUT_SECONDS,
+        ))
+    except Exception as e:
+        logger.exception("Review group AI call failed; reviewing %s messages one by one: %s", len(live), e)
+        decisions = None
+
+    plans: list[_Plan | None | Exception] = []
+    for msg in messages:
+        if msg is None:
+            plans.append(None)
+            continue
+        try:
+            if decisions is not None:
+                decision_data, in_tok, out_tok = next(decisions)
+            else:
+                decision_data, in_tok, out_tok = call_ai_guard(
+                    msg.processing_id,
+                    msg.phone,
+                    msg.body,
+                    msg.retry_count,
+                    msg.last_dlr,
+                    msg.segment_count,
+                    timeout=REVIEW_AI_TIMEOUT_SECONDS,
+                )
+            plans.append(_review_plan(msg, decision_data, in_tok, out_tok))
+        except Exception as e:
+            plans.append(e)
+    return plans
+
+
+def _dlq_plan(sms_event_id: int) -> _Plan:
+    # DLQ is a quarantine sink. We intentionally do not call AI from DLQ to avoid extra costs.
+    return _Plan(SmsOutcome(sms_event_id, "BLOCKED"), mark_id=f"event:{sms_event_id}")
+
+
+def _process_main_message(body: bytes) -> None:
+    plan = _plan_main_message(body)
+    if plan is None:
         return
+    worker_db.apply_outcome(plan.outcome)
+    _run_side_effects(plan, body)
 
-    sms_event_id = int(payload.get("sms_event_id", 0) or 0)
-    if sms_event_id <= 0:
-        logger.warning("DLQ message missing sms_event_id")
+
+def _process_review_message(body: bytes) -> None:
+    plan = _plan_review_message(body)
+    if plan is None:
         return
+    worker_db.apply_outcome(plan.outcome)
+    _run_side_effects(plan, body)
 
-    # DLQ is a quarantine sink. We intentionally do not call AI from DLQ to avoid extra costs.
-    worker_db.update_sms_status_by_id(sms_event_id, "BLOCKED")
-    dedup.mark_message_id(REDIS_URL, message_id=f"event:{sms_event_id}", ttl_seconds=DUPLICATE_WINDOW_SECONDS)
+
+def _process_dlq_message(body: bytes) -> None:
+    parsed = _parse_sms_event_id(body, "DLQ")
+    if parsed is None:
+        return
+    plan = _dlq_plan(parsed[1])
+    worker_db.apply_outcome(plan.outcome)
+    _run_side_effects(plan, body)
@@ -7,6 +7,7 @@ import pika
 from env import (
     RABBITMQ_DLQ,
     RABBITMQ_MAIN_QUEUE,
+    RABBITMQ_REVIEW_QUEUE,
     RABBITMQ_URL,
 )
 
@@ -16,6 +17,7 @@ _thread_local = threading.local()
 def _ensure_queues(channel: pika.channel.Channel) -> None:
     channel.queue_declare(queue=RABBITMQ_MAIN_QUEUE, durable=True)
     channel.queue_declare(queue=RABBITMQ_DLQ, durable=True)
+    channel.queue_declare(queue=RABBITMQ_REVIEW_QUEUE, durable=True)
 
 
 def _get_publish_channel() -> pika.channel.Channel:
@@ -47,3 +49,12 @@ def _publish_to_dlq(body: bytes) -> None:
         properties=pika.BasicProperties(delivery_mode=2),
     )
 
+
+def _publish_to_review(body: bytes) -> None:
+    ch = _get_publish_channel()
+    ch.basic_publish(
+        exchange="",
+        routing_key=RABBITMQ_REVIEW_QUEUE,
+        body=body,
+        properties=pika.BasicProperties(delivery_mode=2),
+    )
@@ -5,7 +5,9 @@ from dataclasses import dataclass
 from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
 
-import redis
+import redis.asyncio as redis_async
+
+from redis_client import get_breaker, get_redis, get_script
 
 logger = logging.getLogger(__name__)
 
@@ -50,6 +52,19 @@ def _today_key(prefix: str, tz: ZoneInfo) -> str:
     return f"{prefix}:{today}"
 
 
+def _resolve_tz(tz_name: str) -> ZoneInfo:
+    try:
+        return ZoneInfo(tz_name)
+    except Exception:
+        logger.warning("Invalid timezone %r; falling back to UTC", tz_name)
+        return ZoneInfo("UTC")
+
+
+def _limit_result(limit: int, allowed: int | str, used: int | str, day_key: str) -> DailyLimitResult:
+    used_int = int(used)
+    return DailyLimitResult(bool(int(allowed)), used_int, max(0, limit - used_int), day_key=day_key)
+
+
 def try_consume_daily_limit(
     redis_url: str,
     *,
@@ -61,29 +76,51 @@ def try_consume_daily_limit(
     if limit <= 0:
         return DailyLimitResult(False, 0, 0, day_key=_today_key(key_prefix, ZoneInfo("UTC")))
 
-    try:
-        tz = ZoneInfo(tz_name)
-    except Exception:
-        logger.warning("Invalid timezone %r; falling back to UTC", tz_name)
-        tz = ZoneInfo("UTC")
-
+    tz = _resolve_tz(tz_name)
     day_key = _today_key(key_prefix, tz)
     ttl_seconds = _seconds_until_next_midnight(tz)
 
-    client = redis.Redis.from_url(
-        redis_url,
-        decode_responses=True,
-        socket_timeout=socket_timeout_seconds,
-        socket_connect_timeout=socket_timeout_seconds,
-    )
+    # Fails closed like a Redis error, but without waiting out the socket timeout on every call.
+    breaker = get_breaker(redis_url)
+    if not breaker.allow():
+        return DailyLimitResult(False, 0, 0, day_key=day_key)
+    client = get_redis(redis_url, socket_timeout_seconds)
 
     try:
-        allowed, used = client.eval(_LUA_CONSUME_DAILY, 1, day_key, str(limit), str(ttl_seconds))
-        allowed_bool = bool(int(allowed))
-        used_int = int(used)
-        remaining = max(0, limit - used_int)
-        return DailyLimitResult(allowed_bool, used_int, remaining, day_key=day_key)
+        script = get_script(client, _LUA_CONSUME_DAILY)
+        allowed, used = script(keys=[day_key], args=[str(limit), str(ttl_seconds)])
+        breaker.record_success()
+        return _limit_result(limit, allowed, used, day_key)
     except Exception as e:
+        breaker.record_failure()
         logger.exception("Redis rate limit check failed: %s", e)
         return DailyLimitResult(False, 0, 0, day_key=day_key)
 
+
+async def try_consume_daily_limit_async(
+    client: redis_async.Redis,
+    *,
+    redis_url: str,
+    key_prefix: str,
+    limit: int,
+    tz_name: str,
+) -> DailyLimitResult:
+    if limit <= 0:
+        return DailyLimitResult(False, 0, 0, day_key=_today_key(key_prefix, ZoneInfo("UTC")))
+
+    tz = _resolve_tz(tz_name)
+    day_key = _today_key(key_prefix, tz)
+    ttl_seconds = _seconds_until_next_midnight(tz)
+
+    breaker = get_breaker(redis_url)
+    if not breaker.allow():
+        return DailyLimitResult(False, 0, 0, day_key=day_key)
+    try:
+        script = get_script(client, _LUA_CONSUME_DAILY)
+        allowed, used = await script(keys=[day_key], args=[str(limit), str(ttl_seconds)])
+        breaker.record_success()
+        return _limit_result(limit, allowed, used, day_key)
+    except Exception as e:
+        breaker.record_failure()
+        logger.exception("Redis rate limit check failed: %s", e)
+        return DailyLimitResult(False, 0, 0, day_key=day_key)
@@ -0,0 +1,123 @@
+import logging
+import threading
+import time
+from typing import Any
+
+import redis
+
+import metrics
+from env import REDIS_BREAKER_FAILURE_THRESHOLD, REDIS_BREAKER_PROBE_INTERVAL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_clients: dict[tuple[str, float], redis.Redis] = {}
+_scripts: dict[tuple[int, str], Any] = {}
+_breakers: dict[str, "CircuitBreaker"] = {}
+
+
+class CircuitBreaker:
+    # Opens after `failure_threshold` consecutive failures so callers skip Redis (and its socket
+    # timeout) entirely; a background probe PINGs until Redis answers and then closes it.
+    def __init__(self, redis_url: str, failure_threshold: int, probe_interval_seconds: float) -> None:
+        self.redis_url = redis_url
+        self.failure_threshold = max(1, failure_threshold)
+        self.probe_interval_seconds = max(0.1, probe_interval_seconds)
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._open = False
+        self._opened_at = 0.0
+
+    @property
+    def is_open(self) -> bool:
+        return self._open
+
+    def allow(self) -> bool:
+        if self._open:
+            metrics.incr("redis.breaker.short_circuited")
+            return False
+        return True
+
+    def record_success(self) -> None:
+        self._failures = 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._open or self._failures < self.failure_threshold:
+                return
+            self._open = True
+            self._opened_at = time.monotonic()
+        logger.warning("Redis circuit opened after %s consecutive failures (%s)", self.failure_threshold, self.redis_url)
+        metrics.incr("redis.breaker.opened")
+        threading.Thread(target=self._probe, name="redis-breaker-probe", daemon=True).start()
+
+    def _probe(self) -> None:
+        while True:
+            time.sleep(self.probe_interval_seconds)
+            try:
+                get_redis(self.redis_url).ping()
+            except Exception:
+                metrics.incr("redis.breaker.probe_failed")
+                continue
+            with self._lock:
+                self._open = False
+                self._failures = 0
+                open_seconds = time.monotonic() - self._opened_at
+            logger.info("Redis circuit closed after %.1fs (%s)", open_seconds, self.redis_url)
+            metrics.incr("redis.breaker.closed")
+            metrics.observe("redis.breaker.open", open_seconds)
+            return
+
+
+def get_redis(redis_url: str, socket_timeout_seconds: float = 1.0) -> redis.Redis:
+    # One client (and so one connection pool) per process and URL; redis-py pools are thread-safe.
+    key = (redis_url, socket_timeout_seconds)
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                client = redis.Redis.from_url(
+                    redis_url,
+                    decode_responses=True,
+                    socket_timeout=socket_timeout_seconds,
+                    socket_connect_timeout=socket_timeout_seconds,
+                    health_check_interval=30,
+                )
+                _clients[key] = client
+    return client
+
+
+def get_breaker(redis_url: str) -> CircuitBreaker:
+    breaker = _breakers.get(redis_url)
+    if breaker is None:
+        with _lock:
+            breaker = _breakers.get(redis_url)
+            if breaker is None:
+                breaker = CircuitBreaker(redis_url, REDIS_BREAKER_FAILURE_THRESHOLD, REDIS_BREAKER_PROBE_INTERVAL_SECONDS)
+                _breakers[redis_url] = breaker
+                metrics.register_gauge("redis.breaker.is_open", lambda: float(any(b.is_open for b in _breakers.values())))
+    return breaker
+
+
+def get_script(client: Any, source: str) -> Any:
+    # Registered scripts run via EVALSHA and reload themselves on NOSCRIPT; works for
+    # both redis.Redis and redis.asyncio.Redis clients.
+    key = (id(client), source)
+    script = _scripts.get(key)
+    if script is None:
+        with _lock:
+            script = _scripts.get(key)
+            if script is None:
+                script = client.register_script(source)
+                _scripts[key] = script
+    return script
+
+
+def close_clients() -> None:
+    with _lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
+        _scripts.clear()
@@ -1,5 +1,7 @@
 import logging
-from typing import Literal
+from typing import Literal, Sequence
+
+import redis.asyncio as redis_async
 
 import dedup
 from env import (
@@ -15,14 +17,13 @@ logger = logging.getLogger(__name__)
 RuleResult = Literal["SEND", "REVIEW", "POISON", "DROP"]
 
 
-def classify(
+def _static_rule(
     message_id: str,
-    phone: str,
     body: str,
     retry_count: int,
     last_dlr: str | None,
     segment_count: int,
-) -> RuleResult:
+) -> RuleResult | None:
     # Scenario 1: Retry on permanent failure -> internal cost; quarantine to DLQ
     if retry_count >= MAX_RETRY_BEFORE_DLQ:
         logger.info("Rule: POISON (retry_count=%s >= %s)", retry_count, MAX_RETRY_BEFORE_DLQ)
@@ -41,14 +42,11 @@ def classify(
         logger.info("Rule: REVIEW (long body + segments message_id=%s)", message_id)
         return "REVIEW"
 
+    return None
+
+
+def _duplicate_rule(message_id: str, duplicate_message_id: bool, duplicate_phone_body: bool) -> RuleResult:
     # Scenario 4: Duplicate SMS -> internal cost; DROP
-    duplicate_message_id, duplicate_phone_body = dedup.get_duplicate_flags(
-        REDIS_URL,
-        message_id=message_id,
-        phone=phone,
-        body=body,
-        window_seconds=DUPLICATE_WINDOW_SECONDS,
-    )
     if duplicate_message_id:
         logger.info("Rule: DROP (duplicate message_id=%s)", message_id)
         return "DROP"
@@ -57,3 +55,69 @@ def classify(
         return "DROP"
 
     return "SEND"
+
+
+def classify(
+    message_id: str,
+    phone: str,
+    body: str,
+    retry_count: int,
+    last_dlr: str | None,
+    segment_count: int,
+) -> RuleResult:
+    result = _static_rule(message_id, body, retry_count, last_dlr, segment_count)
+    if result is not None:
+        return result
+
+    duplicate_message_id, duplicate_phone_body = dedup.get_duplicate_flags(
+        REDIS_URL,
+        message_id=message_id,
+        phone=phone,
+        body=body,
+        window_seconds=DUPLICATE_WINDOW_SECONDS,
+    )
+    return _duplicate_rule(message_id, duplicate_message_id, duplicate_phone_body)
+
+
+def classify_many(
+    items: Sequence[tuple[str, str, str, int, str | None, int]],
+) -> list[RuleResult]:
+    # Same rules as classify(), but every message that reaches the duplicate check is
+    # resolved in one Redis call; earlier items win intra-batch duplicates.
+    results: list[RuleResult | None] = [
+        _static_rule(message_id, body, retry_count, last_dlr, segment_count)
+        for message_id, _, body, retry_count, last_dlr, segment_count in items
+    ]
+    pending = [i for i, result in enumerate(results) if result is None]
+    flags = dedup.get_duplicate_flags_many(
+        REDIS_URL,
+        [dedup.DedupItem(items[i][0], items[i][1], items[i][2]) for i in pending],
+        window_seconds=DUPLICATE_WINDOW_SECONDS,
+    )
+    for i, (duplicate_message_id, duplicate_phone_body) in zip(pending, flags):
+        results[i] = _duplicate_rule(items[i][0], duplicate_message_id, duplicate_phone_body)
+    return results
+
+
+async def classify_async(
+    redis_client: redis_async.Redis,
+    message_id: str,
+    phone: str,
+    body: str,
+    retry_count: int,
+    last_dlr: str | None,
+    segment_count: int,
+) -> RuleResult:
+    result = _static_rule(message_id, body, retry_count, last_dlr, segment_count)
+    if result is not None:
+        return result
+
+    duplicate_message_id, duplicate_phone_body = await dedup.get_duplicate_flags_async(
+        redis_client,
+        redis_url=REDIS_URL,
+        message_id=message_id,
+        phone=phone,
+        body=body,
+        window_seconds=DUPLICATE_WINDOW_SECONDS,
+    )
+    return _duplicate_rule(message_id, duplicate_message_id, duplicate_phone_body)
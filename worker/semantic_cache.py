@@ -0,0 +1,122 @@
+import re
+import unicodedata
+from difflib import SequenceMatcher
+from typing import Any
+
+import metrics
+from decision_cache import cache_entry
+from dedup import _normalize_body
+from env import (
+    AI_DECISION_CACHE_TTL_SECONDS,
+    MAX_BODY_CHARS,
+    SEMANTIC_CACHE_MAX_ENTRIES,
+    SEMANTIC_CACHE_THRESHOLD,
+)
+from lsh_index import LSHIndex
+
+# Words and numbers such as "Ali", "1,200", "12/05" or "AB-123"; trailing punctuation is not part of a slot.
+_TOKEN_RE = re.compile(r"\w(?:[\w.,:/-]*\w)?", re.UNICODE)
+_DIGIT_RE = re.compile(r"\d")
+_NON_WORD_RE = re.compile(r"[\W_]+", re.UNICODE)
+# A body this close to one already indexed adds nothing but crowds out other templates.
+_DUPLICATE_SIMILARITY = 0.98
+
+_index = LSHIndex(SEMANTIC_CACHE_MAX_ENTRIES, AI_DECISION_CACHE_TTL_SECONDS)
+
+
+def _avoided_ratio() -> float:
+    avoided = metrics.counter("ai_guard.cache.hits") + metrics.counter("ai_guard.semantic.hits")
+    total = avoided + metrics.counter("ai_guard.model_reviews")
+    return avoided / total if total else 0.0
+
+
+metrics.register_gauge("ai_guard.semantic.entries", lambda: float(len(_index)))
+# Share of reviews answered without the model (exact cache + near matches).
+metrics.register_gauge("ai_guard.llm_calls_avoided_ratio", _avoided_ratio)
+
+
+def _index_text(body: str) -> str:
+    # Digits are folded so amounts, codes and dates do not push variants of one template apart.
+    return _DIGIT_RE.sub("0", _normalize_body(body).lower())
+
+
+def _slot_key(text: str) -> str:
+    # "1,200", "1200" and "١٢٠٠" or "Ali" and "ALI" are the same value once case, punctuation
+    # and digit forms are folded.
+    folded = "".join(str(unicodedata.digit(c)) if c.isdigit() else c for c in unicodedata.normalize("NFKC", text))
+    return _NON_WORD_RE.sub("", folded).casefold()
+
+
+def _resubstitute(template: str, reviewed_body: str, body: str) -> str | None:
+    # Maps the slots that differ between the reviewed body and the new one (aligned word by word)
+    # onto the rewrite. Returns None when the rewrite cannot be adapted safely: the new body adds
+    # words the reviewed one did not have, a differing slot is not in the rewrite verbatim (the
+    # model reformatted or dropped it), or an old slot value would survive in any form.
+    old_tokens, new_tokens = _TOKEN_RE.findall(reviewed_body), _TOKEN_RE.findall(body)
+    substitutions: dict[str, str] = {}
+    for tag, i1, i2, j1, j2 in SequenceMatcher(None, old_tokens, new_tokens, autojunk=False).get_opcodes():
+        if tag == "equal":
+            continue
+        if tag == "insert":
+            return None
+        if i2 - i1 == j2 - j1:
+            pairs = list(zip(old_tokens[i1:i2], new_tokens[j1:j2]))
+        else:
+            pairs = [(" ".join(old_tokens[i1:i2]), " ".join(new_tokens[j1:j2]))]
+        for old, new in pairs:
+            if substitutions.setdefault(old, new) != new:
+                return None
+    if not substitutions:
+        return template
+
+    pattern = re.compile(
+        r"(?<!\w)(?:" + "|".join(re.escape(old) for old in sorted(substitutions, key=len, reverse=True)) + r")(?!\w)"
+    )
+    if set(pattern.findall(template)) != set(substitutions):
+        return None
+    result = pattern.sub(lambda m: substitutions[m.group(0)], template)
+
+    stale = {_slot_key(token) for old in substitutions for token in _TOKEN_RE.findall(old)}
+    stale -= {_slot_key(token) for token in new_tokens}
+    result_keys = {_slot_key(token) for token in _TOKEN_RE.findall(result)}
+    # Numbers are also matched across token boundaries, so "1 200" or "1200.00" still count.
+    result_compact = _slot_key(result)
+    for key in stale:
+        if key in result_keys or (_DIGIT_RE.search(key) and key in result_compact):
+            return None
+    if len(result) > MAX_BODY_CHARS:
+        return None
+    return result
+
+
+def lookup(body: str) -> tuple[dict[str, Any], int, int] | None:
+    metrics.incr("ai_guard.semantic.lookups")
+    match = _index.nearest(_index_text(body))
+    if match is None or match[0] < SEMANTIC_CACHE_THRESHOLD:
+        return None
+    similarity, (reviewed_body, entry) = match
+
+    decision_data = {"decision": entry["decision"], "reason": entry["reason"], "near_match": round(similarity, 4)}
+    if entry["decision"] == "REWRITE":
+        rewritten = _resubstitute(entry["body"], reviewed_body, _normalize_body(body))
+        if rewritten is None:
+            metrics.incr("ai_guard.semantic.template_rejected")
+            return None
+        decision_data["body"] = rewritten
+
+    metrics.incr("ai_guard.semantic.hits")
+    metrics.incr("ai_guard.semantic.saved_tokens", entry.get("tokens", 0))
+    return (decision_data, 0, 0)
+
+
+def remember(body: str, result: tuple[dict[str, Any], int, int]) -> None:
+    # Only real model answers are indexed, never near-match or cached reuses of them.
+    entry = cache_entry(*result)
+    if entry is None:
+        return
+    normalized = _normalize_body(body)
+    text = _index_text(normalized)
+    match = _index.nearest(text)
+    if match is not None and match[0] >= _DUPLICATE_SIMILARITY:
+        return
+    _index.add(text, (normalized, entry))
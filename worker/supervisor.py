@@ -0,0 +1,134 @@
+import logging
+import multiprocessing
+import signal
+import threading
+import time
+from dataclasses import dataclass
+from multiprocessing.sharedctypes import SynchronizedArray
+
+from env import (
+    METRICS_LOG_INTERVAL_SECONDS,
+    WORKER_DRAIN_TIMEOUT_SECONDS,
+    WORKER_RESTART_BACKOFF_MAX_SECONDS,
+    WORKER_RESTART_BACKOFF_SECONDS,
+)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# A child that stayed up this long is considered healthy again and its backoff resets.
+_HEALTHY_UPTIME_SECONDS = 60.0
+
+
+@dataclass
+class _Child:
+    slot: int
+    process: multiprocessing.Process | None = None
+    started_at: float = 0.0
+    next_start_at: float = 0.0
+    failures: int = 0
+    restarts: int = 0
+    last_processed: int = 0
+    # Processed by earlier processes in this slot, and their count not yet in a reported rate.
+    processed_before: int = 0
+    unreported: int = 0
+
+
+def _child_main(slot: int, processed: SynchronizedArray) -> None:
+    import metrics
+    from worker import run_worker
+
+    def _publish_processed() -> None:
+        while True:
+            processed[slot] = int(metrics.counter("main.processed"))
+            time.sleep(1.0)
+
+    threading.Thread(target=_publish_processed, name="child-metrics", daemon=True).start()
+    run_worker()
+    processed[slot] = int(metrics.counter("main.processed"))
+
+
+def _start_child(ctx, child: _Child, processed: SynchronizedArray) -> None:
+    # The new process counts from 0, so the previous one's count is banked for the slot total.
+    count = processed[child.slot]
+    child.processed_before += count
+    child.unreported += count - child.last_processed
+    processed[child.slot] = 0
+    child.last_processed = 0
+    proc = ctx.Process(target=_child_main, args=(child.slot, processed), name=f"worker-{child.slot}")
+    proc.start()
+    child.process = proc
+    child.started_at = time.monotonic()
+    logger.info("Started worker-%s pid=%s", child.slot, proc.pid)
+
+
+def _report(children: list[_Child], processed: SynchronizedArray, elapsed: float) -> None:
+    parts = []
+    total_rate = 0.0
+    for child in children:
+        count = processed[child.slot]
+        delta = count - child.last_processed + child.unreported
+        rate = delta / elapsed if elapsed > 0 else 0.0
+        child.last_processed = count
+        child.unreported = 0
+        total_rate += rate
+        total = child.processed_before + count
+        alive = bool(child.process and child.process.is_alive())
+        parts.append(f"worker-{child.slot}={rate:.1f}/s(total={total},restarts={child.restarts},alive={alive})")
+    logger.info("throughput %.1f msg/s %s", total_rate, " ".join(parts))
+
+
+def run_supervisor(processes: int) -> None:
+    ctx = multiprocessing.get_context("spawn")
+    processed = ctx.Array("q", processes, lock=False)
+    children = [_Child(slot=i) for i in range(processes)]
+    stopping = threading.Event()
+
+    def _on_signal(signum, frame) -> None:
+        logger.info("Supervisor received signal %s; draining workers", signum)
+        stopping.set()
+
+    signal.signal(signal.SIGTERM, _on_signal)
+    signal.signal(signal.SIGINT, _on_signal)
+
+    last_report = time.monotonic()
+    while not stopping.is_set():
+        now = time.monotonic()
+        for child in children:
+            proc = child.process
+            if proc is not None and proc.is_alive():
+                continue
+            if proc is not None:
+                uptime = now - child.started_at
+                child.failures = 0 if uptime >= _HEALTHY_UPTIME_SECONDS else child.failures + 1
+                backoff = min(
+                    WORKER_RESTART_BACKOFF_MAX_SECONDS,
+                    WORKER_RESTART_BACKOFF_SECONDS * (2 ** max(0, child.failures - 1)),
+                )
+                logger.warning(
+                    "worker-%s pid=%s exited with code %s after %.1fs; restarting in %.1fs",
+                    child.slot, proc.pid, proc.exitcode, uptime, backoff,
+                )
+                child.process = None
+                child.restarts += 1
+                child.next_start_at = now + backoff
+            if now >= child.next_start_at:
+                _start_child(ctx, child, processed)
+
+        if METRICS_LOG_INTERVAL_SECONDS > 0 and now - last_report >= METRICS_LOG_INTERVAL_SECONDS:
+            _report(children, processed, now - last_report)
+            last_report = now
+        stopping.wait(0.5)
+
+    alive = [c.process for c in children if c.process is not None and c.process.is_alive()]
+    for proc in alive:
+        proc.terminate()
+    deadline = time.monotonic() + WORKER_DRAIN_TIMEOUT_SECONDS
+    for proc in alive:
+        proc.join(max(0.0, deadline - time.monotonic()))
+    for proc in alive:
+        if proc.is_alive():
+            logger.warning("worker pid=%s did not drain in time; killing", proc.pid)
+            proc.kill()
+            proc.join()
+    logger.info("Supervisor stopped")
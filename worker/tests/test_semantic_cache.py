@@ -0,0 +1,48 @@
+from semantic_cache import _resubstitute
+
+
+def test_swaps_slots_that_appear_verbatim():
+    assert (
+        _resubstitute(
+            "Ali, your balance is 1,200 today",
+            "Dear Ali, your balance is 1,200",
+            "Dear Sara, your balance is 3,400",
+        )
+        == "Sara, your balance is 3,400 today"
+    )
+
+
+def test_identical_body_reuses_rewrite():
+    assert _resubstitute("Pay 1200 today", "Please pay 1200", "Please pay 1200") == "Pay 1200 today"
+
+
+def test_rejects_reformatted_amount():
+    # "1,200" became "1200" in the rewrite, so it cannot be swapped and would leak.
+    assert (
+        _resubstitute(
+            "Ali: balance 1200 today",
+            "Dear Ali, your balance is 1,200",
+            "Dear Sara, your balance is 3,400",
+        )
+        is None
+    )
+
+
+def test_rejects_recased_name():
+    assert _resubstitute("ALI: pay 1200", "Dear Ali, please pay 1200", "Dear Sara, please pay 1200") is None
+
+
+def test_rejects_amount_split_across_tokens():
+    assert _resubstitute("Ali owes 1 200.00", "Ali owes 1200", "Ali owes 3400") is None
+
+
+def test_rejects_dropped_slot():
+    # The rewrite omits the name, so nothing shows the slot was handled; not reused.
+    assert (
+        _resubstitute("Your balance is 1,200", "Dear Ali, your balance is 1,200", "Dear Sara, your balance is 1,200")
+        is None
+    )
+
+
+def test_rejects_added_words():
+    assert _resubstitute("Pay 1200", "Please pay 1200", "Please pay 1200 to Ali now") is None
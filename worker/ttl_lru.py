@@ -0,0 +1,46 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any
+
+
+class TTLLRU:
+    def __init__(self, max_entries: int) -> None:
+        self.max_entries = max(1, max_entries)
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, tuple[Any, float]] = OrderedDict()
+
+    def _get_locked(self, key: str, now: float) -> Any | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[1] <= now:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def _set_locked(self, key: str, value: Any, ttl_seconds: float, now: float) -> None:
+        self._entries[key] = (value, now + ttl_seconds)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, key: str) -> Any | None:
+        with self._lock:
+            return self._get_locked(key, time.monotonic())
+
+    def set(self, key: str, value: Any, ttl_seconds: float) -> None:
+        with self._lock:
+            self._set_locked(key, value, ttl_seconds, time.monotonic())
+
+    def setdefault(self, key: str, value: Any, ttl_seconds: float) -> Any:
+        # Returns the live value if present (refreshing its TTL), otherwise stores `value`.
+        with self._lock:
+            now = time.monotonic()
+            existing = self._get_locked(key, now)
+            self._set_locked(key, value if existing is None else existing, ttl_seconds, now)
+            return existing if existing is not None else value
+
+    def __len__(self) -> int:
+        return len(self._entries)
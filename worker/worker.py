@@ -1,19 +1,71 @@
 import logging
+import signal
+import sys
 import threading
-from consumer import _run_main_consumer, _run_dlq_consumer
+
+import db as worker_db
+import http_client
+import metrics
+import redis_client
+from consumer import _run_main_consumer, _run_review_consumer, _run_dlq_consumer, is_stopping, request_stop
+from env import METRICS_LOG_INTERVAL_SECONDS, WORKER_PROCESSES, WORKER_RUNTIME
 
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+def run_consumers() -> None:
+    def _on_signal(signum, frame) -> None:
+        logger.info("Received signal %s; draining consumers", signum)
+        request_stop()
+
+    signal.signal(signal.SIGTERM, _on_signal)
+    signal.signal(signal.SIGINT, _on_signal)
+    metrics.start_reporter(METRICS_LOG_INTERVAL_SECONDS)
+
+    threads = [
+        threading.Thread(target=_run_main_consumer, name="main-consumer", daemon=True),
+        threading.Thread(target=_run_review_consumer, name="review-consumer", daemon=True),
+        threading.Thread(target=_run_dlq_consumer, name="dlq-consumer", daemon=True),
+    ]
+    for t in threads:
+        t.start()
+
+    while all(t.is_alive() for t in threads):
+        threads[0].join(timeout=1.0)
+
+    failed = not is_stopping()
+    if failed:
+        # One consumer died on its own (e.g. lost connection); stop the rest so the
+        # process exits and can be restarted instead of running half-functional.
+        logger.error("A consumer thread exited unexpectedly; stopping worker")
+        request_stop()
+    for t in threads:
+        t.join()
+    worker_db.close_pool()
+    redis_client.close_clients()
+    http_client.close_http_client()
+    if failed:
+        sys.exit(1)
+
+
+def run_worker() -> None:
+    if WORKER_RUNTIME == "asyncio":
+        from async_worker import run_async_consumers
+
+        run_async_consumers()
+    else:
+        run_consumers()
+
+
 def main() -> None:
-    t1 = threading.Thread(target=_run_main_consumer, daemon=True)
-    t2 = threading.Thread(target=_run_dlq_consumer, daemon=True)
-    t1.start()
-    t2.start()
-    t1.join()
-    t2.join()
+    if WORKER_PROCESSES > 1:
+        from supervisor import run_supervisor
+
+        run_supervisor(WORKER_PROCESSES)
+    else:
+        run_worker()
 
 
 if __name__ == "__main__":